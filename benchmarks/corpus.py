@@ -0,0 +1,212 @@
+"""
+Synthetic corpus for the offline benchmarks: PDF and DOCX documents laid out like the originaldocuments
+container, and Document Intelligence analyze results the fake Document Intelligence client replays.
+
+Run from the repository root to write a corpus to disk, i.e. to benchmark the same corpus across commits:
+    python -m benchmarks.corpus --output benchmark-corpus --pdf-documents 4 --pdf-pages 50 --docx-documents 2
+
+The corpus folder has the documents under originaldocuments/<theme>/<subtheme>/ and the analyze results,
+as returned by AnalyzeResult.as_dict(), under recordings/. Results recorded from the real service can be
+dropped in recordings/ next to the synthetic ones.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import zipfile
+from typing import Dict, List, Tuple
+
+# A handler on the root logger keeps Logger from exporting to Application Insights
+logging.basicConfig(level=logging.WARNING)
+
+from PyPDF2 import PageObject, PdfWriter  # noqa: E402
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject  # noqa: E402
+from benchmarks.page_to_text_benchmark import synthetic_result  # noqa: E402
+
+ORIGINAL_DOCUMENTS_FOLDER = "originaldocuments"
+RECORDINGS_FOLDER = "recordings"
+WORDS = ["receita", "liquida", "EBITDA", "trimestre", "resultado", "mercado", "dividendos", "B3", "2024", "R$", "1.234,56", "variacao"]
+LINE_CHARACTERS = 90
+
+
+def synthetic_words(random_generator: random.Random, count: int) -> str:
+    return " ".join(random_generator.choice(WORDS) for _ in range(count))
+
+
+def synthetic_pdf(pages: int, words_per_page: int, image_bytes: int, seed: int) -> bytes:
+    """
+    PDF with pages of text and, when image_bytes is given, an incompressible grayscale image per page
+    of about that size, like the scanned pages of real documents.
+    """
+    random_generator = random.Random(seed)
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for _ in range(pages):
+        page = PageObject.create_blank_page(writer, 612, 792)
+        resources = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        operations = []
+        if image_bytes > 0:
+            side = max(int(image_bytes ** 0.5), 1)
+            image = DecodedStreamObject()
+            image.set_data(random_generator.randbytes(side * side))
+            image.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Image"),
+                NameObject("/Width"): NumberObject(side),
+                NameObject("/Height"): NumberObject(side),
+                NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+                NameObject("/BitsPerComponent"): NumberObject(8),
+            })
+            resources[NameObject("/XObject")] = DictionaryObject({NameObject("/Im1"): writer._add_object(image)})
+            operations.append("q 512 0 0 300 50 50 cm /Im1 Do Q")
+
+        text = synthetic_words(random_generator, words_per_page)
+        lines = [text[i:i + LINE_CHARACTERS] for i in range(0, len(text), LINE_CHARACTERS)]
+        operations.append("BT /F1 9 Tf 11 TL 50 750 Td")
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            operations.append(f"({escaped}) '")
+        operations.append("ET")
+
+        content = DecodedStreamObject()
+        content.set_data("\n".join(operations).encode("latin-1"))
+        page[NameObject("/Resources")] = resources
+        page[NameObject("/Contents")] = writer._add_object(content)
+        writer.add_page(page)
+
+    stream = io.BytesIO()
+    writer.write(stream)
+    return stream.getvalue()
+
+
+def synthetic_docx(pages: int, words_per_page: int, paragraphs_per_page: int, seed: int) -> bytes:
+    """
+    Minimal DOCX with paragraphs of text and an explicit page break after every page.
+    """
+    random_generator = random.Random(seed)
+    body = []
+    for page_number in range(pages):
+        for _ in range(paragraphs_per_page):
+            body.append(f"<w:p><w:r><w:t>{synthetic_words(random_generator, max(words_per_page // paragraphs_per_page, 1))}</w:t></w:r></w:p>")
+        if page_number < pages - 1:
+            body.append('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+
+    def part(name: str) -> zipfile.ZipInfo:
+        # Fixed timestamps, the same seed gives the same bytes and so the same replayed analyze results
+        info = zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    stream = io.BytesIO()
+    with zipfile.ZipFile(stream, "w") as docx:
+        docx.writestr(part("[Content_Types].xml"),
+                      '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                      '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                      '<Default Extension="xml" ContentType="application/xml"/>'
+                      '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                      '</Types>')
+        docx.writestr(part("_rels/.rels"),
+                      '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                      '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+                      '</Relationships>')
+        docx.writestr(part("word/document.xml"),
+                      '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                      + "".join(body) + '</w:body></w:document>')
+    return stream.getvalue()
+
+
+def synthetic_recordings(pages: int, seed: int) -> List[dict]:
+    """
+    Analyze results with pages of different table density, from text only pages to table heavy ones.
+    """
+    return [
+        synthetic_result(pages, tables_per_page=0, rows=0, columns=0, text_length=3000, seed=seed).as_dict(),
+        synthetic_result(pages, tables_per_page=1, rows=12, columns=5, text_length=1500, seed=seed + 1).as_dict(),
+        synthetic_result(pages, tables_per_page=3, rows=25, columns=8, text_length=600, seed=seed + 2).as_dict(),
+    ]
+
+
+def generate_corpus(pdf_documents: int, pdf_pages: int, docx_documents: int, docx_pages: int, words_per_page: int,
+                    image_bytes: int, seed: int, theme: str = "benchmark", subtheme: str = "synthetic") -> Dict[str, bytes]:
+    """
+    Returns the documents by their path in the originaldocuments container, <theme>/<subtheme>/<file name>.
+    """
+    documents = {}
+    for i in range(pdf_documents):
+        documents[f"{theme}/{subtheme}/Report-{i + 1}.pdf"] = synthetic_pdf(pdf_pages, words_per_page, image_bytes, seed + i)
+    for i in range(docx_documents):
+        documents[f"{theme}/{subtheme}/Manual-{i + 1}.docx"] = synthetic_docx(docx_pages, words_per_page, 8, seed + pdf_documents + i)
+    return documents
+
+
+def write_corpus(directory: str, documents: Dict[str, bytes], recordings: List[dict]):
+    for blob_name, content in documents.items():
+        path = os.path.join(directory, ORIGINAL_DOCUMENTS_FOLDER, *blob_name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as document_file:
+            document_file.write(content)
+    os.makedirs(os.path.join(directory, RECORDINGS_FOLDER), exist_ok=True)
+    for i, recording in enumerate(recordings):
+        with open(os.path.join(directory, RECORDINGS_FOLDER, f"synthetic-{i + 1}.json"), "w", encoding="utf-8") as recording_file:
+            json.dump(recording, recording_file)
+
+
+def read_corpus(directory: str) -> Tuple[Dict[str, bytes], List[dict]]:
+    documents = {}
+    documents_directory = os.path.join(directory, ORIGINAL_DOCUMENTS_FOLDER)
+    for folder, _, file_names in os.walk(documents_directory):
+        for file_name in file_names:
+            path = os.path.join(folder, file_name)
+            with open(path, "rb") as document_file:
+                documents[os.path.relpath(path, documents_directory).replace(os.sep, "/")] = document_file.read()
+
+    recordings = []
+    recordings_directory = os.path.join(directory, RECORDINGS_FOLDER)
+    if os.path.isdir(recordings_directory):
+        for file_name in sorted(os.listdir(recordings_directory)):
+            if file_name.endswith(".json"):
+                with open(os.path.join(recordings_directory, file_name), encoding="utf-8") as recording_file:
+                    recordings.append(json.load(recording_file))
+    return documents, recordings
+
+
+def add_corpus_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--pdf-documents", type=int, default=4)
+    parser.add_argument("--pdf-pages", type=int, default=50)
+    parser.add_argument("--docx-documents", type=int, default=2)
+    parser.add_argument("--docx-pages", type=int, default=20)
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--image-kilobytes", type=int, default=0, help="Size of the image added to every PDF page, 0 for text only pages")
+    parser.add_argument("--recorded-pages", type=int, default=10, help="Pages of every synthetic analyze result")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def corpus_from_arguments(args) -> Tuple[Dict[str, bytes], List[dict]]:
+    documents = generate_corpus(args.pdf_documents, args.pdf_pages, args.docx_documents, args.docx_pages,
+                                args.words_per_page, args.image_kilobytes * 1024, args.seed)
+    return documents, synthetic_recordings(args.recorded_pages, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="Folder the corpus is written to")
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    documents, recordings = corpus_from_arguments(args)
+    write_corpus(args.output, documents, recordings)
+    print(f"{len(documents)} documents of {sum(len(content) for content in documents.values())} bytes and "
+          f"{len(recordings)} analyze results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,662 @@
+"""
+In-process stand-ins for the Azure services the processor calls, used by the offline benchmarks.
+
+The fakes replace the SDK clients held by the real services (StorageContainerService, AzureSearchEmbedService)
+so the code of the processor runs unchanged, and only the network calls are simulated. Every call waits for
+the latency of its service profile and is counted by operation, with the units it carried (bytes, pages,
+inputs or documents) and the seconds it took. LocalQueue stands in for the queue of ActionReceivedFunc, with
+the visibility and dequeue count semantics of Azure Queue Storage.
+"""
+import asyncio
+import copy
+import hashlib
+import io
+import json
+import random
+import re
+import time
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict, List
+from azure.ai.documentintelligence.models import AnalyzeResult
+from azure.core.credentials import AccessToken
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from PyPDF2 import PdfReader
+from models.IndexStatus import IndexStatus
+from repositories.CosmosRepository import CosmosRepository
+from services.Logger import Logger
+
+FAKE_ENDPOINTS = {
+    'AZURE_STORAGE_BLOB_ENDPOINT': "https://benchmark.blob.core.invalid/",
+    'AZURE_SEARCH_SERVICE_ENDPOINT': "https://benchmark.search.invalid/",
+    'AZURE_OPENAI_SERVICE_ENDPOINT': "https://benchmark.openai.invalid/",
+    'AZURE_FORM_RECOGNIZER_SERVICE_ENDPOINT': "https://benchmark.cognitiveservices.invalid/",
+    'EMBEDDING_DEPLOYMENT_NAME': "benchmark-embedding",
+    'KEY_VAULT_NAME_ENDPOINT': "https://benchmark.vault.invalid/",
+    'KEY_VAULT_COSMOS_DB_CONN_NAME': "benchmark",
+    'DATABASE_NAME': "benchmark",
+    'AzureWebJobsStorage': "https://benchmark.queue.core.invalid/",
+}
+PDF_PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+@dataclass
+class ServiceProfile:
+    """
+    Simulated behaviour of a service: every call takes latency_seconds plus seconds_per_unit for every
+    unit it carries, spread by jitter (0.1 is +-10%), and fails with failure_rate probability.
+    """
+    latency_seconds: float = 0.0
+    seconds_per_unit: float = 0.0
+    jitter: float = 0.0
+    failure_rate: float = 0.0
+
+
+@dataclass
+class OperationStats:
+    calls: int = 0
+    failures: int = 0
+    units: float = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+@dataclass
+class ServiceCalls:
+    """
+    Calls made to the fakes by operation, i.e. "blob.upload" or "openai.embeddings".
+    """
+    profiles: Dict[str, ServiceProfile]
+    latency_scale: float = 1.0
+    seed: int = 0
+    operations: Dict[str, OperationStats] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.random_generator = random.Random(self.seed)
+
+    async def call(self, service: str, operation: str, units: float = 1) -> bool:
+        """
+        Waits for the simulated latency of the call and returns False when the call is simulated to fail.
+        """
+        profile = self.profiles.get(service, ServiceProfile())
+        latency = (profile.latency_seconds + profile.seconds_per_unit * units) * self.latency_scale
+        if profile.jitter > 0:
+            latency *= 1 + profile.jitter * (2 * self.random_generator.random() - 1)
+        failed = profile.failure_rate > 0 and self.random_generator.random() < profile.failure_rate
+
+        started = time.perf_counter()
+        await asyncio.sleep(max(latency, 0))
+        elapsed = time.perf_counter() - started
+
+        stats = self.operations.setdefault(f"{service}.{operation}", OperationStats())
+        stats.calls += 1
+        stats.failures += 1 if failed else 0
+        stats.units += units
+        stats.seconds += elapsed
+        stats.max_seconds = max(stats.max_seconds, elapsed)
+        return not failed
+
+    def failed(self, service: str) -> bool:
+        # Per item failures of calls that succeed as a whole, i.e. documents of an indexing request
+        failure_rate = self.profiles.get(service, ServiceProfile()).failure_rate
+        return failure_rate > 0 and self.random_generator.random() < failure_rate
+
+
+def service_error(service: str, operation: str) -> HttpResponseError:
+    error = HttpResponseError(message=f"Simulated failure of {service}.{operation}")
+    error.status_code = 503
+    return error
+
+
+class FakeCredential:
+    async def get_token(self, *scopes, **kwargs) -> AccessToken:
+        return AccessToken("benchmark", int(time.time()) + 3600)
+
+    async def close(self):
+        pass
+
+
+class FakeBlob:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeBlobResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class FakeBlobDownloader:
+    def __init__(self, content: bytes, encoding: str = None):
+        self.content = content
+        self.encoding = encoding
+        self.size = len(content)
+
+    async def readinto(self, stream) -> int:
+        stream.write(self.content)
+        return self.size
+
+    async def readall(self):
+        return self.content.decode(self.encoding) if self.encoding is not None else self.content
+
+
+class FakeContainerClient:
+    def __init__(self, service_client: "FakeBlobServiceClient", container_name: str):
+        self.service_client = service_client
+        self.container_name = container_name
+        self.blobs: Dict[str, bytes] = service_client.containers.setdefault(container_name, {})
+
+    async def upload_blob(self, name: str, data, content_settings=None, overwrite: bool = False, **kwargs):
+        if hasattr(data, "read"):
+            data = data.read()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not await self.service_client.calls.call("blob", "upload", len(data)):
+            raise service_error("blob", "upload")
+        self.blobs[name] = bytes(data)
+
+    async def download_blob(self, name: str, encoding: str = None, **kwargs) -> FakeBlobDownloader:
+        content = self.blobs.get(name)
+        if content is None:
+            await self.service_client.calls.call("blob", "download")
+            raise ResourceNotFoundError(message=f"Blob {name} not found in container {self.container_name}.")
+        if not await self.service_client.calls.call("blob", "download", len(content)):
+            raise service_error("blob", "download")
+        return FakeBlobDownloader(content, encoding)
+
+    async def list_blobs(self, name_starts_with: str = None, **kwargs):
+        await self.service_client.calls.call("blob", "list")
+        for name in sorted(self.blobs):
+            if name_starts_with is None or name.startswith(name_starts_with):
+                yield FakeBlob(name)
+
+    async def delete_blob(self, name: str, **kwargs):
+        await self.service_client.calls.call("blob", "delete")
+        if self.blobs.pop(name, None) is None:
+            raise ResourceNotFoundError(message=f"Blob {name} not found in container {self.container_name}.")
+
+    async def delete_blobs(self, *names, raise_on_any_failure: bool = True, **kwargs):
+        await self.service_client.calls.call("blob", "delete_batch", len(names))
+        responses = [FakeBlobResponse(202 if self.blobs.pop(name, None) is not None else 404) for name in names]
+
+        async def iterate():
+            for response in responses:
+                yield response
+        return iterate()
+
+    async def create_container(self, **kwargs):
+        pass
+
+
+class FakeBlobClient:
+    def __init__(self, container_client: FakeContainerClient, blob_name: str):
+        self.container_client = container_client
+        self.blob_name = blob_name
+
+    async def download_blob(self, encoding: str = None, **kwargs) -> FakeBlobDownloader:
+        return await self.container_client.download_blob(self.blob_name, encoding=encoding)
+
+    async def upload_blob(self, data, overwrite: bool = False, **kwargs):
+        await self.container_client.upload_blob(self.blob_name, data, overwrite=overwrite)
+
+
+class FakeBlobServiceClient:
+    """
+    Containers kept in memory, by container name and blob name.
+    """
+
+    def __init__(self, calls: ServiceCalls):
+        self.calls = calls
+        self.containers: Dict[str, Dict[str, bytes]] = {}
+
+    def get_container_client(self, container: str) -> FakeContainerClient:
+        return FakeContainerClient(self, container)
+
+    def get_blob_client(self, container: str, blob: str) -> FakeBlobClient:
+        return FakeBlobClient(self.get_container_client(container), blob)
+
+    async def close(self):
+        pass
+
+
+class RecordedAnalyzeResults:
+    """
+    Replays recorded analyze results. The recordings are cut into single pages, and the result of a request
+    is made of as many recorded pages as the request has, picked by a hash of the request so the same
+    document always gets the same text.
+    """
+
+    def __init__(self, recordings: List[dict]):
+        self.pages = []
+        for recording in recordings:
+            self.pages += self.split_pages(recording)
+        if len(self.pages) == 0:
+            raise ValueError("No recorded analyze result pages to replay.")
+
+    @classmethod
+    def split_pages(cls, recording: dict) -> List[tuple]:
+        content = recording.get("content", "")
+        pages = []
+        for page in recording.get("pages", []):
+            spans = page.get("spans") or [{"offset": 0, "length": len(content)}]
+            start = min(span["offset"] for span in spans)
+            end = max(span["offset"] + span["length"] for span in spans)
+            tables = [table for table in recording.get("tables") or []
+                      if any(region.get("pageNumber") == page.get("pageNumber") for region in table.get("boundingRegions") or [])]
+            pages.append((content[start:end], cls.shift(page, -start), [cls.shift(table, -start) for table in tables]))
+        return pages
+
+    @classmethod
+    def shift(cls, element, delta: int, page_number: int = None):
+        """
+        Copy of the element with the offsets of its spans moved by delta and, when given, the page number
+        of its bounding regions replaced.
+        """
+        if isinstance(element, list):
+            return [cls.shift(item, delta, page_number) for item in element]
+        if not isinstance(element, dict):
+            return element
+        shifted = {}
+        for key, value in element.items():
+            if key == "offset" and "length" in element:
+                shifted[key] = value + delta
+            elif key == "pageNumber" and page_number is not None:
+                shifted[key] = page_number
+            else:
+                shifted[key] = cls.shift(value, delta, page_number)
+        return shifted
+
+    def replay(self, request: bytes, page_numbers: List[int]) -> AnalyzeResult:
+        seed = int(hashlib.sha256(request).hexdigest()[:8], 16)
+        content = []
+        content_length = 0
+        pages = []
+        tables = []
+        for k, page_number in enumerate(page_numbers):
+            page_content, page, page_tables = self.pages[(seed + k) % len(self.pages)]
+            pages.append(self.shift(page, content_length, page_number))
+            tables += [self.shift(table, content_length, page_number) for table in page_tables]
+            content.append(page_content)
+            content_length += len(page_content)
+        return AnalyzeResult({"apiVersion": "2024-02-29-preview", "modelId": "prebuilt-layout", "stringIndexType": "textElements",
+                              "content": "".join(content), "pages": pages, "tables": tables})
+
+
+class FakePoller:
+    def __init__(self, result: AnalyzeResult):
+        self._result = result
+
+    async def result(self) -> AnalyzeResult:
+        return self._result
+
+
+class FakeDocumentIntelligenceClient:
+    def __init__(self, calls: ServiceCalls, recordings: RecordedAnalyzeResults):
+        self.calls = calls
+        self.recordings = recordings
+
+    async def begin_analyze_document(self, model_id: str, analyze_request, content_type: str, pages: str = None, **kwargs) -> FakePoller:
+        request = analyze_request.read() if hasattr(analyze_request, "read") else bytes(analyze_request)
+        page_numbers = self.page_numbers(request, content_type, pages)
+        if not await self.calls.call("document_intelligence", "analyze", len(page_numbers)):
+            raise service_error("document_intelligence", "analyze")
+        return FakePoller(self.recordings.replay(request, page_numbers))
+
+    @staticmethod
+    def page_numbers(request: bytes, content_type: str, pages: str = None) -> List[int]:
+        if content_type == "application/pdf":
+            # Counting the page objects is much cheaper than parsing the document, which would slow the event loop
+            pages_count = len(PDF_PAGE_OBJECT.findall(request)) or len(PdfReader(io.BytesIO(request)).pages)
+        else:
+            # DOCX documents have as many pages as explicit page breaks plus one
+            with zipfile.ZipFile(io.BytesIO(request)) as docx:
+                pages_count = docx.read("word/document.xml").count(b'w:type="page"') + 1
+        if pages is None:
+            return list(range(1, pages_count + 1))
+        first_page, _, last_page = pages.partition("-")
+        return list(range(int(first_page), min(int(last_page or first_page), pages_count) + 1))
+
+    async def close(self):
+        pass
+
+
+class FakeEmbeddingItem:
+    def __init__(self, index: int, embedding: List[float]):
+        self.index = index
+        self.embedding = embedding
+
+
+class FakeEmbeddingUsage:
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+
+class FakeEmbeddingResponse:
+    def __init__(self, data: List[FakeEmbeddingItem], total_tokens: int):
+        self.data = data
+        self.usage = FakeEmbeddingUsage(total_tokens)
+
+
+class FakeEmbeddings:
+    # A few shared vectors, building a new one per input would add CPU time the real service doesn't cost the worker
+    VECTOR_VARIANTS = 64
+
+    def __init__(self, calls: ServiceCalls, dimensions: int):
+        self.calls = calls
+        random_generator = random.Random(dimensions)
+        self.vectors = [[random_generator.uniform(-0.1, 0.1) for _ in range(dimensions)] for _ in range(self.VECTOR_VARIANTS)]
+
+    async def create(self, model: str, input: List[str], **kwargs) -> FakeEmbeddingResponse:
+        if not await self.calls.call("openai", "embeddings", len(input)):
+            raise service_error("openai", "embeddings")
+        data = [FakeEmbeddingItem(i, self.vectors[hash(text) % self.VECTOR_VARIANTS]) for i, text in enumerate(input)]
+        return FakeEmbeddingResponse(data, sum(max(1, len(text) // 4) for text in input))
+
+
+class FakeOpenAIClient:
+    def __init__(self, calls: ServiceCalls, dimensions: int):
+        self.embeddings = FakeEmbeddings(calls, dimensions)
+
+    async def close(self):
+        pass
+
+
+class FakeIndexingResult:
+    def __init__(self, key: str, succeeded: bool, status_code: int, error_message: str = None):
+        self.key = key
+        self.succeeded = succeeded
+        self.status_code = status_code
+        self.error_message = error_message
+
+
+class FakeSearchIndex:
+    def __init__(self):
+        # Only the keys are kept, the vectors would make the fake the biggest user of memory
+        self.keys = set()
+
+
+class FakeSearchClient:
+    def __init__(self, calls: ServiceCalls, index: FakeSearchIndex):
+        self.calls = calls
+        self.index = index
+
+    async def upload_documents(self, documents: List[dict], **kwargs) -> List[FakeIndexingResult]:
+        if not await self.calls.call("search", "upload", len(documents)):
+            raise service_error("search", "upload")
+        results = []
+        for document in documents:
+            # Throttled documents, the uploader retries them on their own
+            if self.calls.failed("search_document"):
+                results.append(FakeIndexingResult(document["id"], False, 503, "Simulated throttling"))
+                continue
+            self.index.keys.add(document["id"])
+            results.append(FakeIndexingResult(document["id"], True, 201))
+        return results
+
+    async def delete_documents(self, documents: List[dict], **kwargs) -> List[FakeIndexingResult]:
+        await self.calls.call("search", "delete", len(documents))
+        results = []
+        for document in documents:
+            found = document["id"] in self.index.keys
+            self.index.keys.discard(document["id"])
+            results.append(FakeIndexingResult(document["id"], found, 200 if found else 404))
+        return results
+
+    async def close(self):
+        pass
+
+
+class FakeSearchIndexClient:
+    def __init__(self, calls: ServiceCalls, indexes: Dict[str, FakeSearchIndex]):
+        self.calls = calls
+        self.indexes = indexes
+
+    async def get_index(self, name: str):
+        await self.calls.call("search", "get_index")
+        if name not in self.indexes:
+            raise ResourceNotFoundError(message=f"Index {name} not found.")
+        return name
+
+    async def create_index(self, index):
+        await self.calls.call("search", "create_index")
+        self.indexes.setdefault(index.name, FakeSearchIndex())
+        return index
+
+    async def close(self):
+        pass
+
+
+class FakeCosmosRepository(CosmosRepository):
+    """
+    Documents kept in memory, updated with the same update documents the real repository sends.
+    """
+
+    def __init__(self, calls: ServiceCalls):
+        self.logging = Logger()
+        self.calls = calls
+        self.collections: Dict[str, Dict[str, dict]] = {}
+
+    def insert(self, collectionName, document: dict):
+        self.collections.setdefault(collectionName, {})[document["id"]] = copy.deepcopy(document)
+
+    async def find_one(self, collectionName, query: dict):
+        await self.calls.call("cosmos", "find_one")
+        for document in self.collections.get(collectionName, {}).values():
+            if all(document.get(key) == value for key, value in query.items()):
+                return copy.deepcopy(document)
+        return None
+
+    async def update_one(self, collectionName, item_id, update: dict) -> int:
+        await self.calls.call("cosmos", "update_one")
+        document = self.collections.get(collectionName, {}).get(item_id)
+        if document is None:
+            return 0
+        self.apply(document, update)
+        return 1
+
+    @classmethod
+    def apply(cls, document: dict, update: dict):
+        for key, value in update.get("$set", {}).items():
+            target, name = cls.field(document, key)
+            target[name] = copy.deepcopy(value)
+        for key in update.get("$unset", {}):
+            target, name = cls.field(document, key)
+            target.pop(name, None)
+        for key, value in update.get("$push", {}).items():
+            document.setdefault(key, []).extend(copy.deepcopy(value["$each"]))
+
+    @staticmethod
+    def field(document: dict, path: str):
+        *parents, name = path.split(".")
+        for parent in parents:
+            document = document.setdefault(parent, {})
+        return document, name
+
+    async def validate_database(self):
+        pass
+
+    async def update(self, collectionName, item_id, updated_data):
+        return await self.update_one(collectionName, item_id, {"$set": updated_data})
+
+    async def push_document_pages(self, collectionName, item_id, documentKBPages, pageCheckpoints=None):
+        return await self.update_one(collectionName, item_id, self.push_document_pages_update(documentKBPages, pageCheckpoints)) != 0
+
+    async def update_document_index_completion(self, collectionName, item_id, indexCompletionDate):
+        return await self.update_one(collectionName, item_id, self.index_completion_update(indexCompletionDate)) != 0
+
+    async def complete_document_index(self, collectionName, item_id, documentKBPages, indexCompletionDate):
+        await self.calls.call("cosmos", "bulk_write")
+        document = self.collections.get(collectionName, {}).get(item_id)
+        if document is None:
+            return False
+        if len(documentKBPages) > 0:
+            self.apply(document, self.push_document_pages_update(documentKBPages))
+        self.apply(document, self.index_completion_update(indexCompletionDate))
+        return True
+
+    async def start_document_index(self, collectionName, item_id, previousDocumentPages=None):
+        update = {"$set": {"indexStatus": IndexStatus.PROCESSING.value}}
+        if previousDocumentPages is not None:
+            update["$set"]["previousDocumentPages"] = previousDocumentPages
+            update["$set"]["documentPages"] = []
+            update["$unset"] = {"pageCheckpoints": ""}
+        return await self.update_one(collectionName, item_id, update)
+
+    async def get_by_id(self, collectionName, item_id):
+        return await self.find_one(collectionName, {"id": item_id, "indexStatus": IndexStatus.DELETING.value})
+
+    async def get_document(self, collectionName, item_id):
+        return await self.find_one(collectionName, {"id": item_id})
+
+    async def get_by_storage_file_path(self, collectionName, storageFilePath):
+        return await self.find_one(collectionName, {"storageFilePath": storageFilePath})
+
+    async def delete(self, collectionName, item_id):
+        await self.calls.call("cosmos", "delete_one")
+        return 1 if self.collections.get(collectionName, {}).pop(item_id, None) is not None else 0
+
+    def close(self):
+        pass
+
+
+class LocalQueueMessage:
+    def __init__(self, id: str, content: str):
+        self.id = id
+        self.content = content
+        self.dequeue_count = 0
+        self.pop_receipt = None
+        self.inserted_on = time.monotonic()
+        self.next_visible_on = self.inserted_on
+
+
+class LocalQueue:
+    """
+    Storage queue kept in memory, with the visibility timeout and dequeue count semantics of Azure Queue Storage.
+    It has the interface of QueueService, so the continuation messages of the processor land in it, and the
+    messages moved to the poison queue are kept in poison_messages.
+    """
+
+    def __init__(self, calls: ServiceCalls, queue_name: str = "original-docs-action-received"):
+        self.calls = calls
+        self.queue_name = queue_name
+        self.messages: Dict[str, LocalQueueMessage] = {}
+        self.poison_messages: List[LocalQueueMessage] = []
+        self.sent = 0
+
+    def put(self, content: str, visibility_timeout: float = None) -> LocalQueueMessage:
+        self.sent += 1
+        message = LocalQueueMessage(f"message-{self.sent}", content)
+        if visibility_timeout:
+            message.next_visible_on += visibility_timeout
+        self.messages[message.id] = message
+        return message
+
+    async def send_message(self, content, visibility_timeout: int = None):
+        await self.calls.call("queue", "send")
+        self.put(content if isinstance(content, str) else json.dumps(content), visibility_timeout)
+
+    async def receive_messages(self, max_messages: int, visibility_timeout: float) -> List[LocalQueueMessage]:
+        await self.calls.call("queue", "receive")
+        now = time.monotonic()
+        received = []
+        # Oldest messages first, the service is not strictly FIFO but close to it
+        for message in self.messages.values():
+            if len(received) >= max_messages:
+                break
+            if message.next_visible_on <= now:
+                message.dequeue_count += 1
+                message.pop_receipt = f"{message.id}-{message.dequeue_count}"
+                message.next_visible_on = now + visibility_timeout
+                received.append(message)
+        return received
+
+    async def receive_message(self, visibility_timeout: int) -> LocalQueueMessage:
+        received = await self.receive_messages(1, visibility_timeout)
+        return received[0] if len(received) > 0 else None
+
+    async def delete_message(self, message: LocalQueueMessage):
+        await self.calls.call("queue", "delete")
+        self.messages.pop(message.id, None)
+
+    async def update_visibility(self, message: LocalQueueMessage, visibility_timeout: float) -> LocalQueueMessage:
+        await self.calls.call("queue", "update")
+        message.next_visible_on = time.monotonic() + visibility_timeout
+        return message
+
+    async def move_to_poison_queue(self, message: LocalQueueMessage):
+        await self.calls.call("queue", "send")
+        self.messages.pop(message.id, None)
+        self.poison_messages.append(message)
+
+    def outstanding(self) -> int:
+        return len(self.messages)
+
+    async def close(self):
+        pass
+
+
+class FakeKeyVault:
+    SECRET = "benchmark"
+
+    async def get_secret(self, secret_name):
+        return self.SECRET
+
+    async def close(self):
+        pass
+
+
+class FakeServices:
+    """
+    The fakes of all the services sharing one ServiceCalls, and the blobs, indexes and documents they hold.
+    """
+
+    def __init__(self, calls: ServiceCalls, recordings: List[dict], embedding_dimensions: int = 1536):
+        self.calls = calls
+        self.credential = FakeCredential()
+        self.blob_service_client = FakeBlobServiceClient(calls)
+        self.recordings = RecordedAnalyzeResults(recordings)
+        self.open_ai_client = FakeOpenAIClient(calls, embedding_dimensions)
+        self.search_indexes: Dict[str, FakeSearchIndex] = {}
+        self.search_index_client = FakeSearchIndexClient(calls, self.search_indexes)
+        self.cosmos_repository = FakeCosmosRepository(calls)
+        self.queue_service = LocalQueue(calls)
+
+    def search_client(self, key) -> FakeSearchClient:
+        _, index_name = key
+        return FakeSearchClient(self.calls, self.search_indexes.setdefault(index_name, FakeSearchIndex()))
+
+    def document_intelligence_client(self, endpoint) -> FakeDocumentIntelligenceClient:
+        return FakeDocumentIntelligenceClient(self.calls, self.recordings)
+
+    async def attach(self, storage_container_service, search_embed_service):
+        """
+        Replaces the SDK clients of the services with the fakes, the real clients are closed unused.
+        """
+        await storage_container_service.blob_service_client.close()
+        storage_container_service.blob_service_client = self.blob_service_client
+
+        await search_embed_service.search_index_client.close()
+        search_embed_service.search_index_client = self.search_index_client
+        search_embed_service.search_client_pool.factory = self.search_client
+        search_embed_service.document_intelligence_client_pool.factory = self.document_intelligence_client
+        await search_embed_service.open_ai_client.close()
+        search_embed_service.open_ai_client = self.open_ai_client
+        search_embed_service.embedding_service.open_ai_client = self.open_ai_client
+
+    async def create_processor_builder(self):
+        """
+        ProcessorBuilder of the worker holding the fakes, to be used by the function handler in place of
+        the one get_processor_builder creates. The Cosmos DB secret never changes so refresh keeps the fake.
+        """
+        from processors.ProcessorBuilder import ProcessorBuilder
+        processor_builder = ProcessorBuilder()
+        await processor_builder.key_vault.close()
+        await processor_builder.queue_service.close()
+        await processor_builder.credential.close()
+        processor_builder.credential = self.credential
+        processor_builder.key_vault = FakeKeyVault()
+        processor_builder.queue_service = self.queue_service
+        processor_builder.cosmos_repository = self.cosmos_repository
+        processor_builder.cosmos_db_connection_string_secret = FakeKeyVault.SECRET
+        await self.attach(processor_builder.storage_container_service, processor_builder.search_embed_service)
+        return processor_builder
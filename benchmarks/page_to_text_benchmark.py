@@ -0,0 +1,91 @@
+"""
+Throughput of building the page text of a table heavy Document Intelligence result.
+
+Run from the repository root:
+    python -m benchmarks.page_to_text_benchmark --pages 200 --tables-per-page 4
+"""
+import argparse
+import logging
+import random
+import time
+
+# A handler on the root logger keeps Logger from exporting to Application Insights
+logging.basicConfig(level=logging.WARNING)
+
+from azure.ai.documentintelligence.models import (  # noqa: E402
+    AnalyzeResult,
+    BoundingRegion,
+    DocumentPage,
+    DocumentSpan,
+    DocumentTable,
+    DocumentTableCell,
+)
+from services.AzureSearchEmbedService import AzureSearchEmbedService  # noqa: E402
+
+WORDS = ["Receita", "líquida", "EBITDA", "Lucro", "Trimestre", "Variação", "R$", "milhões", "2023", "2024"]
+
+
+def synthetic_result(pages_count: int, tables_per_page: int, rows: int, columns: int, text_length: int, seed: int) -> AnalyzeResult:
+    """
+    Pages of text_length characters of text followed by tables_per_page tables, laid out the way
+    Document Intelligence does: the table cells are part of the content and the table spans cover them.
+    """
+    random_generator = random.Random(seed)
+    content = []
+    content_length = 0
+    pages = []
+    tables = []
+    for page_number in range(1, pages_count + 1):
+        page_offset = content_length
+        for _ in range(tables_per_page + 1):
+            text = " ".join(random_generator.choice(WORDS) for _ in range(text_length // 8)) + ".\n"
+            content.append(text)
+            content_length += len(text)
+            if len(tables) - (page_number - 1) * tables_per_page >= tables_per_page:
+                break
+
+            table_offset = content_length
+            cells = []
+            for row in range(rows):
+                for column in range(columns):
+                    cell_text = f"{random_generator.choice(WORDS)} {random_generator.random() * 1000:.2f}"
+                    cells.append(DocumentTableCell(row_index=row, column_index=column, content=cell_text,
+                                                   kind="columnHeader" if row == 0 else "content"))
+                    content.append(cell_text + "\n")
+                    content_length += len(cell_text) + 1
+            # Cells come row by row, shuffled a little like in real results
+            random_generator.shuffle(cells)
+            tables.append(DocumentTable(row_count=rows, column_count=columns, cells=cells,
+                                        bounding_regions=[BoundingRegion(page_number=page_number, polygon=[])],
+                                        spans=[DocumentSpan(offset=table_offset, length=content_length - table_offset)]))
+        pages.append(DocumentPage(page_number=page_number, angle=0, width=8.5, height=11, unit="inch",
+                                  spans=[DocumentSpan(offset=page_offset, length=content_length - page_offset)]))
+    return AnalyzeResult(api_version="2024-02-29-preview", model_id="prebuilt-layout", string_index_type="textElements",
+                         content="".join(content), pages=pages, tables=tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--tables-per-page", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=30)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--text-length", type=int, default=1500, help="Characters of text around every table")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = synthetic_result(args.pages, args.tables_per_page, args.rows, args.columns, args.text_length, args.seed)
+    print(f"{len(result.pages)} pages, {len(result.tables)} tables, {len(result.content)} characters of content")
+
+    for run in range(args.repeat):
+        started = time.perf_counter()
+        tables_by_page = AzureSearchEmbedService.group_tables_by_page(result)
+        page_text_length = sum(len(AzureSearchEmbedService.page_to_text(result, page, tables_by_page)) for page in result.pages)
+        elapsed = time.perf_counter() - started
+        print(f"Run {run + 1}: {page_text_length} characters of page text in {elapsed:.3f}s "
+              f"({len(result.pages) / elapsed:.0f} pages/s, {len(result.content) / elapsed / 1_000_000:.2f} M characters/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+End-to-end benchmark of the index processor on a synthetic corpus, with in-process fakes of Blob storage,
+Document Intelligence (replaying recorded analyze results), OpenAI embeddings, Azure AI Search and Cosmos DB
+that simulate the latency of every call. The processor code runs unchanged, only the network calls are faked.
+
+Run from the repository root:
+    python -m benchmarks.pipeline_benchmark --pdf-documents 4 --pdf-pages 50 --output results.json
+    python -m benchmarks.pipeline_benchmark --corpus benchmark-corpus --latency-scale 0 --compare results.json
+
+Writes a JSON report with the end-to-end timings, the timings of every stage of the PDF page pipeline,
+the calls made to every service and the memory peaks, for every pass over the corpus. The second and next
+passes index the same documents again, so they measure the re-index of unchanged documents.
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+# A handler on the root logger keeps Logger from exporting to Application Insights
+logging.basicConfig(level=logging.WARNING)
+
+from benchmarks.corpus import add_corpus_arguments, corpus_from_arguments, read_corpus  # noqa: E402
+from benchmarks.fakes import FAKE_ENDPOINTS, FakeServices, ServiceCalls, ServiceProfile  # noqa: E402
+
+# Settings of the processor read by the benchmark report, the defaults of the processor apply when unset
+REPORTED_SETTINGS = ["DOCUMENT_ANALYSIS_MODE", "DOCUMENT_ANALYSIS_PAGES_PER_REQUEST", "PDF_SPLIT_WORKERS", "PIPELINE_QUEUE_SIZE",
+                     "PIPELINE_UPLOAD_WORKERS", "PIPELINE_ANALYZE_WORKERS", "PIPELINE_CORPUS_WORKERS", "PIPELINE_CHUNK_WORKERS",
+                     "PIPELINE_EMBED_WORKERS", "PIPELINE_INDEX_WORKERS", "PIPELINE_RECORD_WORKERS", "COSMOS_PAGE_BATCH_SIZE",
+                     "COSMOS_CHECKPOINT_INTERVAL_SECONDS", "SECTION_BATCH_SIZE", "EMBEDDING_BATCH_SIZE", "EMBEDDING_MAX_CONCURRENCY", "EMBEDDING_CACHE_BACKEND",
+                     "SEARCH_UPLOAD_BATCH_SIZE", "SEARCH_UPLOAD_MAX_CONCURRENCY", "SEARCH_UPLOAD_RETRY_DELAY_SECONDS", "BLOB_UPLOAD_MAX_CONCURRENCY"]
+
+
+def service_profiles(args) -> Dict[str, ServiceProfile]:
+    return {
+        "blob": ServiceProfile(args.blob_latency, 1 / (args.blob_megabytes_per_second * 1_000_000), args.jitter, args.blob_failure_rate),
+        "document_intelligence": ServiceProfile(args.analyze_latency, args.analyze_page_latency, args.jitter, args.analyze_failure_rate),
+        "openai": ServiceProfile(args.embedding_latency, args.embedding_input_latency, args.jitter, args.embedding_failure_rate),
+        "search": ServiceProfile(args.search_latency, args.search_document_latency, args.jitter),
+        "search_document": ServiceProfile(failure_rate=args.search_throttling_rate),
+        "cosmos": ServiceProfile(args.cosmos_latency, 0.0, args.jitter),
+        "queue": ServiceProfile(args.cosmos_latency, 0.0, args.jitter),
+    }
+
+
+def add_service_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplies all the simulated latencies, 0 measures the CPU time only")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Spread of the simulated latencies, 0.1 is +-10%%")
+    parser.add_argument("--blob-latency", type=float, default=0.02, help="Seconds per Blob storage request")
+    parser.add_argument("--blob-megabytes-per-second", type=float, default=50, help="Blob storage transfer rate")
+    parser.add_argument("--blob-failure-rate", type=float, default=0.0)
+    parser.add_argument("--analyze-latency", type=float, default=1.5, help="Seconds per Document Intelligence analyze job")
+    parser.add_argument("--analyze-page-latency", type=float, default=0.3, help="Seconds per analyzed page")
+    parser.add_argument("--analyze-failure-rate", type=float, default=0.0)
+    parser.add_argument("--embedding-latency", type=float, default=0.15, help="Seconds per embeddings request")
+    parser.add_argument("--embedding-input-latency", type=float, default=0.005, help="Seconds per embedded section")
+    parser.add_argument("--embedding-failure-rate", type=float, default=0.0)
+    parser.add_argument("--embedding-dimensions", type=int, default=1536)
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Seconds per indexing request")
+    parser.add_argument("--search-document-latency", type=float, default=0.0005, help="Seconds per indexed section")
+    parser.add_argument("--search-throttling-rate", type=float, default=0.0, help="Share of the sections rejected with 503 and retried")
+    parser.add_argument("--cosmos-latency", type=float, default=0.01, help="Seconds per Cosmos DB and queue request")
+
+
+def configure_environment(args):
+    # Set before the services are created, they read their settings when constructed
+    for name, value in FAKE_ENDPOINTS.items():
+        os.environ[name] = value
+    os.environ['EMBEDDING_CACHE_BACKEND'] = args.embedding_cache
+    os.environ['FUNCTION_TIMEOUT_SECONDS'] = "inf"
+    if args.embedding_cache == "local":
+        os.environ['EMBEDDING_CACHE_DIR'] = tempfile.mkdtemp(prefix="benchmark-embeddingcache-")
+
+
+def index_message(n: int, blob_name: str) -> dict:
+    theme, subtheme, file_name = blob_name.split("/")[-3:]
+    return {"action": "index", "fileId": f"benchmark-{n + 1}", "storageFilePath": blob_name, "fileName": file_name,
+            "originalFileFormat": os.path.splitext(file_name)[1].lstrip(".").lower(), "theme": theme,
+            "subtheme": subtheme, "language": "port"}
+
+
+def seed_documents(fakes: FakeServices, documents: Dict[str, bytes]) -> List[dict]:
+    """
+    Stores the documents in the fake originaldocuments container and Document metadata store, the way
+    the upload API leaves them, and returns their index messages.
+    """
+    messages = []
+    for n, blob_name in enumerate(sorted(documents)):
+        fakes.blob_service_client.get_container_client("originaldocuments").blobs[blob_name] = documents[blob_name]
+        messages.append(index_message(n, blob_name))
+        fakes.cosmos_repository.insert("documentskb", {"id": messages[-1]["fileId"], "storageFilePath": blob_name,
+                                                       "indexStatus": "Processing", "documentPages": []})
+    return messages
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def stage_report(metrics) -> dict:
+    report = dataclasses.asdict(metrics)
+    report.update(average_seconds=metrics.average_seconds(), average_wait_seconds=metrics.average_wait_seconds(),
+                  average_queue_depth=metrics.average_queue_depth())
+    return report
+
+
+def max_rss_bytes(who) -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def git_commit() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip() != ""
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+class Benchmark:
+    def __init__(self, args, documents: Dict[str, bytes], recordings: List[dict]):
+        self.args = args
+        self.documents = documents
+        self.calls = ServiceCalls(service_profiles(args), latency_scale=args.latency_scale, seed=args.seed)
+        self.fakes = FakeServices(self.calls, recordings, embedding_dimensions=args.embedding_dimensions)
+        self.pdf_processors = []
+
+    async def run(self) -> List[dict]:
+        # Imported once the environment is configured
+        from handlers.PdfSplitterHandler import shutdown_process_pool
+        from infra.HttpSession import close_http_session
+        from processors import IndexProcessor
+        from services.AzureSearchEmbedService import AzureSearchEmbedService
+        from services.StorageContainerService import StorageContainerService
+
+        # The PDF processors created by the index processor are kept for their pipeline metrics
+        benchmark = self
+
+        class MeasuredPDFDocumentProcessor(IndexProcessor.PDFDocumentProcessor):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                benchmark.pdf_processors.append(self)
+
+        IndexProcessor.PDFDocumentProcessor = MeasuredPDFDocumentProcessor
+
+        storage_container_service = StorageContainerService(credential=self.fakes.credential)
+        search_embed_service = AzureSearchEmbedService(storage_container_service=storage_container_service, credential=self.fakes.credential)
+        await self.fakes.attach(storage_container_service, search_embed_service)
+
+        messages = seed_documents(self.fakes, self.documents)
+
+        passes = []
+        try:
+            for pass_number in range(1, self.args.passes + 1):
+                passes.append(await self.run_pass(pass_number, messages, storage_container_service, search_embed_service))
+        finally:
+            await search_embed_service.close()
+            await storage_container_service.close()
+            await close_http_session()
+            shutdown_process_pool()
+        return passes
+
+    async def run_pass(self, pass_number: int, messages: List[dict], storage_container_service, search_embed_service) -> dict:
+        from builders.MessageBuilder import MessageBuilder
+        from models.PipelineStageMetrics import PipelineStageMetrics
+        from processors.Processor import Processor
+
+        self.calls.operations.clear()
+        self.pdf_processors.clear()
+        if self.args.trace_memory:
+            tracemalloc.reset_peak()
+
+        pending = asyncio.Queue()
+        for message in messages:
+            pending.put_nowait(message)
+        results = []
+
+        async def consume():
+            while not pending.empty():
+                message = MessageBuilder(pending.get_nowait()).build()
+                processor = Processor(message=message, storage_container_service=storage_container_service,
+                                      cosmos_repository=self.fakes.cosmos_repository, search_embed_service=search_embed_service,
+                                      queue_service=self.fakes.queue_service)
+                started = time.perf_counter()
+                error = None
+                pages = 0
+                try:
+                    pages = (await processor.process()).pages
+                except Exception as e:
+                    error = str(e)
+                results.append({"file": message.storageFilePath, "format": message.originalFileFormat, "pages": pages,
+                                "seconds": time.perf_counter() - started, "error": error})
+
+        started = time.perf_counter()
+        await asyncio.gather(*[consume() for _ in range(max(self.args.concurrency, 1))])
+        elapsed = time.perf_counter() - started
+
+        stages = {}
+        for pdf_processor in self.pdf_processors:
+            # Documents that failed before their pages were split have no pipeline
+            pipeline = getattr(pdf_processor, "pipeline", None)
+            if pipeline is None:
+                continue
+            for name, metrics in pipeline.metrics.items():
+                stages.setdefault(name, PipelineStageMetrics()).add(metrics)
+
+        pages = sum(result["pages"] for result in results)
+        document_seconds = [result["seconds"] for result in results]
+        by_format = {}
+        for result in results:
+            summary = by_format.setdefault(result["format"], {"documents": 0, "pages": 0, "seconds": 0.0})
+            summary["documents"] += 1
+            summary["pages"] += result["pages"]
+            summary["seconds"] += result["seconds"]
+
+        return {
+            "pass": pass_number,
+            "end_to_end": {
+                "seconds": elapsed,
+                "documents": len(results),
+                "failed": len([result for result in results if result["error"] is not None]),
+                "pages": pages,
+                "pages_per_second": pages / elapsed if elapsed > 0 else 0.0,
+                "document_seconds_p50": percentile(document_seconds, 0.5),
+                "document_seconds_p95": percentile(document_seconds, 0.95),
+                "document_seconds_max": max(document_seconds, default=0.0),
+                "by_format": by_format,
+            },
+            "stages": {name: stage_report(metrics) for name, metrics in stages.items()},
+            "services": {operation: dataclasses.asdict(stats) for operation, stats in sorted(self.calls.operations.items())},
+            "memory": {
+                "python_peak_bytes": tracemalloc.get_traced_memory()[1] if self.args.trace_memory else None,
+                "max_rss_bytes": max_rss_bytes(resource.RUSAGE_SELF),
+                "children_max_rss_bytes": max_rss_bytes(resource.RUSAGE_CHILDREN),
+            },
+            "documents": results,
+        }
+
+
+def print_summary(report: dict, baseline: dict = None):
+    def change(value, baseline_value):
+        if baseline_value is None or value is None or baseline_value == 0:
+            return ""
+        return f" ({(value - baseline_value) / baseline_value:+.1%})"
+
+    baseline_passes = {run["pass"]: run for run in (baseline or {}).get("passes", [])}
+    for run in report["passes"]:
+        baseline_run = baseline_passes.get(run["pass"], {})
+        end_to_end = run["end_to_end"]
+        baseline_end_to_end = baseline_run.get("end_to_end", {})
+        print(f"Pass {run['pass']}: {end_to_end['documents']} documents ({end_to_end['failed']} failed), {end_to_end['pages']} pages in "
+              f"{end_to_end['seconds']:.2f}s{change(end_to_end['seconds'], baseline_end_to_end.get('seconds'))}, "
+              f"{end_to_end['pages_per_second']:.1f} pages/s{change(end_to_end['pages_per_second'], baseline_end_to_end.get('pages_per_second'))}",
+              file=sys.stderr)
+        for name, stage in run["stages"].items():
+            baseline_stage = baseline_run.get("stages", {}).get(name, {})
+            print(f"  stage {name:8} busy {stage['busy_seconds']:8.2f}s{change(stage['busy_seconds'], baseline_stage.get('busy_seconds')):10} "
+                  f"avg {stage['average_seconds']:.3f}s, avg wait {stage['average_wait_seconds']:.3f}s, items {stage['items']}",
+                  file=sys.stderr)
+        for operation, stats in run["services"].items():
+            baseline_stats = baseline_run.get("services", {}).get(operation, {})
+            print(f"  {operation:32} calls {stats['calls']:6}{change(stats['calls'], baseline_stats.get('calls')):10} "
+                  f"seconds {stats['seconds']:8.2f}, failures {stats['failures']}", file=sys.stderr)
+        memory = run["memory"]
+        if memory["python_peak_bytes"] is not None:
+            print(f"  python peak {memory['python_peak_bytes'] / 1_000_000:.1f} MB"
+                  f"{change(memory['python_peak_bytes'], baseline_run.get('memory', {}).get('python_peak_bytes'))}", file=sys.stderr)
+    memory = report["passes"][-1]["memory"] if report["passes"] else None
+    if memory is not None:
+        print(f"Max RSS {memory['max_rss_bytes'] / 1_000_000:.1f} MB, PDF split processes {memory['children_max_rss_bytes'] / 1_000_000:.1f} MB",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Folder written by benchmarks.corpus, a synthetic corpus is generated when not given")
+    add_corpus_arguments(parser)
+    parser.add_argument("--passes", type=int, default=1, help="Passes over the corpus, the next passes re-index unchanged documents")
+    parser.add_argument("--concurrency", type=int, default=1, help="Documents processed at the same time, the Function processes one")
+    add_service_arguments(parser)
+    parser.add_argument("--embedding-cache", choices=["none", "local"], default="none",
+                        help="local caches the embeddings in a new temporary folder, the next passes hit it")
+    parser.add_argument("--trace-memory", action="store_true", help="Measures the Python memory peak of every pass, slows the run down")
+    parser.add_argument("--output", help="File the JSON report is written to, printed when not given")
+    parser.add_argument("--compare", help="JSON report of an earlier run, i.e. of another commit, the summary shows the changes against it")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    if args.corpus is not None:
+        documents, recordings = read_corpus(args.corpus)
+    else:
+        documents, recordings = corpus_from_arguments(args)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    passes = asyncio.run(Benchmark(args, documents, recordings).run())
+    report = {
+        "benchmark": "pipeline",
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git": git_commit(),
+        "python": platform.python_version(),
+        "arguments": vars(args),
+        "settings": {name: os.getenv(name) for name in REPORTED_SETTINGS if os.getenv(name) is not None},
+        "corpus": {
+            "documents": len(documents),
+            "bytes": sum(len(content) for content in documents.values()),
+            "recordings": len(recordings),
+        },
+        "seconds": time.perf_counter() - started,
+        "passes": passes,
+    }
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    print_summary(report, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Load test of ActionReceivedFunc under a burst of queue messages, i.e. a whole subtheme uploaded again at once.
+
+The real function handler is driven by a simulation of the queue listener of the Functions host, with the
+batchSize, newBatchThreshold, visibilityTimeout and maxDequeueCount of host.json, over a local queue. The
+services are the in-process fakes of pipeline_benchmark, with simulated latencies and error rates. Every
+combination of the swept settings runs the whole burst on fresh fakes.
+
+Run from the repository root:
+    python -m benchmarks.queue_load_test --pdf-documents 20 --pdf-pages 10 --batch-size 1,4,16 --new-batch-threshold 0,2 \\
+        --time-scale 0.1 --analyze-failure-rate 0.01 --output load.json
+    python -m benchmarks.queue_load_test --batch-size 8 --setting PIPELINE_ANALYZE_WORKERS=2,8 --instances 1,2
+
+Reports, for every combination, the p50/p95/p99 latency of the messages from the time they were enqueued to the time
+they were deleted, the throughput, the retried invocations, the timeouts and the messages moved to the poison queue.
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+# A handler on the root logger keeps Logger from exporting to Application Insights
+logging.basicConfig(level=logging.WARNING)
+
+from benchmarks.corpus import add_corpus_arguments, corpus_from_arguments, read_corpus  # noqa: E402
+from benchmarks.fakes import FAKE_ENDPOINTS, FakeServices, LocalQueue, LocalQueueMessage, ServiceCalls  # noqa: E402
+from benchmarks.pipeline_benchmark import add_service_arguments, git_commit, percentile, seed_documents, service_profiles  # noqa: E402
+
+HOST_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "host.json")
+MIN_POLLING_INTERVAL_SECONDS = 0.1  # The host polls again right away while it finds messages, then backs off up to maxPollingInterval
+DEFAULT_INDEX_CONTINUATION_MARGIN_SECONDS = 300
+
+
+def timespan_seconds(timespan: str) -> float:
+    hours, minutes, seconds = timespan.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def host_json_settings(path: str = HOST_JSON) -> dict:
+    with open(path, encoding="utf-8") as host_file:
+        host = json.load(host_file)
+    queues = host.get("extensions", {}).get("queues", {})
+    batch_size = queues.get("batchSize", 16)
+    return {
+        "batch_size": batch_size,
+        "new_batch_threshold": queues.get("newBatchThreshold", batch_size // 2),
+        "visibility_timeout": timespan_seconds(queues.get("visibilityTimeout", "00:00:00")),
+        "max_dequeue_count": queues.get("maxDequeueCount", 5),
+        "max_polling_interval": timespan_seconds(queues.get("maxPollingInterval", "00:01:00")),
+        "function_timeout": timespan_seconds(host.get("functionTimeout", "00:30:00")),
+    }
+
+
+@dataclass
+class HostSettings:
+    batch_size: int
+    new_batch_threshold: int
+    visibility_timeout: float
+    max_dequeue_count: int
+    max_polling_interval: float
+    function_timeout: float
+    instances: int = 1
+    environment: Dict[str, str] = field(default_factory=dict)
+
+    def to_string(self):
+        environment = "".join(f", {name}={value}" for name, value in self.environment.items())
+        return (f"batchSize={self.batch_size}, newBatchThreshold={self.new_batch_threshold}, "
+                f"visibilityTimeout={self.visibility_timeout:g}s, instances={self.instances}{environment}")
+
+
+@dataclass
+class LoadStats:
+    invocations: int = 0
+    failed_invocations: int = 0
+    timeouts: int = 0
+    retries: int = 0
+    poisoned: int = 0
+    completed: int = 0
+    message_seconds: List[float] = field(default_factory=list)
+    invocation_seconds: List[float] = field(default_factory=list)
+    first_enqueued_at: float = None
+    last_finished_at: float = None
+
+
+class HostInstance:
+    """
+    Queue listener of a Functions host instance: it receives batchSize messages at a time and receives the next
+    batch once the messages in process drop to newBatchThreshold. A failed message becomes visible again after
+    visibilityTimeout, and is moved to the poison queue once it was dequeued maxDequeueCount times.
+    """
+
+    def __init__(self, handler, queue: LocalQueue, settings: HostSettings, time_scale: float, stats: LoadStats, arrivals: asyncio.Event):
+        self.handler = handler
+        self.queue = queue
+        self.settings = settings
+        self.time_scale = time_scale
+        self.stats = stats
+        self.arrivals = arrivals
+
+    async def run(self):
+        in_flight = set()
+        min_polling_interval = MIN_POLLING_INTERVAL_SECONDS * self.time_scale
+        polling_interval = min_polling_interval
+        while not self.arrivals.is_set() or self.queue.outstanding() > 0 or len(in_flight) > 0:
+            delay = polling_interval
+            if len(in_flight) <= self.settings.new_batch_threshold:
+                # Messages in process stay hidden, the host keeps renewing their visibility
+                messages = await self.queue.receive_messages(self.settings.batch_size, visibility_timeout=float("inf"))
+                for message in messages:
+                    in_flight.add(asyncio.ensure_future(self.invoke(message)))
+                if len(messages) > 0:
+                    polling_interval = min_polling_interval
+                    delay = polling_interval
+                else:
+                    polling_interval = min(polling_interval * 2, self.settings.max_polling_interval * self.time_scale)
+
+            if len(in_flight) > 0:
+                done, _ = await asyncio.wait(in_flight, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                in_flight -= done
+            else:
+                await asyncio.sleep(delay)
+
+    async def invoke(self, message: LocalQueueMessage):
+        import azure.functions as func
+
+        self.stats.invocations += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.handler(func.QueueMessage(id=message.id, body=message.content.encode("utf-8"), pop_receipt=message.pop_receipt)),
+                                   timeout=self.settings.function_timeout)
+            failed = False
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            failed = True
+        except Exception:
+            failed = True
+        finished = time.monotonic()
+        self.stats.invocation_seconds.append(finished - started)
+        self.stats.last_finished_at = finished
+
+        if not failed:
+            await self.queue.delete_message(message)
+            self.stats.completed += 1
+            self.stats.message_seconds.append(finished - message.inserted_on)
+            return
+
+        self.stats.failed_invocations += 1
+        if message.dequeue_count >= self.settings.max_dequeue_count:
+            await self.queue.move_to_poison_queue(message)
+            self.stats.poisoned += 1
+        else:
+            await self.queue.update_visibility(message, self.settings.visibility_timeout * self.time_scale)
+            self.stats.retries += 1
+
+
+def bad_message(message: dict) -> str:
+    # Missing the fields the MessageBuilder requires, it fails on every attempt and ends in the poison queue
+    return json.dumps({"action": message["action"], "fileId": message["fileId"]})
+
+
+async def enqueue(queue: LocalQueue, messages: List[str], arrival_seconds: float, arrivals: asyncio.Event, stats: LoadStats):
+    stats.first_enqueued_at = time.monotonic()
+    for i, content in enumerate(messages):
+        if arrival_seconds > 0:
+            await asyncio.sleep(stats.first_enqueued_at + arrival_seconds * i / len(messages) - time.monotonic())
+        queue.put(content)
+    arrivals.set()
+
+
+async def run_configuration(args, settings: HostSettings, documents: Dict[str, bytes], recordings: List[dict], handler) -> dict:
+    from processors import ProcessorBuilder
+    from services import SearchIndexRegistry
+
+    previous_environment = {name: os.environ.get(name) for name in settings.environment}
+    os.environ.update(settings.environment)
+    # The processor stops before the function timeout the host enforces
+    os.environ['FUNCTION_TIMEOUT_SECONDS'] = str(settings.function_timeout)
+    os.environ['INDEX_CONTINUATION_MARGIN_SECONDS'] = str(args.continuation_margin * args.time_scale)
+
+    calls = ServiceCalls(service_profiles(args), latency_scale=args.latency_scale * args.time_scale, seed=args.seed)
+    fakes = FakeServices(calls, recordings, embedding_dimensions=args.embedding_dimensions)
+    messages = seed_documents(fakes, documents)
+    random_generator = random.Random(args.seed)
+    contents = [bad_message(message) if random_generator.random() < args.bad_message_rate else json.dumps(message) for message in messages]
+
+    # The handler gets the clients from get_processor_builder, the fakes are put in its place
+    processor_builder = await fakes.create_processor_builder()
+    ProcessorBuilder._processor_builder = processor_builder
+    SearchIndexRegistry._registry = None
+
+    stats = LoadStats()
+    arrivals = asyncio.Event()
+    queue = fakes.queue_service
+    try:
+        await asyncio.gather(enqueue(queue, contents, args.arrival_seconds * args.time_scale, arrivals, stats),
+                             *[HostInstance(handler, queue, settings, args.time_scale, stats, arrivals).run() for _ in range(settings.instances)])
+    finally:
+        ProcessorBuilder._processor_builder = None
+        await processor_builder.close()
+        for name, value in previous_environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    elapsed = (stats.last_finished_at or stats.first_enqueued_at) - stats.first_enqueued_at
+    indexed = [document for document in fakes.cosmos_repository.collections["documentskb"].values() if document.get("indexStatus") == "Indexed"]
+    pages = sum(len(document.get("documentPages") or []) for document in indexed)
+    return {
+        "settings": dataclasses.asdict(settings),
+        "seconds": elapsed,
+        "messages": {
+            "sent": len(contents),
+            "continuations": queue.sent - len(contents),
+            "completed": stats.completed,
+            "poisoned": stats.poisoned,
+            "invocations": stats.invocations,
+            "failed_invocations": stats.failed_invocations,
+            "retries": stats.retries,
+            "timeouts": stats.timeouts,
+        },
+        "message_latency_seconds": {
+            "p50": percentile(stats.message_seconds, 0.5),
+            "p95": percentile(stats.message_seconds, 0.95),
+            "p99": percentile(stats.message_seconds, 0.99),
+            "max": max(stats.message_seconds, default=0.0),
+        },
+        "invocation_seconds": {
+            "p50": percentile(stats.invocation_seconds, 0.5),
+            "p95": percentile(stats.invocation_seconds, 0.95),
+            "p99": percentile(stats.invocation_seconds, 0.99),
+        },
+        "throughput": {
+            "messages_per_minute": stats.completed * 60 / elapsed if elapsed > 0 else 0.0,
+            "documents_indexed": len(indexed),
+            "pages_indexed": pages,
+            "pages_per_minute": pages * 60 / elapsed if elapsed > 0 else 0.0,
+        },
+        "services": {operation: dataclasses.asdict(operation_stats) for operation, operation_stats in sorted(calls.operations.items())},
+    }
+
+
+def swept_settings(args, defaults: dict) -> List[HostSettings]:
+    environments = [{}]
+    for setting in args.setting:
+        name, _, values = setting.partition("=")
+        environments = [dict(environment, **{name: value}) for environment in environments for value in values.split(",")]
+
+    sweep = []
+    for batch_size, new_batch_threshold, visibility_timeout, instances, environment in itertools.product(
+            args.batch_size or [defaults["batch_size"]],
+            args.new_batch_threshold or [defaults["new_batch_threshold"]],
+            args.visibility_timeout or [defaults["visibility_timeout"]],
+            args.instances,
+            environments):
+        sweep.append(HostSettings(batch_size=batch_size, new_batch_threshold=new_batch_threshold, visibility_timeout=visibility_timeout,
+                                  max_dequeue_count=args.max_dequeue_count or defaults["max_dequeue_count"],
+                                  max_polling_interval=defaults["max_polling_interval"],
+                                  function_timeout=(args.function_timeout or defaults["function_timeout"]) * args.time_scale,
+                                  instances=instances, environment=environment))
+    return sweep
+
+
+def values_of(value_type):
+    def parse(values: str):
+        return [value_type(value) for value in values.split(",")]
+    return parse
+
+
+async def run_sweep(args, sweep: List[HostSettings], documents: Dict[str, bytes], recordings: List[dict]) -> List[dict]:
+    import function_app
+    from processors.ProcessorBuilder import close_processor_builder
+
+    handler = next(function.get_user_function() for function in function_app.app.get_functions() if function.get_function_name() == "ActionReceivedFunc")
+    results = []
+    try:
+        for settings in sweep:
+            result = await run_configuration(args, settings, documents, recordings, handler)
+            print_result(result, settings)
+            results.append(result)
+    finally:
+        await close_processor_builder()
+    return results
+
+
+def print_result(result: dict, settings: HostSettings):
+    messages = result["messages"]
+    latency = result["message_latency_seconds"]
+    throughput = result["throughput"]
+    print(f"{settings.to_string()}: {messages['completed']}/{messages['sent'] + messages['continuations']} messages completed in {result['seconds']:.2f}s, "
+          f"latency p50 {latency['p50']:.2f}s p95 {latency['p95']:.2f}s p99 {latency['p99']:.2f}s, "
+          f"{throughput['messages_per_minute']:.1f} messages/min, {throughput['pages_per_minute']:.1f} pages/min, "
+          f"retries {messages['retries']}, timeouts {messages['timeouts']}, poisoned {messages['poisoned']}, "
+          f"continuations {messages['continuations']}", file=sys.stderr)
+
+
+def main():
+    defaults = host_json_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Folder written by benchmarks.corpus, a synthetic corpus is generated when not given")
+    add_corpus_arguments(parser)
+    add_service_arguments(parser)
+    parser.add_argument("--batch-size", type=values_of(int), help=f"Comma separated values to sweep, host.json has {defaults['batch_size']}")
+    parser.add_argument("--new-batch-threshold", type=values_of(int), help=f"Comma separated values to sweep, host.json has {defaults['new_batch_threshold']}")
+    parser.add_argument("--visibility-timeout", type=values_of(float), help=f"Seconds, comma separated values to sweep, host.json has {defaults['visibility_timeout']:g}")
+    parser.add_argument("--instances", type=values_of(int), default=[1],
+                        help="Host instances, comma separated values to sweep. They run in this process and share its CPU and clients")
+    parser.add_argument("--setting", action="append", default=[],
+                        help="Processor setting to sweep, i.e. PIPELINE_ANALYZE_WORKERS=2,8, can be repeated")
+    parser.add_argument("--max-dequeue-count", type=int, help=f"host.json has {defaults['max_dequeue_count']}")
+    parser.add_argument("--function-timeout", type=float, help=f"Seconds, host.json has {defaults['function_timeout']:g}")
+    parser.add_argument("--continuation-margin", type=float, default=float(os.getenv('INDEX_CONTINUATION_MARGIN_SECONDS', DEFAULT_INDEX_CONTINUATION_MARGIN_SECONDS)),
+                        help="Seconds, INDEX_CONTINUATION_MARGIN_SECONDS of the processor")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Multiplies the simulated latencies, the host delays and timeouts and the arrival window, i.e. 0.1 runs ten times faster. "
+                             "The reported times are measured, not scaled back")
+    parser.add_argument("--arrival-seconds", type=float, default=0.0, help="The messages arrive evenly over this window, 0 enqueues them all at once")
+    parser.add_argument("--bad-message-rate", type=float, default=0.0, help="Share of malformed messages, they end in the poison queue")
+    parser.add_argument("--output", help="File the JSON report is written to, printed when not given")
+    args = parser.parse_args()
+
+    # Set before the services are created, they read their settings when constructed
+    for name, value in FAKE_ENDPOINTS.items():
+        os.environ[name] = value
+    os.environ['EMBEDDING_CACHE_BACKEND'] = "none"
+
+    if args.corpus is not None:
+        documents, recordings = read_corpus(args.corpus)
+    else:
+        documents, recordings = corpus_from_arguments(args)
+
+    sweep = swept_settings(args, defaults)
+    results = asyncio.run(run_sweep(args, sweep, documents, recordings))
+    report = {
+        "benchmark": "queue_load_test",
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git": git_commit(),
+        "arguments": vars(args),
+        "host_json": defaults,
+        "corpus": {"documents": len(documents), "bytes": sum(len(content) for content in documents.values()), "recordings": len(recordings)},
+        "configurations": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Throughput of TextSplitterHandler.split_pages on large synthetic texts.
+
+Run from the repository root:
+    python -m benchmarks.split_pages_benchmark --megabytes 8 --repeat 3
+"""
+import argparse
+import logging
+import random
+import time
+
+# A handler on the root logger keeps Logger from exporting to Application Insights
+logging.basicConfig(level=logging.WARNING)
+
+from handlers.TextSplitterHandler import TextSplitterHandler  # noqa: E402
+from models.Message import Message  # noqa: E402
+from models.PageDetail import PageDetail  # noqa: E402
+
+WORDS = ["receita", "líquida", "EBITDA", "trimestre", "resultado", "market", "share", "dividend", "2024", "R$", "1.234,56"]
+
+
+def synthetic_text(size: int, seed: int, table_every: int) -> str:
+    random_generator = random.Random(seed)
+    parts = []
+    written = 0
+    sentence = 0
+    while written < size:
+        words = " ".join(random_generator.choice(WORDS) for _ in range(random_generator.randint(5, 30)))
+        part = words + random_generator.choice([". ", "; ", ", ", "! ", "? ", "\n"])
+        sentence += 1
+        if table_every > 0 and sentence % table_every == 0:
+            rows = "".join(f"<tr><td>{random_generator.choice(WORDS)}</td><td>{random_generator.random():.2f}</td></tr>" for _ in range(random_generator.randint(2, 40)))
+            part += "<table>" + rows + "</table>"
+        parts.append(part)
+        written += len(part)
+    return "".join(parts)[:size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=4, help="Characters of text, in millions")
+    parser.add_argument("--pages", type=int, default=1, help="Pages the text is spread over, DOCX documents are a single page")
+    parser.add_argument("--table-every", type=int, default=20, help="Adds a table after every N sentences, 0 for no tables")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text = synthetic_text(int(args.megabytes * 1_000_000), args.seed, args.table_every)
+    page_length = -(-len(text) // args.pages)
+    pages = [PageDetail(i, offset, text[offset:offset + page_length]) for i, offset in enumerate(range(0, len(text), page_length))]
+    message = Message(dict(action="index", fileId="benchmark", storageFilePath="theme/subtheme/Benchmark.docx",
+                           fileName="Benchmark.docx", originalFileFormat="docx", theme="theme", subtheme="subtheme", language="port"))
+    splitter = TextSplitterHandler()
+
+    for run in range(args.repeat):
+        started = time.perf_counter()
+        sections = splitter.split_pages("theme/subtheme/Benchmark/Benchmark.docx", message, pages)
+        elapsed = time.perf_counter() - started
+        print(f"Run {run + 1}: {len(text)} characters, {len(sections)} sections in {elapsed:.3f}s "
+              f"({len(text) / elapsed / 1_000_000:.2f} M characters/s, {len(sections) / elapsed:.0f} sections/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,4 +4,20 @@ class ActionNotSupportedError(Exception):
 
 class FileFormatNotSuportedError(Exception):
     def __init__(self, format):
-        super().__init__(f"File format not supported, format: " + format)
\ No newline at end of file
+        super().__init__(f"File format not supported, format: " + format)
+
+class PageProcessingError(Exception):
+    def __init__(self, file_name, failed_pages):
+        super().__init__(f"Error processing pages {failed_pages} of file: " + file_name)
+        self.failed_pages = failed_pages
+
+class IndexingInterruptedError(Exception):
+    def __init__(self, file_name, next_page, processed_pages=0):
+        super().__init__(f"Indexing of file: {file_name} stopped before page {next_page} to finish before the function timeout")
+        self.next_page = next_page
+        self.processed_pages = processed_pages
+
+class SectionDeletionError(Exception):
+    def __init__(self, file_name, failed_count):
+        super().__init__(f"Error deleting {failed_count} sections of file: {file_name} from the search index")
+        self.failed_count = failed_count
@@ -1,3 +1,7 @@
 class BlobFileDoesntExistsError(Exception):
     def __init__(self):
-        super().__init__(f"""Blob file doesnt exists in storage container.""")
\ No newline at end of file
+        super().__init__(f"""Blob file doesnt exists in storage container.""")
+
+class BlobDeletionError(Exception):
+    def __init__(self, container_name, folder_name, failed):
+        super().__init__(f"Failed deleting {failed} blobs in folder '{folder_name}' of container '{container_name}'.")
@@ -4,7 +4,7 @@ from services.Logger import Logger
 from builders.MessageBuilder import MessageBuilder
 from dotenv import load_dotenv
 
-from processors.ProcessorBuilder import ProcessorBuilder
+from processors.ProcessorBuilder import get_processor_builder
 
 app = func.FunctionApp()
 
@@ -18,17 +18,16 @@ async def ActionReceivedFunc(azqueue: func.QueueMessage):
 
     try:
         az_message = azqueue.get_body().decode('utf-8')
-        logging.info('ARF-02 - Decoding message: ' + az_message)
+        logging.info('ARF-02 - Decoding message: %s', az_message)
         az_message_dict = json.loads(az_message)
         message = MessageBuilder(az_message_dict).build()
 
         logging.info('ARF-03 -Building processor')
-        processor = ProcessorBuilder().build(
-            message=message
-        )
-
-        logging.info('ARF-04 - Processing message')
-        await processor.process()
+        # The clients are created by the first message and reused by the next ones
+        processor_builder = await get_processor_builder()
+        async with processor_builder.processor(message=message) as processor:
+            logging.info('ARF-04 - Processing message')
+            await processor.process()
 
 
     except Exception as e:
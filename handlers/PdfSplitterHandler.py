@@ -0,0 +1,201 @@
+import asyncio
+import mmap
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing.shared_memory import SharedMemory
+from typing import AsyncGenerator, Tuple
+from PyPDF2 import PdfReader, PdfWriter
+from infra.BlobStream import BlobStream
+from services.Logger import Logger
+from services.Metrics import span
+
+DEFAULT_PDF_SPLIT_WORKERS = min(4, os.cpu_count() or 1)  # 0 splits the pages in a thread of the worker process
+
+# Single process pools, the pages of a document are all split by one of them: [[pool, documents pinned to it]]
+_process_pools = []
+_process_pools_lock = threading.Lock()
+
+# Documents opened by the current pool process, reused by all their pages until they are released: {document source: PdfReader}
+_worker_documents = {}
+
+
+def split_page(pdf_reader: PdfReader, page_index: int) -> bytes:
+    single_pdf_document = PdfWriter()
+    single_pdf_document.add_page(pdf_reader.pages[page_index])
+    page_stream = BytesIO()
+    single_pdf_document.write(page_stream)
+    return page_stream.getvalue()
+
+
+def _open_document_in_worker(source: Tuple[str, str, int]) -> PdfReader:
+    kind, name, size = source
+    if kind == "file":
+        # Spooled documents are mapped from the file the parent downloaded, not copied
+        with open(name, "rb") as document_file:
+            return PdfReader(mmap.mmap(document_file.fileno(), 0, access=mmap.ACCESS_READ))
+    shared_memory = SharedMemory(name=name)
+    try:
+        document_bytes = bytes(shared_memory.buf[:size])
+    finally:
+        shared_memory.close()
+    return PdfReader(BytesIO(document_bytes))
+
+
+def _split_page_in_worker(source: Tuple[str, str, int], page_index: int) -> bytes:
+    pdf_reader = _worker_documents.get(source)
+    if pdf_reader is None:
+        pdf_reader = _open_document_in_worker(source)
+        _worker_documents[source] = pdf_reader
+    return split_page(pdf_reader, page_index)
+
+
+def _release_document_in_worker(source: Tuple[str, str, int]):
+    # Closing the mapping of a spooled document lets the parent free the disk space of its file
+    pdf_reader = _worker_documents.pop(source, None)
+    if pdf_reader is not None:
+        pdf_reader.stream.close()
+
+
+def pin_process_pool(workers: int) -> int:
+    """
+    Returns the index of the pool process with the fewest documents pinned to it. The documents split at the
+    same time are spread over the processes instead of taking turns in the cache of every process.
+
+    The pools are kept for the lifetime of the worker. Spawned processes don't inherit the sockets
+    and threads of the function host the way forked ones would.
+    """
+    with _process_pools_lock:
+        if len(_process_pools) == 0:
+            context = multiprocessing.get_context("spawn")
+            _process_pools.extend([ProcessPoolExecutor(max_workers=1, mp_context=context), 0] for _ in range(workers))
+        index = min(range(len(_process_pools)), key=lambda i: _process_pools[i][1])
+        _process_pools[index][1] += 1
+        return index
+
+
+def unpin_process_pool(index: int):
+    with _process_pools_lock:
+        if index < len(_process_pools):
+            _process_pools[index][1] -= 1
+
+
+def get_process_pool(index: int) -> ProcessPoolExecutor:
+    with _process_pools_lock:
+        return _process_pools[index][0]
+
+
+def shutdown_process_pool():
+    with _process_pools_lock:
+        for process_pool, _ in _process_pools:
+            process_pool.shutdown(wait=True)
+        _process_pools.clear()
+
+
+class PdfSplitterHandler:
+    """
+    Splits a PDF document into single page PDF documents kept in memory.
+
+    The PyPDF2 work runs in a pool process so the event loop stays free. The process reads the document
+    once, from shared memory or, for documents spooled to disk, from the mapped file, and releases it
+    when the handler exits.
+    """
+
+    def __init__(self, document_stream: BlobStream):
+        self.logger = Logger()
+        self.workers = int(os.getenv('PDF_SPLIT_WORKERS', DEFAULT_PDF_SPLIT_WORKERS))
+        self.document_stream = document_stream
+        self.pdf_reader = None
+        self.pages_count = 0
+        self.reader_lock = threading.Lock()
+        self.shared_memory = None
+        self.source = None
+        self.process_index = None
+
+    async def __aenter__(self):
+        # Parsing the document is CPU bound, it stays off the event loop like the splits
+        self.pdf_reader = await asyncio.to_thread(self.open_reader)
+        self.pages_count = len(self.pdf_reader.pages)
+        if self.workers > 0:
+            if self.document_stream.path is not None:
+                self.source = ("file", self.document_stream.path, self.document_stream.size)
+            else:
+                with self.document_stream.getbuffer() as document_buffer:
+                    self.shared_memory = SharedMemory(create=True, size=max(len(document_buffer), 1))
+                    self.shared_memory.buf[:len(document_buffer)] = document_buffer
+                    self.source = ("memory", self.shared_memory.name, len(document_buffer))
+            self.process_index = pin_process_pool(self.workers)
+        self.logger.info("PSH-EN-01 - Splitting %d pages with %d split workers.", self.pages_count, self.workers)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.process_index is not None:
+            try:
+                # Runs after the splits of the document, the process keeps nothing of it once the handler exits
+                await asyncio.get_running_loop().run_in_executor(
+                    get_process_pool(self.process_index), _release_document_in_worker, self.source
+                )
+            except Exception as e:
+                self.logger.warning("PSH-EX-01 - Error releasing the document in its split process: %s", e)
+            finally:
+                unpin_process_pool(self.process_index)
+                self.process_index = None
+        if self.pdf_reader is not None:
+            await asyncio.to_thread(self.close_reader)
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+            self.shared_memory = None
+        self.source = None
+
+    async def split_page(self, page_index: int) -> bytes:
+        with span("split"):
+            if self.source is not None:
+                return await asyncio.get_running_loop().run_in_executor(
+                    get_process_pool(self.process_index), _split_page_in_worker, self.source, page_index
+                )
+            return await asyncio.to_thread(self.split_page_in_thread, page_index)
+
+    def open_reader(self) -> PdfReader:
+        pdf_reader = PdfReader(self.document_stream.view())
+        # The page tree is read here too, len(pages) parses it the first time
+        len(pdf_reader.pages)
+        return pdf_reader
+
+    def close_reader(self):
+        # Waits for a split still running in a thread, the view of a document kept in memory holds its buffer
+        with self.reader_lock:
+            self.pdf_reader.stream.close()
+            self.pdf_reader = None
+
+    def split_page_in_thread(self, page_index: int) -> bytes:
+        # PdfReader is not thread safe
+        with self.reader_lock:
+            return split_page(self.pdf_reader, page_index)
+
+    async def pages(self) -> AsyncGenerator[Tuple[int, bytes, Exception], None]:
+        """
+        Yields (page index, page bytes, split error) in page order as soon as every page is split,
+        keeping a bounded number of pages being split ahead of the consumer.
+        A page that fails to split is yielded with its error and no bytes, the next pages are still split.
+        """
+        lookahead = max(self.workers, 1) * 2
+        in_flight = []
+        next_page = 0
+        try:
+            while next_page < self.pages_count or len(in_flight) > 0:
+                while next_page < self.pages_count and len(in_flight) < lookahead:
+                    in_flight.append((next_page, asyncio.ensure_future(self.split_page(next_page))))
+                    next_page += 1
+                page_index, split = in_flight.pop(0)
+                try:
+                    pdf_bytes = await split
+                except Exception as e:
+                    yield page_index, None, e
+                    continue
+                yield page_index, pdf_bytes, None
+        finally:
+            for _, split in in_flight:
+                split.cancel()
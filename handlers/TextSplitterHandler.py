@@ -1,4 +1,5 @@
 
+from bisect import bisect_right
 from typing import Generator, List
 from models.Message import Message
 from models.Page import Page, PageSection, SplitPage
@@ -68,6 +69,168 @@ CJK_SENTENCE_ENDINGS = ["。", "！", "？", "‼", "⁇", "⁈", "⁉"]
 DEFAULT_OVERLAP_PERCENT = 10  # See semantic search article for 10% overlap performance
 DEFAULT_SECTION_LENGTH = 1000  # Roughly 400-500 tokens for English
 
+SECTION_ID_INVALID_CHARACTERS = re.compile(r'[^0-9a-zA-Z_-]')
+
+class TextBoundaries:
+    """
+    Finds the sentence endings and word breaks of a text with compiled regex searches bounded to
+    the window being looked at, instead of testing the characters one at a time in Python.
+
+    Text is appended as it is produced and the text before a position can be discarded,
+    positions are always offsets in the whole text.
+    """
+
+    def __init__(self, sentence_endings: List[str], word_breaks: List[str]):
+        self.text = ""
+        self.base = 0  # Offset in the whole text of the first character kept
+        self.sentence_ending_chars = frozenset(sentence_endings)
+        self.sentence_ending_pattern = re.compile(self.character_class(sentence_endings))
+        self.word_break_pattern = re.compile(self.character_class(word_breaks))
+
+    @staticmethod
+    def character_class(characters: List[str]) -> str:
+        return "[" + "".join(re.escape(character) for character in characters) + "]"
+
+    @property
+    def length(self) -> int:
+        return self.base + len(self.text)
+
+    def append(self, text: str):
+        self.text += text
+
+    def discard_before(self, position: int):
+        if position > self.base:
+            self.text = self.text[position - self.base:]
+            self.base = position
+
+    def slice(self, start: int, end: int) -> str:
+        return self.text[start - self.base:end - self.base]
+
+    def is_sentence_ending(self, position: int) -> bool:
+        return self.text[position - self.base] in self.sentence_ending_chars
+
+    def first_sentence_ending(self, low: int, high: int) -> int:
+        """
+        First sentence ending in [low, high), -1 when there is none.
+        """
+        return self.first_match(self.sentence_ending_pattern, low, high)
+
+    def last_sentence_ending(self, low: int, high: int) -> int:
+        """
+        Last sentence ending in [low, high), -1 when there is none.
+        """
+        return self.last_match(self.sentence_ending_pattern, low, high)
+
+    def first_word_break(self, low: int, high: int) -> int:
+        """
+        First word break in [low, high), -1 when there is none.
+        """
+        return self.first_match(self.word_break_pattern, low, high)
+
+    def last_word_break(self, low: int, high: int) -> int:
+        """
+        Last word break in [low, high), -1 when there is none.
+        """
+        return self.last_match(self.word_break_pattern, low, high)
+
+    def first_match(self, pattern: re.Pattern, low: int, high: int) -> int:
+        match = pattern.search(self.text, low - self.base, high - self.base)
+        return match.start() + self.base if match is not None else -1
+
+    def last_match(self, pattern: re.Pattern, low: int, high: int) -> int:
+        position = -1
+        for match in pattern.finditer(self.text, low - self.base, high - self.base):
+            position = match.start() + self.base
+        return position
+
+
+class SectionSplitter:
+    """
+    Splits the text of a document into sections as its pages are added, keeping only the text
+    still needed by the next sections. Gives the same sections as splitting all pages at once.
+    """
+
+    def __init__(self, handler: "TextSplitterHandler", page_full_path: str, message: Message):
+        self.handler = handler
+        self.page_full_path = page_full_path
+        self.message = message
+        self.source_page = handler.original_blob_name_with_file_page_ref(message.fileName, message.storageFilePath, page_full_path)
+        self.boundaries = TextBoundaries(handler.sentence_endings, handler.word_breaks)
+        self.page_offsets = []
+        self.page_indexes = []
+        self.has_text = False
+        self.start = 0
+        self.end = None
+        self.section_text = None
+
+    def find_page(self, offset):
+        i = bisect_right(self.page_offsets, offset) - 1
+        if 0 <= i < len(self.page_indexes) - 1:
+            return self.page_indexes[i]
+        return self.page_indexes[len(self.page_indexes) - 1]
+
+    def add_page(self, page: PageDetail) -> List[PageSection]:
+        """
+        Adds the text of the next page, returns the sections that can be completed with the text added so far.
+        """
+        self.page_offsets.append(page.Offset)
+        self.page_indexes.append(page.Index)
+        self.boundaries.append(page.Text)
+        self.has_text = self.has_text or len(page.Text.strip()) > 0
+        # Documents without any text have no sections, nothing is split until some text is found
+        if not self.has_text:
+            return []
+        return self.split(final=False)
+
+    def finish(self) -> List[PageSection]:
+        """
+        Returns the remaining sections once all the pages were added.
+        """
+        if not self.has_text:
+            return []
+        page_sections = self.split(final=True)
+        end = self.end if self.end is not None else self.boundaries.length
+        if self.start + self.handler.section_overlap < end:
+            page_sections.append(self.handler.create_section(self.page_full_path, self.message, self.source_page, self.start, self.section_text))
+        return page_sections
+
+    def split(self, final: bool) -> List[PageSection]:
+        handler = self.handler
+        boundaries = self.boundaries
+        length = boundaries.length
+        page_sections = []
+        while self.start + handler.section_overlap < length:
+            # Until the last page is added, a section is only split once the text its end search looks at is there
+            if not final and self.start + handler.max_section_length + handler.sentence_search_limit >= length:
+                break
+            start = self.start
+            end = handler.find_section_end(boundaries, start, length)
+            start = handler.find_section_start(boundaries, start, end)
+
+            section_text = boundaries.slice(start, end)
+            page_sections.append(handler.create_section(self.page_full_path, self.message, self.source_page, start, section_text))
+
+            last_table_start = section_text.rfind("<table")
+            if last_table_start > 2 * handler.sentence_search_limit and last_table_start > section_text.rfind("</table"):
+                # If the section ends with an unclosed table, we need to start the next section with the table.
+                # If table starts inside sentence_search_limit, we ignore it, as that will cause an infinite loop for tables longer than MAX_SECTION_LENGTH
+                # If last table starts inside section_overlap, keep overlapping
+                handler.logger.info(
+                    "Section ends with unclosed table, starting next section with the table at page %s offset %d table start %d", self.find_page(start), start, last_table_start
+                )
+                start = min(end - handler.section_overlap, start + last_table_start)
+            else:
+                start = end - handler.section_overlap
+            self.start = start
+            self.end = end
+            self.section_text = section_text
+
+        # The start search of the next section looks back at most max_section_length + 2 * sentence_search_limit
+        # characters, when the section is the last one and ends before start + max_section_length
+        boundaries.discard_before(self.start - handler.max_section_length - 2 * handler.sentence_search_limit)
+        return page_sections
+
+
 class TextSplitterHandler:
     def __init__(self):
         self.logger = Logger()
@@ -78,90 +241,73 @@ class TextSplitterHandler:
         self.section_overlap = int(self.max_section_length * DEFAULT_OVERLAP_PERCENT / 100)
 
     def split_pages(self, page_full_path: str, message: Message, pages: List[PageDetail]) -> List[PageSection]:
-        def find_page(offset):
-            num_pages = len(pages)
-            for i in range(num_pages - 1):
-                if offset >= pages[i].Offset and offset < pages[i + 1].Offset:
-                    return pages[i].Index
-            return pages[num_pages - 1].Index
-
-        all_text = "".join(page.Text for page in pages)
-        if len(all_text.strip()) == 0:
-            return
+        section_splitter = self.section_splitter(page_full_path, message)
         page_sections = []
-        length = len(all_text)
-        start = 0
-        end = length
-        while start + self.section_overlap < length:
-            last_word = -1
-            end = start + self.max_section_length
-
-            if end > length:
-                end = length
-            else:
-                # Try to find the end of the sentence
-                while (
-                    end < length
-                    and (end - start - self.max_section_length) < self.sentence_search_limit
-                    and all_text[end] not in self.sentence_endings
-                ):
-                    if all_text[end] in self.word_breaks:
-                        last_word = end
-                    end += 1
-                if end < length and all_text[end] not in self.sentence_endings and last_word > 0:
-                    end = last_word  # Fall back to at least keeping a whole word
-            if end < length:
-                end += 1
-
-            # Try to find the start of the sentence or at least a whole word boundary
-            last_word = -1
-            while (
-                start > 0
-                and start > end - self.max_section_length - 2 * self.sentence_search_limit
-                and all_text[start] not in self.sentence_endings
-            ):
-                if all_text[start] in self.word_breaks:
-                    last_word = start
-                start -= 1
-            if all_text[start] not in self.sentence_endings and last_word > 0:
-                start = last_word
-            if start > 0:
-                start += 1
-
-            section_text = all_text[start:end]
-            page_sections.append(PageSection(
-                id = re.sub(r'[^0-9a-zA-Z_-]', '_', f'{page_full_path}-{start}').lstrip('_'),
-                content=section_text,
-                source_page=self.original_blob_name_with_file_page_ref(message.fileName, message.storageFilePath, page_full_path),
-                source_file=page_full_path,
-                original_doc_source=message.storageFilePath,
-                theme=message.theme,
-                sub_theme=message.subtheme
-            ))
+        for page in pages:
+            page_sections += section_splitter.add_page(page)
+        page_sections += section_splitter.finish()
+        if not section_splitter.has_text:
+            return
+        return page_sections
 
-            last_table_start = section_text.rfind("<table")
-            if last_table_start > 2 * self.sentence_search_limit and last_table_start > section_text.rfind("</table"):
-                # If the section ends with an unclosed table, we need to start the next section with the table.
-                # If table starts inside sentence_search_limit, we ignore it, as that will cause an infinite loop for tables longer than MAX_SECTION_LENGTH
-                # If last table starts inside section_overlap, keep overlapping
-                self.logger.info(
-                    f"Section ends with unclosed table, starting next section with the table at page {find_page(start)} offset {start} table start {last_table_start}"
-                )
-                start = min(end - self.section_overlap, start + last_table_start)
+    def section_splitter(self, page_full_path: str, message: Message) -> SectionSplitter:
+        """
+        Splits the pages of a document as they are produced, see SectionSplitter.
+        """
+        return SectionSplitter(self, page_full_path, message)
+
+    def find_section_end(self, boundaries: TextBoundaries, start: int, length: int) -> int:
+        """
+        End (exclusive) of the section starting at start: the first sentence ending within
+        sentence_search_limit characters past max_section_length, else the last word break before it.
+        """
+        end = start + self.max_section_length
+        if end > length:
+            return length
+
+        search_end = min(end + self.sentence_search_limit, length)
+        sentence_end = boundaries.first_sentence_ending(end, search_end)
+        if sentence_end >= 0:
+            end = sentence_end
+        else:
+            last_word = boundaries.last_word_break(end, search_end)
+            end = search_end
+            if end < length and not boundaries.is_sentence_ending(end) and last_word > 0:
+                end = last_word  # Fall back to at least keeping a whole word
+        if end < length:
+            end += 1
+        return end
+
+    def find_section_start(self, boundaries: TextBoundaries, start: int, end: int) -> int:
+        """
+        Moves start back to just after the previous sentence ending, searching back to
+        2 * sentence_search_limit characters before the section's max length, else to a word break.
+        """
+        search_start = max(end - self.max_section_length - 2 * self.sentence_search_limit, 0)
+        last_word = -1
+        if start > search_start:
+            sentence_start = boundaries.last_sentence_ending(search_start + 1, start + 1)
+            if sentence_start >= 0:
+                start = sentence_start
             else:
-                start = end - self.section_overlap
-
-        if start + self.section_overlap < end:
-            page_sections.append(PageSection(
-                id = re.sub(r'[^0-9a-zA-Z_-]', '_', f'{page_full_path}-{start}').lstrip('_'),
-                content=section_text,
-                source_page=self.original_blob_name_with_file_page_ref(message.fileName, message.storageFilePath, page_full_path),
-                source_file=page_full_path,
-                original_doc_source=message.storageFilePath,
-                theme=message.theme,
-                sub_theme=message.subtheme
-            ))
-        return page_sections
+                last_word = boundaries.first_word_break(search_start + 1, start + 1)
+                start = search_start
+        if not boundaries.is_sentence_ending(start) and last_word > 0:
+            start = last_word
+        if start > 0:
+            start += 1
+        return start
+
+    def create_section(self, page_full_path: str, message: Message, source_page: str, start: int, section_text: str) -> PageSection:
+        return PageSection(
+            id = SECTION_ID_INVALID_CHARACTERS.sub('_', f'{page_full_path}-{start}').lstrip('_'),
+            content=section_text,
+            source_page=source_page,
+            source_file=page_full_path,
+            original_doc_source=message.storageFilePath,
+            theme=message.theme,
+            sub_theme=message.subtheme
+        )
     
     def original_blob_name_with_file_page_ref(self, file_name: str, original_file_path: str, page_name_full_path: str) -> str:
         page_no = page_name_full_path.split('-')[-1].split('.')[0]
@@ -0,0 +1,110 @@
+import io
+import mmap
+from typing import Union
+
+
+class MemoryBlobStream(io.BytesIO):
+    """
+    Downloaded blob kept in memory.
+    """
+
+    path = None
+
+    @property
+    def size(self) -> int:
+        return len(self.getbuffer())
+
+    def view(self) -> "BlobBufferView":
+        # Independent stream over the same content, with its own position, the content is not copied
+        return BlobBufferView(self.getbuffer())
+
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            # A view still reads the content, it is freed together with the last view
+            pass
+
+
+class BlobBufferView(io.RawIOBase):
+    """
+    Read only stream over the content of a downloaded blob, with its own position.
+    """
+
+    def __init__(self, buffer):
+        super().__init__()
+        self.buffer = buffer
+        self.position = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.buffer)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        data = bytes(self.buffer[self.position:end])
+        self.position = max(end, self.position)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        self.position = max(self.position, 0)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer)
+
+    def close(self):
+        if not self.closed and isinstance(self.buffer, memoryview):
+            self.buffer.release()
+        super().close()
+
+
+class MappedBlobStream(BlobBufferView):
+    """
+    Downloaded blob spooled to a named temporary file and memory mapped, so the content is paged in
+    from disk on demand instead of being held in the process memory.
+
+    The file path can be opened by other processes while the stream is open.
+    """
+
+    def __init__(self, temp_file, mapped_file: mmap.mmap = None, owner: bool = True):
+        super().__init__(mapped_file if mapped_file is not None else mmap.mmap(temp_file.fileno(), 0, access=mmap.ACCESS_READ))
+        self.temp_file = temp_file
+        self.path = temp_file.name
+        self.mapped_file = self.buffer
+        self.owner = owner
+
+    def view(self) -> "MappedBlobStream":
+        # Independent stream over the same mapping, closing it doesn't close the mapping
+        return MappedBlobStream(self.temp_file, self.mapped_file, owner=False)
+
+    def close(self):
+        if not self.closed and self.owner:
+            self.mapped_file.close()
+            self.temp_file.close()
+        super().close()
+
+
+BlobStream = Union[MemoryBlobStream, MappedBlobStream]
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Hashable
+from services.Logger import Logger
+
+
+class PooledClient:
+    def __init__(self, client):
+        self.client = client
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+
+class ClientPool:
+    """
+    Long-lived async clients created on first use by key and shared by all the tasks of the worker.
+
+    Clients that were not used for idle_seconds are closed, and once the pool holds max_size clients
+    the least recently used idle client is closed to make room for a new one.
+    """
+
+    def __init__(self, name: str, factory: Callable[[Hashable], Any], max_size: int, idle_seconds: float):
+        self.logger = Logger()
+        self.name = name
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.clients: Dict[Hashable, PooledClient] = {}
+        self.lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def client(self, key: Hashable):
+        async with self.lock:
+            await self.evict_idle()
+            pooled = self.clients.get(key)
+            if pooled is None:
+                await self.make_room()
+                pooled = PooledClient(self.factory(key))
+                self.clients[key] = pooled
+                self.logger.info("CP-CL-01 - Created %s client for %s. Pool size: %d", self.name, key, len(self.clients))
+            pooled.leases += 1
+        try:
+            yield pooled.client
+        finally:
+            pooled.leases -= 1
+            pooled.last_used = time.monotonic()
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        for key, pooled in list(self.clients.items()):
+            if pooled.leases == 0 and now - pooled.last_used > self.idle_seconds:
+                await self.evict(key)
+
+    async def make_room(self):
+        # Clients in use are never closed, the pool can briefly grow past max_size when all are busy
+        while len(self.clients) >= self.max_size:
+            idle = [(pooled.last_used, key) for key, pooled in self.clients.items() if pooled.leases == 0]
+            if len(idle) == 0:
+                return
+            await self.evict(min(idle)[1])
+
+    async def evict(self, key: Hashable):
+        pooled = self.clients.pop(key)
+        self.logger.info("CP-EV-01 - Closing %s client for %s. Pool size: %d", self.name, key, len(self.clients))
+        await pooled.client.close()
+
+    async def close(self):
+        async with self.lock:
+            for key in list(self.clients.keys()):
+                await self.evict(key)
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+
+DEFAULT_HTTP_POOL_SIZE = 100  # Connections kept by the shared session across all hosts
+
+_session = None
+_session_loop = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Returns the aiohttp session shared by the async Azure clients of the worker, so they reuse
+    pooled connections instead of each opening its own. Must be called from the event loop.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        # Same settings azure-core uses for the sessions it owns
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=int(os.getenv('HTTP_POOL_SIZE', DEFAULT_HTTP_POOL_SIZE))),
+            trust_env=True,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            auto_decompress=False
+        )
+        _session_loop = loop
+    return _session
+
+
+def create_shared_transport() -> AioHttpTransport:
+    # The clients closing their transport leave the shared session open
+    return AioHttpTransport(session=get_http_session(), session_owner=False)
+
+
+async def close_http_session():
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
@@ -1,14 +1,31 @@
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
+from azure.identity.aio import DefaultAzureCredential
+from azure.keyvault.secrets.aio import SecretClient
 import os
+import time
+
+DEFAULT_KEY_VAULT_SECRET_REFRESH_SECONDS = 3600  # Secrets are read again from Key Vault once they are older than this
 
 class KeyVault:
-    def __init__(self):
-        self.credential = DefaultAzureCredential()
+    def __init__(self, credential: DefaultAzureCredential = None):
+        self.owns_credential = credential is None
+        self.credential = credential if credential is not None else DefaultAzureCredential()
         self.key_vault_uri = os.getenv('KEY_VAULT_NAME_ENDPOINT')
         if self.key_vault_uri is None:
             raise ValueError("KEY_VAULT_NAME_ENDPOINT environment variable is not set")
         self.client = SecretClient(vault_url=self.key_vault_uri, credential=self.credential)
+        self.refresh_seconds = float(os.getenv('KEY_VAULT_SECRET_REFRESH_SECONDS', DEFAULT_KEY_VAULT_SECRET_REFRESH_SECONDS))
+        # Secret name -> (value, time it was read)
+        self.secrets = {}
+
+    async def get_secret(self, secret_name):
+        cached = self.secrets.get(secret_name)
+        if cached is not None and time.monotonic() - cached[1] < self.refresh_seconds:
+            return cached[0]
+        value = (await self.client.get_secret(secret_name)).value
+        self.secrets[secret_name] = (value, time.monotonic())
+        return value
 
-    def get_secret(self, secret_name):
-        return self.client.get_secret(secret_name).value
\ No newline at end of file
+    async def close(self):
+        await self.client.close()
+        if self.owns_credential:
+            await self.credential.close()
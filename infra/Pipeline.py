@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterable, Awaitable, Callable, Dict, List
+from models.PipelineStageMetrics import PipelineStageMetrics
+from services.Logger import Lazy, Logger
+
+DEFAULT_PIPELINE_QUEUE_SIZE = 4  # Items waiting in front of every stage, a full queue holds back the stage feeding it
+
+_END = object()
+
+
+class PipelineItem:
+    """
+    Unit of work moving through the stages of a Pipeline.
+
+    A stage that fails sets error and a stage that finishes the work early sets completed,
+    the next stages are skipped except the ones that run for every item.
+    """
+
+    def __init__(self):
+        self.error: Exception = None
+        self.completed = False
+        self.enqueued_at = 0.0
+
+
+class PipelineStage:
+    def __init__(self, name: str, handler: Callable[[PipelineItem], Awaitable[None]], workers: int = 1, run_always: bool = False):
+        self.name = name
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.run_always = run_always
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, every stage runs its own workers so the stages work on different
+    items at the same time, and a slow stage fills its queue and holds back the stages before it.
+
+    The metrics of every stage (items, handler latency, time waited in its queue and queue depth)
+    are kept by stage name, and the source is measured as a stage of its own.
+    """
+
+    def __init__(self, name: str, stages: List[PipelineStage], queue_size: int = None, source_name: str = "source"):
+        self.logger = Logger()
+        self.name = name
+        self.stages = stages
+        self.queue_size = queue_size if queue_size is not None else int(os.getenv('PIPELINE_QUEUE_SIZE', DEFAULT_PIPELINE_QUEUE_SIZE))
+        self.source_name = source_name
+        self.metrics: Dict[str, PipelineStageMetrics] = {source_name: PipelineStageMetrics()}
+        for stage in stages:
+            self.metrics[stage.name] = PipelineStageMetrics()
+
+    @staticmethod
+    def stage_workers(name: str, default: int) -> int:
+        return int(os.getenv(f"PIPELINE_{name.upper()}_WORKERS", default))
+
+    async def run(self, source: AsyncIterable[PipelineItem]):
+        """
+        Feeds the items of the source through the stages and returns once every item went through all of them.
+        The items already in the pipeline are finished when the source fails, then its error is raised.
+        """
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        workers = []
+        for k, stage in enumerate(self.stages):
+            next_stage = self.stages[k + 1] if k + 1 < len(self.stages) else None
+            next_queue = queues[k + 1] if next_stage is not None else None
+            workers.append([asyncio.ensure_future(self.work(stage, queues[k], next_stage, next_queue)) for _ in range(stage.workers)])
+
+        source_metrics = self.metrics[self.source_name]
+        source_error = None
+        try:
+            try:
+                started = time.perf_counter()
+                async for item in source:
+                    source_metrics.items += 1
+                    source_metrics.busy_seconds += time.perf_counter() - started
+                    await self.put(queues[0], self.metrics[self.stages[0].name], item)
+                    started = time.perf_counter()
+            except Exception as e:
+                source_error = e
+
+            # Every stage is closed once all the workers of the stage before it are done
+            for k, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    await queues[k].put(_END)
+                await asyncio.gather(*workers[k])
+        except BaseException:
+            for stage_workers in workers:
+                for worker in stage_workers:
+                    worker.cancel()
+            raise
+
+        self.log_metrics()
+        if source_error is not None:
+            raise source_error
+
+    async def work(self, stage: PipelineStage, queue: asyncio.Queue, next_stage: PipelineStage, next_queue: asyncio.Queue):
+        metrics = self.metrics[stage.name]
+        while True:
+            item = await queue.get()
+            if item is _END:
+                return
+            metrics.waited_seconds += time.perf_counter() - item.enqueued_at
+
+            if stage.run_always or (item.error is None and not item.completed):
+                started = time.perf_counter()
+                try:
+                    await stage.handler(item)
+                except Exception as e:
+                    self.logger.error("PL-WK-01 - Stage %s of pipeline %s failed. Error: %s", stage.name, self.name, e)
+                    item.error = e
+                    metrics.failed += 1
+                elapsed = time.perf_counter() - started
+                metrics.items += 1
+                metrics.busy_seconds += elapsed
+                metrics.max_seconds = max(metrics.max_seconds, elapsed)
+            else:
+                metrics.skipped += 1
+
+            if next_queue is not None:
+                await self.put(next_queue, self.metrics[next_stage.name], item)
+
+    @staticmethod
+    async def put(queue: asyncio.Queue, metrics: PipelineStageMetrics, item: PipelineItem):
+        metrics.record_queue_depth(queue.qsize())
+        item.enqueued_at = time.perf_counter()
+        await queue.put(item)
+
+    def log_metrics(self):
+        for name, metrics in self.metrics.items():
+            self.logger.info("PL-RN-01 - Pipeline %s stage %s: %s", self.name, name, Lazy(metrics.to_string))
@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+
+@dataclass
+class BlobDeletionSummary:
+    deleted: int = 0
+    missing: int = 0
+    failed: int = 0
+
+    def add(self, other: "BlobDeletionSummary"):
+        self.deleted += other.deleted
+        self.missing += other.missing
+        self.failed += other.failed
+
+    def to_string(self):
+        return f"Deleted: {self.deleted}, Already missing: {self.missing}, Failed: {self.failed}"
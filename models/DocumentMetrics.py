@@ -0,0 +1,29 @@
+from dataclasses import dataclass, field
+from typing import Dict
+from models.SpanMetrics import SpanMetrics
+
+@dataclass
+class DocumentMetrics:
+    """
+    Time spent by a document in every step of its indexing (download, split, analyze, chunk, embed, index, cosmos...)
+    and what it cost (analyzed pages, sections, embedding tokens, bytes, retries).
+    """
+    file_id: str = None
+    theme: str = None
+    language: str = None
+    counters: Dict[str, int] = field(default_factory=dict)
+    spans: Dict[str, SpanMetrics] = field(default_factory=dict)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_span(self, name: str, seconds: float):
+        self.spans.setdefault(name, SpanMetrics()).add(seconds)
+
+    def tags(self) -> Dict[str, str]:
+        return {"theme": self.theme, "language": self.language, "fileId": self.file_id}
+
+    def to_string(self):
+        counters = ", ".join(f"{name}: {value}" for name, value in sorted(self.counters.items()))
+        spans = ", ".join(f"{name}: {span.to_string()}" for name, span in self.spans.items())
+        return f"File ID: {self.file_id}, Theme: {self.theme}, Language: {self.language}, Counters: [{counters}], Spans: [{spans}]"
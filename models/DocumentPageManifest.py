@@ -0,0 +1,94 @@
+import hashlib
+from typing import Dict, List
+
+FINGERPRINT_CHUNK_BYTES = 1024 * 1024
+
+
+class DocumentPageManifest:
+    """
+    Pages recorded for a document by its previous indexing, by page number, used to skip the pages
+    whose fingerprint (hash of the page bytes and the pipeline settings) didn't change.
+
+    When a re-index starts, the documentPages entries are moved to previousDocumentPages and documentPages
+    is filled again. A retried re-index finds its own entries in documentPages, those pages are already recorded,
+    and the pageCheckpoints of the pages it left halfway, by page number, with the last stage they completed.
+    """
+
+    def __init__(self, previous_pages: List[dict], recorded_pages: List[dict], resumed: bool, checkpoints: Dict[str, dict] = None):
+        self.previous_page_list = previous_pages
+        self.previous_pages: Dict[int, dict] = {page.get("pageNumber"): page for page in previous_pages}
+        self.recorded_pages: Dict[int, dict] = {page.get("pageNumber"): page for page in recorded_pages}
+        self.resumed = resumed
+        self.checkpoints: Dict[int, dict] = {int(page_number): checkpoint for page_number, checkpoint in (checkpoints or {}).items()}
+
+    @classmethod
+    def from_document(cls, document: dict) -> "DocumentPageManifest":
+        document = document or {}
+        if document.get("previousDocumentPages") is not None:
+            return cls(document["previousDocumentPages"], document.get("documentPages") or [], resumed=True,
+                       checkpoints=document.get("pageCheckpoints"))
+        return cls(document.get("documentPages") or [], [], resumed=False)
+
+    @staticmethod
+    def fingerprint(page_bytes: bytes, pipeline_settings: str) -> str:
+        return DocumentPageManifest.fingerprint_stream([page_bytes], pipeline_settings)
+
+    @staticmethod
+    def fingerprint_stream(chunks, pipeline_settings: str) -> str:
+        digest = hashlib.sha256(pipeline_settings.encode('utf-8'))
+        digest.update(b"\0")
+        for chunk in chunks:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def read_chunks(stream):
+        while True:
+            chunk = stream.read(FINGERPRINT_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+    def is_recorded(self, page_number: int, fingerprint: str) -> bool:
+        """
+        The page was already indexed and recorded in documentPages by an earlier attempt of this re-index.
+        """
+        page = self.recorded_pages.get(page_number)
+        return page is not None and page.get("fingerprint") == fingerprint
+
+    def checkpoint(self, page_number: int, fingerprint: str) -> dict:
+        """
+        Last stage completed for the page by an earlier attempt of this re-index, when the page didn't change since, else None.
+        """
+        checkpoint = self.checkpoints.get(page_number)
+        if checkpoint is not None and checkpoint.get("fingerprint") == fingerprint:
+            return checkpoint
+        return None
+
+    def unchanged_page(self, page_number: int, fingerprint: str) -> dict:
+        """
+        Entry of the previous indexing of the page when its fingerprint didn't change, else None.
+        """
+        page = self.previous_pages.get(page_number)
+        if page is not None and page.get("fingerprint") == fingerprint:
+            return page
+        return None
+
+    def stale_pages(self, current_pages: List[dict]) -> List[dict]:
+        """
+        Previous pages that are no longer part of the document.
+        """
+        current_page_numbers = set(page.get("pageNumber") for page in current_pages)
+        return [page for page_number, page in self.previous_pages.items() if page_number not in current_page_numbers]
+
+    def stale_section_ids(self, current_pages: List[dict]) -> List[str]:
+        """
+        Ids of the sections of the previous indexing that none of the current pages uploaded again.
+        """
+        current_ids = set(section_id for page in current_pages for section_id in page.get("sectionIds") or [])
+        stale_ids = {}
+        for page in self.previous_page_list:
+            for section_id in page.get("sectionIds") or []:
+                if section_id not in current_ids:
+                    stale_ids[section_id] = True
+        return list(stale_ids.keys())
@@ -1,13 +1,27 @@
 class DocumentsKBPage:
-    def __init__(self, file_page_name, storage_file_path, page_number, index_status, index_completion_date):
+    def __init__(self, file_page_name, storage_file_path, page_number, index_status, index_completion_date, section_ids=None, fingerprint=None):
         self.file_page_name = file_page_name
         self.storage_file_path = storage_file_path
         self.page_number = page_number
         self.index_status = index_status
         self.index_completion_date = index_completion_date
+        self.section_ids = section_ids or []
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_dict(cls, document_page: dict) -> "DocumentsKBPage":
+        return cls(
+            file_page_name=document_page.get("filePageName"),
+            storage_file_path=document_page.get("storageFilePath"),
+            page_number=document_page.get("pageNumber"),
+            index_status=document_page.get("indexStatus"),
+            index_completion_date=document_page.get("indexCompletionDate"),
+            section_ids=document_page.get("sectionIds"),
+            fingerprint=document_page.get("fingerprint")
+        )
 
     def to_string(self):
-        return f"File Page Name: {self.file_page_name}\nStorage File Path: {self.storage_file_path}\nPage Number: {self.page_number}\nIndex Status: {self.index_status}\nIndex Completion Date: {self.index_completion_date}"
+        return f"File Page Name: {self.file_page_name}\nStorage File Path: {self.storage_file_path}\nPage Number: {self.page_number}\nIndex Status: {self.index_status}\nIndex Completion Date: {self.index_completion_date}\nSections: {len(self.section_ids)}"
     
     def to_dict(self):
         return {
@@ -15,5 +29,7 @@ class DocumentsKBPage:
             "storageFilePath": self.storage_file_path,
             "pageNumber": self.page_number,
             "indexStatus": self.index_status,
-            "indexCompletionDate": self.index_completion_date
+            "indexCompletionDate": self.index_completion_date,
+            "sectionIds": self.section_ids,
+            "fingerprint": self.fingerprint
         }
\ No newline at end of file
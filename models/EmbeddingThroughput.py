@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+
+@dataclass
+class EmbeddingThroughput:
+    sections: int = 0
+    tokens: int = 0
+    requests: int = 0
+    elapsed_seconds: float = 0.0
+
+    def sections_per_second(self) -> float:
+        return self.sections / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def add(self, other: "EmbeddingThroughput"):
+        self.sections += other.sections
+        self.tokens += other.tokens
+        self.requests += other.requests
+        self.elapsed_seconds += other.elapsed_seconds
+
+    def to_string(self):
+        return f"Sections: {self.sections}, Tokens: {self.tokens}, Requests: {self.requests}, Elapsed: {self.elapsed_seconds:.2f}s, Sections/s: {self.sections_per_second():.2f}, Tokens/s: {self.tokens_per_second():.2f}"
@@ -0,0 +1,22 @@
+from dataclasses import dataclass, field
+from typing import List
+
+@dataclass
+class IndexingResult:
+    succeeded_ids: List[str] = field(default_factory=list)
+    failed_ids: List[str] = field(default_factory=list)
+    error: str = None
+
+    def succeeded(self) -> bool:
+        return self.error is None and len(self.failed_ids) == 0
+
+    def uploaded_ids(self) -> List[str]:
+        return self.succeeded_ids + self.failed_ids
+
+    def add(self, other: "IndexingResult"):
+        self.succeeded_ids += other.succeeded_ids
+        self.failed_ids += other.failed_ids
+        self.error = self.error or other.error
+
+    def to_string(self):
+        return f"Succeeded: {len(self.succeeded_ids)}, Failed: {len(self.failed_ids)}, Error: {self.error}"
@@ -11,10 +11,25 @@ class Message:
         self.theme = data.get('theme')
         self.subtheme = data.get('subtheme')
         self.language = data.get('language')
+        # Number of times the indexing of the document was continued in a new message
+        self.continuation = int(data.get('continuation', 0))
         
     def to_string(self):
-        return f"Action: {self.action}, File ID: {self.fileId}, Storage File Path: {self.storageFilePath}, File Name: {self.fileName}, Original File Format: {self.originalFileFormat}, Theme: {self.theme}, Subtheme: {self.subtheme}, Language: {self.language}"
+        return f"Action: {self.action}, File ID: {self.fileId}, Storage File Path: {self.storageFilePath}, File Name: {self.fileName}, Original File Format: {self.originalFileFormat}, Theme: {self.theme}, Subtheme: {self.subtheme}, Language: {self.language}, Continuation: {self.continuation}"
     
+    def to_dict(self):
+        return {
+            "action": getattr(self.action, "value", self.action),
+            "fileId": self.fileId,
+            "storageFilePath": self.storageFilePath,
+            "fileName": self.fileName,
+            "originalFileFormat": self.originalFileFormat,
+            "theme": self.theme,
+            "subtheme": self.subtheme,
+            "language": self.language,
+            "continuation": self.continuation
+        }
+
     def file_path_without_extension(self):
         file_path_without_extension, _ = os.path.splitext(self.storageFilePath)
         return file_path_without_extension
\ No newline at end of file
@@ -0,0 +1,10 @@
+from dataclasses import dataclass
+
+@dataclass
+class MessageResult:
+    """
+    Work done by a single invocation: the pages processed by it, not the ones recorded by an earlier attempt
+    or continuation, and whether it completed the indexing of a document.
+    """
+    pages: int = 0
+    completed_document: bool = False
@@ -0,0 +1,42 @@
+from dataclasses import dataclass
+
+@dataclass
+class PipelineStageMetrics:
+    items: int = 0
+    failed: int = 0
+    skipped: int = 0
+    busy_seconds: float = 0.0
+    max_seconds: float = 0.0
+    waited_seconds: float = 0.0
+    queue_depth_sum: int = 0
+    queue_depth_samples: int = 0
+    max_queue_depth: int = 0
+
+    def record_queue_depth(self, depth: int):
+        self.queue_depth_sum += depth
+        self.queue_depth_samples += 1
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def average_seconds(self) -> float:
+        return self.busy_seconds / self.items if self.items > 0 else 0.0
+
+    def average_wait_seconds(self) -> float:
+        processed = self.items + self.skipped
+        return self.waited_seconds / processed if processed > 0 else 0.0
+
+    def average_queue_depth(self) -> float:
+        return self.queue_depth_sum / self.queue_depth_samples if self.queue_depth_samples > 0 else 0.0
+
+    def add(self, other: "PipelineStageMetrics"):
+        self.items += other.items
+        self.failed += other.failed
+        self.skipped += other.skipped
+        self.busy_seconds += other.busy_seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.waited_seconds += other.waited_seconds
+        self.queue_depth_sum += other.queue_depth_sum
+        self.queue_depth_samples += other.queue_depth_samples
+        self.max_queue_depth = max(self.max_queue_depth, other.max_queue_depth)
+
+    def to_string(self):
+        return f"Items: {self.items}, Failed: {self.failed}, Skipped: {self.skipped}, Busy: {self.busy_seconds:.2f}s, Avg: {self.average_seconds():.3f}s, Max: {self.max_seconds:.3f}s, Avg wait: {self.average_wait_seconds():.3f}s, Avg queue depth: {self.average_queue_depth():.2f}, Max queue depth: {self.max_queue_depth}"
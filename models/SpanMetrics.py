@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+
+@dataclass
+class SpanMetrics:
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_string(self):
+        return f"{self.seconds:.2f}s in {self.count} (max {self.max_seconds:.3f}s)"
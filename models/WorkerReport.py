@@ -0,0 +1,31 @@
+from dataclasses import dataclass
+from models.MessageResult import MessageResult
+
+@dataclass
+class WorkerReport:
+    documents: int = 0
+    pages: int = 0
+    failed: int = 0
+    elapsed_seconds: float = 0.0
+
+    def documents_per_minute(self) -> float:
+        return self.documents * 60 / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def pages_per_minute(self) -> float:
+        return self.pages * 60 / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def add_message(self, result: MessageResult):
+        # Continuations and delete messages add their pages but are not documents of their own
+        if result.completed_document:
+            self.documents += 1
+        self.pages += result.pages
+
+    def add(self, other: "WorkerReport"):
+        # Worker processes run side by side, the elapsed time is the longest one
+        self.documents += other.documents
+        self.pages += other.pages
+        self.failed += other.failed
+        self.elapsed_seconds = max(self.elapsed_seconds, other.elapsed_seconds)
+
+    def to_string(self):
+        return f"Documents: {self.documents}, Pages: {self.pages}, Failed: {self.failed}, Elapsed: {self.elapsed_seconds:.2f}s, Docs/min: {self.documents_per_minute():.2f}, Pages/min: {self.pages_per_minute():.2f}"
@@ -1,75 +1,74 @@
 import asyncio
-import os
+from exceptions.ProcessorExceptions import SectionDeletionError
 from models.Message import Message
 from repositories.CosmosRepository import CosmosRepository
-from services.Logger import Logger
+from services.AzureSearchEmbedService import AzureSearchEmbedService
+from services.Logger import Lazy, Logger
 from services.StorageContainerService import StorageContainerService
-from azure.search.documents import SearchClient
-from azure.identity import DefaultAzureCredential
 
 class DeleteProcessor:
     
-    def __init__(self, cosmos_repository: CosmosRepository, storage_container_service: StorageContainerService):
+    def __init__(self, cosmos_repository: CosmosRepository, storage_container_service: StorageContainerService, search_embed_service: AzureSearchEmbedService):
         self.logger = Logger()
         self.cosmos_repository = cosmos_repository
         self.storage_container_service = storage_container_service
+        self.search_embed_service = search_embed_service
 
     async def process(self, message: Message):
         self.logger.info("DP-PR-01 - Starting delete processor.")
 
-        document = self.cosmos_repository.get_by_id("documentskb", message.fileId)
+        document = await self.cosmos_repository.get_by_id("documentskb", message.fileId)
 
         if document is None:
-            self.logger.error("DP-PR-02 - Document not found or document is not ready to be deleted Check Index Status. FileId: "+message.fileId)
+            self.logger.error("DP-PR-02 - Document not found or document is not ready to be deleted Check Index Status. FileId: %s", message.fileId)
             return
         
-        self.storage_container_service.delete_blob("originaldocuments", message.storageFilePath)
-        self.storage_container_service.delete_blobs_in_folder("documentpages", message.file_path_without_extension())
-        self.storage_container_service.delete_blobs_in_folder("corpus", message.file_path_without_extension())    
-        await self.remove_from_index_async(message)
-        self.cosmos_repository.delete("documentskb", message.fileId)
-
-    async def remove_from_index_async(self, message: Message):
+        original_summary, pages_summary, corpus_summary = await asyncio.gather(
+            self.storage_container_service.delete_blob("originaldocuments", message.storageFilePath),
+            self.storage_container_service.delete_blobs_in_folder("documentpages", message.file_path_without_extension()),
+            self.storage_container_service.delete_blobs_in_folder("corpus", message.file_path_without_extension())
+        )
+        self.logger.info("DP-PR-03 - Deleted blobs. Original document: %s. Document pages: %s. Corpus: %s.",
+                         Lazy(original_summary.to_string), Lazy(pages_summary.to_string), Lazy(corpus_summary.to_string))
+        await self.remove_from_index_async(message, document)
+        await self.cosmos_repository.delete("documentskb", message.fileId)
+
+    async def remove_from_index_async(self, message: Message, document: dict):
         search_index_name = self.get_azure_search_index_name_for(message)
 
-        self.logger.info(f"DP-RI-01 - Removing sections from original document '{message.storageFilePath}' from search index '{search_index_name}' for file {message.fileId}")
-
-        search_client = SearchClient(endpoint=os.getenv('AZURE_SEARCH_SERVICE_ENDPOINT'),
-                                     index_name=self.get_azure_search_index_name_for(message),
-                                     credential=DefaultAzureCredential()
-                                    )
-        while True:
-            filter = f"originaldocsource eq '{message.storageFilePath}'"
-            
-            result = search_client.search(
-                search_text="", filter=filter, top=1000, include_total_count=True
-            )
-
-            result_count = result.get_count()
-            
-            if result_count == 0:
-                self.logger.info("DP-RI-02 - No more sections to remove from search index "+search_index_name+" from original document "+message.storageFilePath+".")
-                break
-
-            documents_to_remove = []
+        self.logger.info("DP-RI-01 - Removing sections from original document '%s' from search index '%s' for file %s", message.storageFilePath, search_index_name, message.fileId)
 
-            for document in result:
-                documents_to_remove.append({"id": document["id"]})
-
-            self.logger.info(str(len(documents_to_remove)) + " documents to remove")
-            if len(documents_to_remove) == 0:
-                self.logger.info("DP-RI-03 - No more sections to remove from search index "+search_index_name+" from original document "+message.storageFilePath+".")
-                break
-
-            removed_docs = search_client.delete_documents(documents_to_remove)
-            self.logger.info("DP-RI-03 - Removed "+str(len(removed_docs))+" sections from search index "+search_index_name+" from original document "+message.storageFilePath+".")
-
-            # It can take a few seconds for search results to reflect changes, so wait a bit
-            await asyncio.sleep(2)
-
-        if removed_docs != None:
-            self.logger.info("DP-RI-04 - Removed "+str(len(removed_docs))+" sections from search index "+search_index_name+" from original document "+message.storageFilePath+".")
+        async with self.search_embed_service.search_client(search_index_name) as search_client:
+            # The ids of the sections indexed for every page are kept with the page in Cosmos
+            manifest_ids = self.get_manifest_section_ids(document)
+            self.logger.info("DP-RI-02 - Removing %d sections recorded for the document pages from search index %s.", len(manifest_ids), search_index_name)
+            removed_count = await self.search_embed_service.delete_sections(search_client, manifest_ids)
 
+            # Sweep for sections not recorded in the pages, i.e. documents indexed before the ids were
+            # recorded. The query results are collected before deleting so paging isn't affected.
+            filter = f"originaldocsource eq '{message.storageFilePath}'"
+            result = await search_client.search(search_text="", filter=filter, select=["id"])
+            known_ids = set(manifest_ids)
+            unrecorded_ids = [document["id"] async for document in result if document["id"] not in known_ids]
+
+            self.logger.info("DP-RI-03 - Found %d sections not recorded for the document pages in search index %s.", len(unrecorded_ids), search_index_name)
+            removed_count += await self.search_embed_service.delete_sections(search_client, unrecorded_ids)
+
+        self.logger.info("DP-RI-04 - Removed %d sections from search index %s from original document %s.", removed_count, search_index_name, message.storageFilePath)
+
+        # The document keeps the section ids, it is only deleted once no section is left behind
+        section_count = len(manifest_ids) + len(unrecorded_ids)
+        if removed_count < section_count:
+            self.logger.error("DP-RI-05 - Failed to remove %d sections of %s, the document is kept to retry.", section_count - removed_count, message.storageFilePath)
+            raise SectionDeletionError(message.fileName, section_count - removed_count)
+
+    def get_manifest_section_ids(self, document: dict):
+        section_ids = {}
+        # An interrupted re-index keeps the pages of the previous indexing aside
+        for page in (document.get("documentPages") or []) + (document.get("previousDocumentPages") or []):
+            for section_id in page.get("sectionIds") or []:
+                section_ids[section_id] = True
+        return list(section_ids.keys())
 
     def get_azure_search_index_name_for(self, message: Message):
         return message.theme + "-index-" + message.language
\ No newline at end of file
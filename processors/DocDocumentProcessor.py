@@ -1,14 +1,16 @@
 import datetime
-from io import BytesIO
+from infra.BlobStream import BlobStream
 from pathlib import Path
-import tempfile
+from models.DocumentPageManifest import DocumentPageManifest
 from models.DocumentsKBPage import DocumentsKBPage
 from models.IndexStatus import IndexStatus
 from models.Message import Message
-from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient
 from repositories.CosmosRepository import CosmosRepository
+from repositories.DocumentPageWriter import DocumentPageWriter
 from services.AzureSearchEmbedService import AzureSearchEmbedService
-from services.Logger import Logger
+from services.Logger import Lazy, Logger
+from services.Metrics import count
 from services.StorageContainerService import StorageContainerService
 
 
@@ -19,20 +21,27 @@ class DocDocumentProcessor:
         self.cosmos_repository = cosmos_repository
         self.logger = Logger()
 
-    async def process(self, message: Message, document_processed_memory_stream: BytesIO, search_client: SearchClient):
+    async def process(self, message: Message, document_processed_memory_stream: BlobStream, document_page_writer: DocumentPageWriter, page_manifest: DocumentPageManifest, search_client: SearchClient):
         self.logger.info("DP-PR-01 - Starting document processor.")
 
-        with tempfile.NamedTemporaryFile(suffix=".docx", delete=False) as temp_file:
-            temp_file.write(document_processed_memory_stream.getvalue())
-
-            # Close the temporary file so it can be reopened in binary mode
-            temp_file.close()
-
-            # Reopen the temporary file in binary mode and read its contents
-            with open(temp_file.name, "rb") as binary_file:
-                doc_bytes = binary_file.read()
+        document_page_name = f"{Path(message.fileName).stem}.docx"
+        document_page_full_path = f"{message.file_path_without_extension()}/{document_page_name}"
 
-        self.storage_container_service.upload_page_blob(message.storageFilePath, doc_bytes, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        fingerprint = DocumentPageManifest.fingerprint_stream(
+            DocumentPageManifest.read_chunks(document_processed_memory_stream.view()),
+            self.search_embed_service.pipeline_settings(message, document_page_full_path)
+        )
+        if page_manifest.is_recorded(1, fingerprint):
+            self.logger.info("DP-PR-06 - Document was already indexed by an earlier attempt.")
+            return 0
+        unchanged_page = page_manifest.unchanged_page(1, fingerprint)
+        if unchanged_page is not None:
+            self.logger.info("DP-PR-07 - Document didn't change since its last indexing, skipping it.")
+            count("unchanged_pages")
+            await document_page_writer.add(unchanged_page)
+            return 1
+
+        await self.storage_container_service.upload_page_blob(message.storageFilePath, document_processed_memory_stream.view(), "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
 
         self.logger.info("DP-PR-02 - Successfully updated document.")
 
@@ -41,29 +50,29 @@ class DocDocumentProcessor:
             storage_file_path=message.storageFilePath,
             page_number=1,
             index_status=IndexStatus.INDEXED.value,
-            index_completion_date=int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
+            index_completion_date=int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000),
+            fingerprint=fingerprint
         )
 
-        self.logger.info("DP-PR-03 - Created metadata for document page. Metadata: "+metadata.to_string())
-
-        document_page_name = f"{Path(message.fileName).stem}.docx"
-        document_page_full_path = f"{message.file_path_without_extension()}/{document_page_name}"
+        self.logger.info("DP-PR-03 - Created metadata for document page. Metadata: %s", Lazy(metadata.to_string))
 
         embed_result = await self.search_embed_service.embed_blob(
-            file_stream=BytesIO(doc_bytes),
+            file_stream=document_processed_memory_stream.view(),
             message=message,
             search_client=search_client,
             page_full_path=document_page_full_path
         )
 
-        if embed_result == True:
-            self.logger.info("DP-PR-04 - Successfully embedded document.")
+        if not embed_result.succeeded():
+            # Failing the message keeps the sections of the previous indexing, they would be removed as stale otherwise
+            self.logger.error("DP-PR-04 - Error embedding document. %s", Lazy(embed_result.to_string))
+            raise Exception("Sections of document " + message.fileName + " failed to index. " + embed_result.to_string())
 
-            self.logger.info("DP-PR-05 - Updating Cosmos with the list of pages.")
+        self.logger.info("DP-PR-04 - Successfully embedded document.")
+        # The ids of the sections are kept with the page so they can be deleted by key
+        metadata.section_ids = embed_result.uploaded_ids()
 
-            result = self.cosmos_repository.update_document_page_async("documentskb", message.fileId, metadata.to_dict())
+        self.logger.info("DP-PR-05 - Adding the document page to the list of pages.")
 
-            self.logger.info("DP-PR-06 - Status: " + str(result) + " for updating Cosmos with the metadata.")
-        else:
-            self.logger.error("DP-PR-04 - Error embedding document.")
-        
\ No newline at end of file
+        await document_page_writer.add(metadata.to_dict())
+        return 1
@@ -1,28 +1,57 @@
+import asyncio
 import datetime
-from io import BytesIO
 import os
-from exceptions.ProcessorExceptions import FileFormatNotSuportedError
+import time
+from exceptions.ProcessorExceptions import FileFormatNotSuportedError, IndexingInterruptedError
+from models.DocumentPageManifest import DocumentPageManifest
+from models.MessageResult import MessageResult
 from models.Message import Message
-from models.IndexStatus import IndexStatus
 from processors.DocDocumentProcessor import DocDocumentProcessor
 from processors.PDFDocumentProcessor import PDFDocumentProcessor
 from repositories.CosmosRepository import CosmosRepository
+from repositories.DocumentPageWriter import DocumentPageWriter
 from services.AzureSearchEmbedService import AzureSearchEmbedService
-from services.Logger import Logger
+from services.Logger import Lazy, Logger
+from services.Metrics import count, document_metrics, export_document_metrics, span
+from services.QueueService import QueueService
 from services.StorageContainerService import StorageContainerService
-from azure.search.documents import SearchClient
-from azure.identity import DefaultAzureCredential
+
+DEFAULT_FUNCTION_TIMEOUT_SECONDS = 3600  # functionTimeout of host.json
+DEFAULT_INDEX_CONTINUATION_MARGIN_SECONDS = 300  # No new page is started once the function timeout is this close
+DEFAULT_MAX_INDEX_CONTINUATIONS = 10  # Continuation messages sent for a document before its indexing is failed
 
 class IndexProcessor:
     logger = Logger()
 
-    def __init__(self, storage_container_service: StorageContainerService, cosmos_repository: CosmosRepository, search_embed_service: AzureSearchEmbedService):
+    def __init__(self, storage_container_service: StorageContainerService, cosmos_repository: CosmosRepository, search_embed_service: AzureSearchEmbedService, queue_service: QueueService):
         self.storage_container_service = storage_container_service
         self.cosmos_repository = cosmos_repository
         self.search_embed_service = search_embed_service
+        self.queue_service = queue_service
+        self.function_timeout = float(os.getenv('FUNCTION_TIMEOUT_SECONDS', DEFAULT_FUNCTION_TIMEOUT_SECONDS))
+        self.continuation_margin = float(os.getenv('INDEX_CONTINUATION_MARGIN_SECONDS', DEFAULT_INDEX_CONTINUATION_MARGIN_SECONDS))
+        self.max_continuations = int(os.getenv('MAX_INDEX_CONTINUATIONS', DEFAULT_MAX_INDEX_CONTINUATIONS))
+
+    async def process(self, message: Message) -> MessageResult:
+        """
+        Returns the number of pages indexed, or skipped as unchanged, by this invocation
+        and whether it completed the indexing of the document.
+
+        The time spent in every step and the cost counters of the document are logged and exported as custom metrics.
+        """
+        metrics = None
+        try:
+            with document_metrics(message.fileId, message.theme, message.language) as metrics:
+                return await self.index_document(message)
+        finally:
+            if metrics is not None:
+                self.logger.info("IP-15 - Indexing metrics of %s. %s", message.fileName, Lazy(metrics.to_string))
+                export_document_metrics(metrics)
 
-    async def process(self, message: Message):
+    async def index_document(self, message: Message) -> MessageResult:
         self.logger.info("IP-01 - Starting index processor.")
+        # The message is processed right after it is received, the deadline leaves time to record the pages in flight
+        deadline = time.monotonic() + self.function_timeout - self.continuation_margin
 
         original_file_name = message.fileName
         original_file_path = message.storageFilePath
@@ -31,51 +60,113 @@ class IndexProcessor:
         self.logger.info("IP-02 - Checking if file format is supported.")
         
         if message.originalFileFormat in ['pdf', 'docx']:
-            self.logger.info("IP-03 - Updating document index for: " + original_file_name + " with ID: " + file_id)
-            self.cosmos_repository.update("documentskb", file_id, {"indexStatus": IndexStatus.PROCESSING.value})
+            self.logger.info("IP-03 - Updating document index for: %s with ID: %s", original_file_name, file_id)
+            # The pages of the previous indexing are kept aside, the unchanged ones are recorded again without being processed
+            with span("cosmos"):
+                document = await self.cosmos_repository.get_document("documentskb", file_id)
+                page_manifest = DocumentPageManifest.from_document(document)
+                self.logger.info("IP-10 - Previous indexing of %s has %d pages. Resumed: %s", original_file_name, len(page_manifest.previous_pages), page_manifest.resumed)
+                await self.cosmos_repository.start_document_index("documentskb", file_id,
+                                                                  None if page_manifest.resumed else page_manifest.previous_page_list)
 
+            # The pages are pushed to Cosmos in batches, the last one together with the index completion
+            document_page_writer = DocumentPageWriter(self.cosmos_repository, "documentskb", file_id)
+            file_memory_stream = None
             try:
-                self.logger.info("IP-04 - Downloading blob file: " + message.storageFilePath)
+                self.logger.info("IP-04 - Downloading blob file: %s", message.storageFilePath)
 
-                file_memory_stream = BytesIO(self.storage_container_service.download_blob(message.storageFilePath).readall())
-                self.logger.info("IP-05 - Success downloading blob file and store in a memory stream")
+                file_memory_stream = await self.storage_container_service.download_blob(message.storageFilePath)
+                self.logger.info("IP-05 - Success downloading blob file of %d bytes", file_memory_stream.size)
 
                 search_index_name = self.get_azure_search_index_name_for(message)
-                self.logger.info("IP-06 - Get index name: " + search_index_name)
+                self.logger.info("IP-06 - Get index name: %s", search_index_name)
 
                 self.logger.info("IP-07 - Ensure the index exists")
                 await self.search_embed_service.ensure_search_index_exists(search_index_name)
 
-                if message.originalFileFormat == 'pdf':
-                    self.logger.info("IP-08 - Processing PDF document.")
-                    pdf_processor = PDFDocumentProcessor(storage_container_service=self.storage_container_service, 
-                                                         search_embed_service=self.search_embed_service,
-                                                         cosmos_repository=self.cosmos_repository)
-                    await pdf_processor.process(message, 
-                                          file_memory_stream, 
-                                          SearchClient(endpoint=os.getenv('AZURE_SEARCH_SERVICE_ENDPOINT'),
-                                                       index_name=search_index_name,
-                                                       credential=DefaultAzureCredential()
-                                                    )
-                                        )
-                elif message.originalFileFormat == 'docx':
-                    self.logger.info("IP-08 - Processing DOCX document.")
-                    doc_processor = DocDocumentProcessor(storage_container_service=self.storage_container_service, 
-                                                         search_embed_service=self.search_embed_service,
-                                                         cosmos_repository=self.cosmos_repository)
-                    await doc_processor.process(message, 
-                                          file_memory_stream, 
-                                          SearchClient(endpoint=os.getenv('AZURE_SEARCH_SERVICE_ENDPOINT'),
-                                                       index_name=search_index_name,
-                                                       credential=DefaultAzureCredential()
-                                                    )
-                                        )
-
-                self.cosmos_repository.update_document_index_completion("documentskb", file_id, int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000))
+                async with self.search_embed_service.search_client(search_index_name) as search_client:
+                    if message.originalFileFormat == 'pdf':
+                        self.logger.info("IP-08 - Processing PDF document.")
+                        pdf_processor = PDFDocumentProcessor(storage_container_service=self.storage_container_service, 
+                                                             search_embed_service=self.search_embed_service,
+                                                             cosmos_repository=self.cosmos_repository)
+                        pages_count = await pdf_processor.process(message, 
+                                              file_memory_stream, 
+                                              document_page_writer, 
+                                              page_manifest,
+                                              search_client,
+                                              deadline)
+                    elif message.originalFileFormat == 'docx':
+                        self.logger.info("IP-08 - Processing DOCX document.")
+                        doc_processor = DocDocumentProcessor(storage_container_service=self.storage_container_service, 
+                                                             search_embed_service=self.search_embed_service,
+                                                             cosmos_repository=self.cosmos_repository)
+                        pages_count = await doc_processor.process(message, 
+                                              file_memory_stream, 
+                                              document_page_writer, 
+                                              page_manifest,
+                                              search_client)
+
+                    await document_page_writer.flush()
+                    with span("cleanup"):
+                        await self.remove_stale_pages(message, page_manifest, search_client)
+
+                await document_page_writer.complete(int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000))
+                count("pages", pages_count)
+                return MessageResult(pages=pages_count, completed_document=True)
+            except IndexingInterruptedError as interrupted:
+                # The checkpoints are recorded first, the continuation message resumes from them
+                await document_page_writer.flush()
+                await self.continue_in_new_message(message, interrupted)
+                count("pages", interrupted.processed_pages)
+                return MessageResult(pages=interrupted.processed_pages)
             except Exception as e:
+                # Keeps the pages that were indexed before the failure
+                try:
+                    await document_page_writer.flush()
+                except Exception as flush_error:
+                    self.logger.error("IP-09 - Error recording the indexed pages of %s: %s", original_file_name, flush_error)
                 raise e
+            finally:
+                if file_memory_stream is not None:
+                    file_memory_stream.close()
         else:
             raise FileFormatNotSuportedError(message.original_file_format)
         
+    async def continue_in_new_message(self, message: Message, interrupted: IndexingInterruptedError):
+        if message.continuation >= self.max_continuations:
+            self.logger.error("IP-14 - Indexing of %s was continued %d times, not continuing it again.", message.fileName, message.continuation)
+            raise interrupted
+        continuation = message.to_dict()
+        continuation["continuation"] = message.continuation + 1
+        await self.queue_service.send_message(continuation)
+        count("continuations")
+        self.logger.info("IP-13 - Sent continuation %d of %s from page %d.", continuation["continuation"], message.fileName, interrupted.next_page)
+
+    async def remove_stale_pages(self, message: Message, page_manifest: DocumentPageManifest, search_client):
+        """
+        Removes what the previous indexing left behind: the sections no page uploaded again,
+        and the blobs of the pages that are no longer part of the document.
+        """
+        document = await self.cosmos_repository.get_document("documentskb", message.fileId)
+        current_pages = (document or {}).get("documentPages") or []
+
+        stale_section_ids = page_manifest.stale_section_ids(current_pages)
+        if len(stale_section_ids) > 0:
+            removed_count = await self.search_embed_service.delete_sections(search_client, stale_section_ids)
+            self.logger.info("IP-11 - Removed %d of %d stale sections of %s.", removed_count, len(stale_section_ids), message.fileName)
+
+        stale_pages = page_manifest.stale_pages(current_pages)
+        if len(stale_pages) > 0:
+            # A page has a corpus blob for every page Document Intelligence found in it
+            corpus_paths = await asyncio.gather(*[self.search_embed_service.list_corpus_blob_paths(page.get("storageFilePath")) for page in stale_pages])
+            deletions = []
+            for page, page_corpus_paths in zip(stale_pages, corpus_paths):
+                deletions.append(self.storage_container_service.delete_blob("documentpages", page.get("storageFilePath")))
+                for corpus_path in page_corpus_paths:
+                    deletions.append(self.storage_container_service.delete_blob("corpus", corpus_path))
+            await asyncio.gather(*deletions)
+            self.logger.info("IP-12 - Removed the blobs of %d pages no longer part of %s.", len(stale_pages), message.fileName)
+
     def get_azure_search_index_name_for(self, message: Message):
         return message.theme + "-index-" + message.language
\ No newline at end of file
@@ -1,90 +1,279 @@
+from contextlib import aclosing
 from io import BytesIO
+from exceptions.ProcessorExceptions import IndexingInterruptedError, PageProcessingError
+from handlers.PdfSplitterHandler import PdfSplitterHandler
+from infra.BlobStream import BlobStream
+from models.DocumentPageManifest import DocumentPageManifest
 from models.DocumentsKBPage import DocumentsKBPage
 from models.Message import Message
 from models.IndexStatus import IndexStatus
 from repositories.CosmosRepository import CosmosRepository
+from repositories.DocumentPageWriter import DocumentPageWriter
 from services.AzureSearchEmbedService import AzureSearchEmbedService
-from services.Logger import Logger
-from azure.search.documents import SearchClient
-from PyPDF2 import PdfWriter, PdfReader
+from infra.Pipeline import Pipeline, PipelineItem, PipelineStage
+from services.Logger import Lazy, Logger
+from services.Metrics import count
+from azure.search.documents.aio import SearchClient
 import os
 from pathlib import Path
 from services.StorageContainerService import StorageContainerService
-import tempfile
 import datetime
 import asyncio
+import time
+
+DEFAULT_DOCUMENT_ANALYSIS_MODE = "page"  # "page" analyzes every split page, "document" analyzes the original PDF in page ranges
+DEFAULT_DOCUMENT_ANALYSIS_PAGES_PER_REQUEST = 0  # Size of the page ranges of the "document" mode, 0 analyzes all pages at once
+DEFAULT_DOCUMENT_ANALYSIS_CONCURRENCY = 2  # Page ranges analyzed at the same time in the "document" mode
+# Pages every stage works on at the same time, overridden by PIPELINE_<STAGE>_WORKERS
+DEFAULT_PIPELINE_STAGE_WORKERS = {"upload": 4, "analyze": 4, "corpus": 4, "chunk": 1, "embed": 2, "index": 2, "record": 1}
+
+PAGE_FAILED = "failed"
+PAGE_RECORDED = "recorded"  # Already recorded in documentPages by an earlier attempt of the re-index
+PAGE_STAGE_STORED = "stored"  # Checkpoint of a page whose blob was uploaded
+PAGE_STAGE_ANALYZED = "analyzed"  # Checkpoint of a page whose text was extracted and kept in its corpus blobs
+
+
+class PdfPage(PipelineItem):
+    def __init__(self, i: int, pdf_bytes: bytes, message: Message):
+        super().__init__()
+        self.i = i
+        self.pdf_bytes = pdf_bytes
+        self.page_name = f"{Path(message.fileName).stem}-{i + 1}.pdf"
+        self.page_full_path = f"{message.file_path_without_extension()}/{self.page_name}"
+        self.fingerprint = None
+        self.checkpoint = {}
+        self.metadata = None
+        self.page_map = None
+        self.read_from_corpus = False
+        self.sections = None
+        self.documents = None
+
 
 class PDFDocumentProcessor:
+    """
+    Indexes the pages of a PDF through a pipeline: the pages are split, then go through the upload, analyze,
+    corpus, chunk, embed, index and record stages, each with its own workers, so the blob storage,
+    Document Intelligence, OpenAI, Azure AI Search and Cosmos DB calls of different pages overlap.
+    """
+
     def __init__(self, storage_container_service: StorageContainerService, search_embed_service: AzureSearchEmbedService, cosmos_repository: CosmosRepository):
         self.logger = Logger()
         self.storage_container_service = storage_container_service
         self.search_embed_service = search_embed_service
         self.cosmos_repository = cosmos_repository
+        self.analysis_mode = os.getenv('DOCUMENT_ANALYSIS_MODE', DEFAULT_DOCUMENT_ANALYSIS_MODE).lower()
+        self.analysis_pages_per_request = int(os.getenv('DOCUMENT_ANALYSIS_PAGES_PER_REQUEST', DEFAULT_DOCUMENT_ANALYSIS_PAGES_PER_REQUEST))
+        self.analysis_concurrency = int(os.getenv('DOCUMENT_ANALYSIS_CONCURRENCY', DEFAULT_DOCUMENT_ANALYSIS_CONCURRENCY))
+        self.stage_workers = {name: Pipeline.stage_workers(name, workers) for name, workers in DEFAULT_PIPELINE_STAGE_WORKERS.items()}
 
-    async def process(self, message: Message, document_processed_memory_stream: BytesIO, search_client: SearchClient):
+    async def process(self, message: Message, document_processed_memory_stream: BlobStream, document_page_writer: DocumentPageWriter, page_manifest: DocumentPageManifest, search_client: SearchClient, deadline: float = None):
+        """
+        Returns the number of pages processed, the pages recorded by an earlier attempt or continuation are not counted.
+
+        Stops handing out pages once the deadline (time.monotonic) is reached, the pages in flight are finished
+        and recorded and IndexingInterruptedError is raised with the first page that was not processed.
+        """
         self.logger.info("DP-PR-01 - Starting document processor.")
 
         self.logger.info("DP-PR-02 - Opening PDF.")
-        pdf_reader = PdfReader(document_processed_memory_stream)
-        self.logger.info("DP-PR-03 - Successfully opened original pdf document: +" + message.fileName + ". Pages count: " + str(len(pdf_reader.pages)))
+        async with PdfSplitterHandler(document_processed_memory_stream) as pdf_splitter:
+            pages_count = pdf_splitter.pages_count
+            self.logger.info("DP-PR-03 - Successfully opened original pdf document: %s. Pages count: %d. Stage workers: %s", message.fileName, pages_count, self.stage_workers)
+
+            # Pages finish in any order, their metadata is kept by page number and recorded
+            # in Cosmos in page order as soon as all the previous pages are done
+            self.message = message
+            self.search_client = search_client
+            self.document_page_writer = document_page_writer
+            self.page_manifest = page_manifest
+            self.pages_metadata = [None] * pages_count
+            self.next_page_to_record = 0
+            self.record_lock = asyncio.Lock()
+            self.interrupted_page = None
+            self.record_error = None
+            self.processed_pages = 0
 
-        list_of_pages = []
+            self.analyzed_ranges = {}
+            if self.analysis_mode == "document":
+                self.start_document_analysis(message, document_processed_memory_stream, pages_count)
 
-        for i in range(len(pdf_reader.pages)):
-            document_page_name = f"{Path(message.fileName).stem}-{i + 1}.pdf"
-            document_page_full_path = f"{message.file_path_without_extension()}/{document_page_name}"
-            
-            self.logger.info("DP-PR-04 - Start working on pdf page: " + document_page_full_path)
+            self.pipeline = Pipeline("pdf-pages", [
+                PipelineStage("upload", self.upload_page, self.stage_workers["upload"]),
+                PipelineStage("analyze", self.analyze_page, self.stage_workers["analyze"]),
+                PipelineStage("corpus", self.upload_corpus, self.stage_workers["corpus"]),
+                PipelineStage("chunk", self.chunk_page, self.stage_workers["chunk"]),
+                PipelineStage("embed", self.embed_page, self.stage_workers["embed"]),
+                PipelineStage("index", self.index_page, self.stage_workers["index"]),
+                PipelineStage("record", self.record_page, self.stage_workers["record"], run_always=True),
+            ], source_name="split")
+            await self.pipeline.run(self.split_pages(pdf_splitter, deadline))
 
-            single_pdf_document = PdfWriter()
-            single_pdf_document.add_page(pdf_reader.pages[i])
+        if self.record_error is not None:
+            # The pages that weren't written stay in the writer, failing the message keeps the document from completing without them
+            raise self.record_error
 
-            self.logger.info("DP-PR-05 - Created a new document with the page.")
+        if self.interrupted_page is not None:
+            self.logger.info("DP-PR-17 - Stopped before page %d of %s, the function timeout is close.", self.interrupted_page, message.fileName)
+            raise IndexingInterruptedError(message.fileName, self.interrupted_page, self.processed_pages)
 
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_pdf_file:
-                single_pdf_document.write(temp_pdf_file)
+        failed_pages = [i + 1 for i, metadata in enumerate(self.pages_metadata) if metadata == PAGE_FAILED]
+        if len(failed_pages) > 0:
+            self.logger.error("DP-PR-13 - Failed pages: %s of %s", failed_pages, message.fileName)
+            raise PageProcessingError(message.fileName, failed_pages)
+        return self.processed_pages
 
-                # Close the temporary file so it can be reopened in binary mode
-                temp_pdf_file.close()
+    async def split_pages(self, pdf_splitter: PdfSplitterHandler, deadline: float):
+        # The splitter only runs ahead of the pipeline while the queue of the upload stage has room
+        async with aclosing(pdf_splitter.pages()) as pages:
+            async for i, pdf_bytes, split_error in pages:
+                if self.record_error is not None:
+                    return
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.interrupted_page = i + 1
+                    return
+                page = PdfPage(i, pdf_bytes, self.message)
+                if split_error is not None:
+                    # Only this page fails, the record stage marks it failed and the next pages go on
+                    self.logger.error("DP-PR-19 - Error splitting page %d of %s. Error: %s", i + 1, self.message.fileName, split_error)
+                    page.error = split_error
+                yield page
 
-                # Reopen the temporary file in binary mode and read its contents
-                with open(temp_pdf_file.name, "rb") as binary_file:
-                    pdf_bytes = binary_file.read()
+    async def upload_page(self, page: PdfPage):
+        i = page.i
+        self.logger.info("DP-PR-04 - Start working on pdf page: %s", page.page_full_path)
 
+        page.fingerprint = DocumentPageManifest.fingerprint(page.pdf_bytes, self.search_embed_service.pipeline_settings(self.message, page.page_full_path))
+        if self.page_manifest.is_recorded(i + 1, page.fingerprint):
+            self.logger.info("DP-PR-14 - Page %d was already indexed by an earlier attempt.", i + 1)
+            page.metadata = PAGE_RECORDED
+            page.completed = True
+            return
+        unchanged_page = self.page_manifest.unchanged_page(i + 1, page.fingerprint)
+        if unchanged_page is not None:
+            # Its blob and sections are still in place, only its entry is recorded again
+            self.logger.info("DP-PR-15 - Page %d didn't change since its last indexing, skipping it.", i + 1)
+            page.metadata = DocumentsKBPage.from_dict(unchanged_page)
+            page.completed = True
+            count("unchanged_pages")
+            return
+
+        # The stages an earlier attempt completed for the page are not done again
+        page.checkpoint = self.page_manifest.checkpoint(i + 1, page.fingerprint) or {}
+        stage = page.checkpoint.get("stage")
+        if stage is not None:
+            self.logger.info("DP-PR-16 - Resuming page %d after its %s stage.", i + 1, stage)
+        else:
             self.logger.info("DP-PR-05 - Uploading document for blob.")
-            
-            self.storage_container_service.upload_page_blob(document_page_full_path, pdf_bytes, "application/pdf")
+
+            await self.storage_container_service.upload_page_blob(page.page_full_path, page.pdf_bytes, "application/pdf")
+            await self.document_page_writer.add_checkpoint(i + 1, {"stage": PAGE_STAGE_STORED, "fingerprint": page.fingerprint})
 
             self.logger.info("DP-PR-06 - Successfully updated document.")
 
-            metadata = DocumentsKBPage(
-                file_page_name=document_page_name,
-                storage_file_path=document_page_full_path,
-                page_number=i+1,
-                index_status=IndexStatus.INDEXED.value,
-                index_completion_date=int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
-            )
+        page.metadata = DocumentsKBPage(
+            file_page_name=page.page_name,
+            storage_file_path=page.page_full_path,
+            page_number=i+1,
+            index_status=IndexStatus.INDEXED.value,
+            index_completion_date=int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000),
+            fingerprint=page.fingerprint
+        )
+
+        self.logger.info("DP-PR-07 - Adding metadata: %s to list of documents.", Lazy(page.metadata.to_string))
+
+    async def analyze_page(self, page: PdfPage):
+        if page.checkpoint.get("stage") == PAGE_STAGE_ANALYZED:
+            # The text extracted by the earlier attempt is read back from the corpus blobs
+            page.page_map = await self.search_embed_service.read_corpus_pages(page.page_full_path, page.checkpoint.get("corpusPages", 1))
+            page.read_from_corpus = True
+        elif self.analysis_mode == "document":
+            page.page_map = await self.get_analyzed_page(page.i)
+        else:
+            page.page_map = await self.search_embed_service.parse(file_stream=BytesIO(page.pdf_bytes),
+                                                                  blob_name=page.page_full_path,
+                                                                  file_format=self.message.originalFileFormat)
+        page.pdf_bytes = None
+
+    async def upload_corpus(self, page: PdfPage):
+        if page.read_from_corpus:
+            return
+        await self.search_embed_service.upload_corpus_pages(page.page_full_path, page.page_map)
+        await self.document_page_writer.add_checkpoint(page.i + 1, {"stage": PAGE_STAGE_ANALYZED, "fingerprint": page.fingerprint, "corpusPages": len(page.page_map)})
+
+    async def chunk_page(self, page: PdfPage):
+        self.logger.info("DP-PR-08 - Start embedding process...")
+        page.sections = self.search_embed_service.split_sections(page.page_map, self.message, page.page_full_path)
+        page.page_map = None
+
+    async def embed_page(self, page: PdfPage):
+        page.documents = await self.search_embed_service.embed_sections(page.sections)
+        page.sections = None
+
+    async def index_page(self, page: PdfPage):
+        indexing_result = await self.search_embed_service.upload_sections(self.search_client, page.documents)
+        page.documents = None
+        # The ids of the sections are kept with the page so they can be deleted by key
+        page.metadata.section_ids = indexing_result.uploaded_ids()
+        if not indexing_result.succeeded():
+            self.logger.error("DP-PR-09 - Error embedding document. %s", Lazy(indexing_result.to_string))
+            raise Exception("Sections of page " + str(page.i + 1) + " failed to index. " + indexing_result.to_string())
+        self.logger.info("DP-PR-09 - Successfully embedded document.")
 
-            self.logger.info("DP-PR-07 - Adding metadata: " + metadata.to_string() + " to list of documents.")
+    async def record_page(self, page: PdfPage):
+        if page.error is not None:
+            self.logger.error("DP-PR-12 - Error processing page %d of %s. Error: %s", page.i + 1, self.message.fileName, page.error)
+            self.pages_metadata[page.i] = PAGE_FAILED
+        else:
+            self.pages_metadata[page.i] = page.metadata
+        try:
+            await self.record_completed_pages(self.message)
+        except Exception as e:
+            self.logger.error("DP-PR-18 - Error recording the pages of %s, no new page is started. Error: %s", self.message.fileName, e)
+            if self.record_error is None:
+                self.record_error = e
+            raise
 
-            list_of_pages.append(metadata)
+    async def record_completed_pages(self, message: Message):
+        async with self.record_lock:
+            while self.next_page_to_record < len(self.pages_metadata) and self.pages_metadata[self.next_page_to_record] is not None:
+                metadata = self.pages_metadata[self.next_page_to_record]
+                self.next_page_to_record += 1
+                if metadata == PAGE_FAILED or metadata == PAGE_RECORDED:
+                    continue
 
-            self.logger.info("DP-PR-08 - Start embedding process...")
+                self.logger.info("DP-PR-10 - Adding page %d to the list of pages.", metadata.page_number)
 
-            embed_result = await self.search_embed_service.embed_blob(
-                file_stream=BytesIO(pdf_bytes),
-                message=message,
-                search_client=search_client,
-                page_full_path=document_page_full_path
-            )
+                await self.document_page_writer.add(metadata.to_dict())
+                self.processed_pages += 1
 
-            if embed_result == True:
-                self.logger.info("DP-PR-09 - Successfully embedded document.")
+    def start_document_analysis(self, message: Message, document_stream: BlobStream, pages_count: int):
+        # One analysis job per page range, started by the first page of the range that needs it,
+        # so the ranges whose pages are all unchanged are never analyzed
+        pages_per_request = self.analysis_pages_per_request if self.analysis_pages_per_request > 0 else max(pages_count, 1)
+        self.analysis_range_size = pages_per_request
+        semaphore = asyncio.Semaphore(self.analysis_concurrency)
 
-                self.logger.info("DP-PR-10 - Updating Cosmos with the list of pages.")
+        async def analyze_range(first_page, last_page):
+            self.logger.info("DP-SDA-02 - Analyzing pages %d-%d of %s.", first_page, last_page, message.fileName)
+            async with semaphore:
+                return await self.search_embed_service.parse_document_pages(
+                    file_stream=document_stream.view(),
+                    blob_name=message.storageFilePath,
+                    file_format=message.originalFileFormat,
+                    pages=f"{first_page}-{last_page}"
+                )
 
-                result = self.cosmos_repository.update_document_page_async("documentskb", message.fileId, metadata.to_dict())
+        self.logger.info("DP-SDA-01 - Analyzing %d pages of %s in ranges of %d pages.", pages_count, message.fileName, pages_per_request)
+        self.analyze_range = analyze_range
+        self.analysis_pages_count = pages_count
 
-                self.logger.info("DP-PR-11 - Status: " + str(result) + " for updating Cosmos with the metadata.")
-            else:
-                self.logger.error("DP-PR-09 - Error embedding document.")
\ No newline at end of file
+    async def get_analyzed_page(self, i: int):
+        range_index = i // self.analysis_range_size
+        if range_index not in self.analyzed_ranges:
+            first_page = range_index * self.analysis_range_size + 1
+            last_page = min(first_page + self.analysis_range_size - 1, self.analysis_pages_count)
+            self.analyzed_ranges[range_index] = asyncio.ensure_future(self.analyze_range(first_page, last_page))
+        page_maps = await self.analyzed_ranges[range_index]
+        if i + 1 not in page_maps:
+            raise Exception(f"Page {i + 1} not found in the document analysis result.")
+        return page_maps[i + 1]
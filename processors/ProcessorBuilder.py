@@ -1,25 +1,142 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from azure.identity.aio import DefaultAzureCredential
+from handlers.PdfSplitterHandler import shutdown_process_pool
+from infra.HttpSession import close_http_session
 from infra.KeyVault import KeyVault
 from models.Message import Message
 from processors.Processor import Processor
 from repositories.CosmosRepository import CosmosRepository
 from services.AzureSearchEmbedService import AzureSearchEmbedService
+from services.Logger import Logger
+from services.QueueService import QueueService
 from services.StorageContainerService import StorageContainerService
 
 class ProcessorBuilder:
+    """
+    Holds the clients of the worker, created once and shared by all the messages it processes.
+    The clients share one credential, so tokens are acquired once and cached.
+    """
+
     def __init__(self):
-        key_vault = KeyVault()
-        cosmos_db_connection_string_secret = key_vault.get_secret(os.getenv('KEY_VAULT_COSMOS_DB_CONN_NAME'))
-        cosmos_db_database_name = os.getenv('DATABASE_NAME')
-        self.storage_container_service = StorageContainerService()
-        self.cosmos_repository = CosmosRepository(connection_string=cosmos_db_connection_string_secret, 
-                                                 database_name=cosmos_db_database_name)
-        self.search_embed_service = AzureSearchEmbedService(storage_container_service=self.storage_container_service)
-
-    def build(self, message: Message) -> Processor:
+        self.logger = Logger()
+        self.credential = DefaultAzureCredential()
+        self.key_vault = KeyVault(credential=self.credential)
+        self.cosmos_db_connection_string_secret = None
+        self.cosmos_repository = None
+        # Messages in process by Cosmos DB client, a client replaced by a new connection string is closed after its last message
+        self.cosmos_repository_messages = {}
+        self.retired_cosmos_repositories = []
+        self.storage_container_service = StorageContainerService(credential=self.credential)
+        self.search_embed_service = AzureSearchEmbedService(storage_container_service=self.storage_container_service,
+                                                            credential=self.credential)
+        self.queue_service = QueueService(credential=self.credential)
+
+    async def initialize(self):
+        await self.refresh()
+
+    async def refresh(self):
+        """
+        Reconnects to Cosmos DB when the connection string secret changed in Key Vault,
+        the secret is read from Key Vault again only once its cached value is due for a refresh.
+        """
+        connection_string = await self.key_vault.get_secret(os.getenv('KEY_VAULT_COSMOS_DB_CONN_NAME'))
+        if connection_string == self.cosmos_db_connection_string_secret:
+            return
+
+        self.logger.info("PB-RF-01 - Connecting to Cosmos DB.")
+        cosmos_repository = CosmosRepository(connection_string=connection_string,
+                                             database_name=os.getenv('DATABASE_NAME'))
+        try:
+            await cosmos_repository.validate_database()
+        except Exception:
+            cosmos_repository.close()
+            raise
+
+        if self.cosmos_repository is not None:
+            # Several messages are processed at once, the old client is closed once the ones using it are done
+            if self.cosmos_repository_messages.get(self.cosmos_repository, 0) > 0:
+                self.retired_cosmos_repositories.append(self.cosmos_repository)
+            else:
+                self.logger.info("PB-RF-02 - Closing the previous Cosmos DB client.")
+                self.cosmos_repository.close()
+        self.cosmos_repository = cosmos_repository
+        self.cosmos_db_connection_string_secret = connection_string
+
+    def build(self, message: Message, cosmos_repository: CosmosRepository = None) -> Processor:
         return Processor(
             message=message,
             storage_container_service=self.storage_container_service,
-            cosmos_repository=self.cosmos_repository,
-            search_embed_service=self.search_embed_service
+            cosmos_repository=cosmos_repository or self.cosmos_repository,
+            search_embed_service=self.search_embed_service,
+            queue_service=self.queue_service
         )
+
+    @asynccontextmanager
+    async def processor(self, message: Message) -> AsyncIterator[Processor]:
+        """
+        Builds the Processor of the message, its Cosmos DB client is kept open until the message is done
+        even when the connection string changes in the meantime.
+        """
+        cosmos_repository = self.cosmos_repository
+        self.cosmos_repository_messages[cosmos_repository] = self.cosmos_repository_messages.get(cosmos_repository, 0) + 1
+        try:
+            yield self.build(message, cosmos_repository)
+        finally:
+            self.cosmos_repository_messages[cosmos_repository] -= 1
+            if self.cosmos_repository_messages[cosmos_repository] == 0:
+                del self.cosmos_repository_messages[cosmos_repository]
+                if cosmos_repository in self.retired_cosmos_repositories:
+                    self.logger.info("PB-RF-02 - Closing the previous Cosmos DB client.")
+                    self.retired_cosmos_repositories.remove(cosmos_repository)
+                    cosmos_repository.close()
+
+    async def close(self):
+        if self.cosmos_repository is not None:
+            self.cosmos_repository.close()
+        for cosmos_repository in self.retired_cosmos_repositories:
+            cosmos_repository.close()
+        await self.search_embed_service.close()
+        await self.storage_container_service.close()
+        await self.queue_service.close()
+        await self.key_vault.close()
+        await self.credential.close()
+
+
+_processor_builder = None
+_processor_builder_lock = None
+
+
+async def get_processor_builder() -> ProcessorBuilder:
+    """
+    Returns the ProcessorBuilder of the worker, creating it on the first message.
+    """
+    global _processor_builder, _processor_builder_lock
+    if _processor_builder_lock is None:
+        _processor_builder_lock = asyncio.Lock()
+    async with _processor_builder_lock:
+        if _processor_builder is None:
+            processor_builder = ProcessorBuilder()
+            try:
+                await processor_builder.initialize()
+            except Exception:
+                await processor_builder.close()
+                raise
+            _processor_builder = processor_builder
+        else:
+            await _processor_builder.refresh()
+        return _processor_builder
+
+
+async def close_processor_builder():
+    """
+    Closes the clients of the worker, the shared HTTP session and the PDF split processes.
+    """
+    global _processor_builder
+    if _processor_builder is not None:
+        await _processor_builder.close()
+        _processor_builder = None
+    await close_http_session()
+    shutdown_process_pool()
@@ -1,44 +1,101 @@
-import pymongo
+from typing import Dict, List
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 from models.IndexStatus import IndexStatus
 from services.Logger import Logger
 
 class CosmosRepository:
     def __init__(self, connection_string, database_name):
         self.logging = Logger()
-        self.client = pymongo.MongoClient(connection_string)
+        self.database_name = database_name
+        self.client = AsyncIOMotorClient(connection_string)
         self.db = self.client[database_name]
-        if database_name not in self.client.list_database_names():
-            self.logging.error("CDB-1-INIT - Database '{}' not found.".format(database_name))
-            raise Exception("Database '{}' not found.".format(database_name))
+
+    async def validate_database(self):
+        if self.database_name not in await self.client.list_database_names():
+            self.logging.error("CDB-1-INIT - Database '%s' not found.", self.database_name)
+            raise Exception("Database '{}' not found.".format(self.database_name))
         else:
-            self.logging.info("CDB-2-INIT - Using database: '{}'.\n".format(database_name))
-        self.logging.info("CDB-3-INIT - Connected to database: '{}'.\n".format(database_name))
+            self.logging.info("CDB-2-INIT - Using database: '%s'.\n", self.database_name)
+        self.logging.info("CDB-3-INIT - Connected to database: '%s'.\n", self.database_name)
 
-    def update(self, collectionName, item_id, updated_data):
+    async def update(self, collectionName, item_id, updated_data):
         collection = self.db.get_collection(collectionName)
-        result = collection.update_one({"id": item_id}, {"$set": updated_data})
+        result = await collection.update_one({"id": item_id}, {"$set": updated_data})
         return result.modified_count
     
-    def update_document_page_async(self, collectionName, item_id, documentKBPage):
+    async def update_document_page_async(self, collectionName, item_id, documentKBPage):
+        return await self.push_document_pages(collectionName, item_id, [documentKBPage])
+
+    async def push_document_pages(self, collectionName, item_id, documentKBPages: List[dict], pageCheckpoints: Dict[int, dict] = None):
         collection = self.db.get_collection(collectionName)
-        filter = {"id": item_id}
-        update = {"$push": {"documentPages": documentKBPage}}
-        update_result = collection.update_one(filter, update)
+        update_result = await collection.update_one({"id": item_id}, self.push_document_pages_update(documentKBPages, pageCheckpoints))
         return update_result.modified_count != 0
     
-    def update_document_index_completion(self, collectionName, item_id, indexCompletionDate):
+    async def update_document_index_completion(self, collectionName, item_id, indexCompletionDate):
         collection = self.db.get_collection(collectionName)
         filter = {"id": item_id}
-        update = {"$set": {"indexStatus": IndexStatus.INDEXED.value, "indexCompletionDate": indexCompletionDate}}
-        update_result = collection.update_one(filter, update)
+        update_result = await collection.update_one(filter, self.index_completion_update(indexCompletionDate))
         return update_result.modified_count != 0
+
+    async def complete_document_index(self, collectionName, item_id, documentKBPages: List[dict], indexCompletionDate):
+        """
+        Pushes the last pages and sets the document as indexed in a single ordered bulk write.
+        """
+        collection = self.db.get_collection(collectionName)
+        filter = {"id": item_id}
+        operations = []
+        if len(documentKBPages) > 0:
+            operations.append(UpdateOne(filter, self.push_document_pages_update(documentKBPages)))
+        operations.append(UpdateOne(filter, self.index_completion_update(indexCompletionDate)))
+        bulk_result = await collection.bulk_write(operations, ordered=True)
+        return bulk_result.modified_count != 0
+
+    @staticmethod
+    def push_document_pages_update(documentKBPages: List[dict], pageCheckpoints: Dict[int, dict] = None):
+        update = {}
+        if len(documentKBPages) > 0:
+            update["$push"] = {"documentPages": {"$each": documentKBPages}}
+        if pageCheckpoints:
+            update["$set"] = {f"pageCheckpoints.{page_number}": checkpoint for page_number, checkpoint in pageCheckpoints.items()}
+        return update
+
+    @staticmethod
+    def index_completion_update(indexCompletionDate):
+        return {"$set": {"indexStatus": IndexStatus.INDEXED.value, "indexCompletionDate": indexCompletionDate},
+                "$unset": {"previousDocumentPages": "", "pageCheckpoints": ""}}
+
+    async def start_document_index(self, collectionName, item_id, previousDocumentPages: List[dict] = None):
+        """
+        Sets the document as processing. When previousDocumentPages is given the pages of the previous indexing
+        are moved to it, and documentPages and pageCheckpoints are filled again by the new indexing.
+        """
+        collection = self.db.get_collection(collectionName)
+        update = {"$set": {"indexStatus": IndexStatus.PROCESSING.value}}
+        if previousDocumentPages is not None:
+            update["$set"]["previousDocumentPages"] = previousDocumentPages
+            update["$set"]["documentPages"] = []
+            update["$unset"] = {"pageCheckpoints": ""}
+        result = await collection.update_one({"id": item_id}, update)
+        return result.modified_count
     
-    def get_by_id(self, collectionName, item_id):
+    async def get_by_id(self, collectionName, item_id):
         collection = self.db.get_collection(collectionName)
-        item = collection.find_one({"id": item_id, "indexStatus": IndexStatus.DELETING.value})
+        item = await collection.find_one({"id": item_id, "indexStatus": IndexStatus.DELETING.value})
         return item
     
-    def delete(self, collectionName, item_id):
+    async def get_document(self, collectionName, item_id):
+        collection = self.db.get_collection(collectionName)
+        return await collection.find_one({"id": item_id})
+
+    async def get_by_storage_file_path(self, collectionName, storageFilePath):
+        collection = self.db.get_collection(collectionName)
+        return await collection.find_one({"storageFilePath": storageFilePath})
+
+    async def delete(self, collectionName, item_id):
         collection = self.db.get_collection(collectionName)
-        result = collection.delete_one({"id": item_id})
-        return result.deleted_count
\ No newline at end of file
+        result = await collection.delete_one({"id": item_id})
+        return result.deleted_count
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,92 @@
+import asyncio
+import os
+from repositories.CosmosRepository import CosmosRepository
+from services.Logger import Logger
+from services.Metrics import span
+
+DEFAULT_COSMOS_PAGE_BATCH_SIZE = 50  # Pages pushed to documentPages in a single write, 0 writes them all when the document completes
+DEFAULT_COSMOS_CHECKPOINT_INTERVAL_SECONDS = 5  # Longest a page checkpoint waits for the next write, 0 writes every checkpoint right away
+
+
+class DocumentPageWriter:
+    """
+    Coalesces the documentPages entries of a document into batched $push writes,
+    the last batch is written together with the index completion.
+
+    The stage checkpoints of the pages still in progress go out with the same writes, or on their own
+    once the oldest of them waited COSMOS_CHECKPOINT_INTERVAL_SECONDS, so a crash loses little work.
+    The pages and checkpoints of a failed write are kept, they go out with the next one.
+    """
+
+    def __init__(self, cosmos_repository: CosmosRepository, collection_name: str, item_id: str):
+        self.logger = Logger()
+        self.cosmos_repository = cosmos_repository
+        self.collection_name = collection_name
+        self.item_id = item_id
+        self.batch_size = int(os.getenv('COSMOS_PAGE_BATCH_SIZE', DEFAULT_COSMOS_PAGE_BATCH_SIZE))
+        self.checkpoint_interval = float(os.getenv('COSMOS_CHECKPOINT_INTERVAL_SECONDS', DEFAULT_COSMOS_CHECKPOINT_INTERVAL_SECONDS))
+        self.checkpoint_timer = None
+        self.pending_pages = []
+        self.pending_checkpoints = {}
+        self.lock = asyncio.Lock()
+
+    async def add(self, document_page: dict):
+        async with self.lock:
+            self.pending_pages.append(document_page)
+            if self.batch_size > 0 and len(self.pending_pages) >= self.batch_size:
+                await self.flush_pending()
+
+    async def add_checkpoint(self, page_number: int, checkpoint: dict):
+        async with self.lock:
+            self.pending_checkpoints[page_number] = checkpoint
+            if self.checkpoint_interval <= 0 or (self.batch_size > 0 and len(self.pending_pages) + len(self.pending_checkpoints) >= self.batch_size):
+                await self.flush_pending()
+            elif self.checkpoint_timer is None:
+                self.checkpoint_timer = asyncio.create_task(self.flush_checkpoints_later())
+
+    async def flush_checkpoints_later(self):
+        await asyncio.sleep(self.checkpoint_interval)
+        async with self.lock:
+            self.checkpoint_timer = None
+            if len(self.pending_checkpoints) == 0:
+                return
+            try:
+                await self.flush_pending()
+            except Exception as e:
+                # Nobody awaits the timer, the checkpoints are kept and go out with the next write
+                self.logger.warning("DPW-CK-01 - Error writing the page checkpoints of document %s: %s", self.item_id, e)
+
+    async def flush(self):
+        async with self.lock:
+            await self.flush_pending()
+
+    async def complete(self, index_completion_date):
+        async with self.lock:
+            pages = self.pending_pages
+            with span("cosmos"):
+                result = await self.cosmos_repository.complete_document_index(self.collection_name, self.item_id, pages, index_completion_date)
+            self.pending_pages = []
+            # The completion removes the checkpoints, the pending ones are not needed anymore
+            self.pending_checkpoints = {}
+            self.cancel_checkpoint_timer()
+            self.logger.info("DPW-CP-01 - Completed document %s with %d pages. Status: %s", self.item_id, len(pages), result)
+            return result
+
+    async def flush_pending(self):
+        if len(self.pending_pages) == 0 and len(self.pending_checkpoints) == 0:
+            return
+        pages = self.pending_pages
+        checkpoints = self.pending_checkpoints
+        # Cleared once written, the lock keeps new pages from being added in the meantime
+        with span("cosmos"):
+            result = await self.cosmos_repository.push_document_pages(self.collection_name, self.item_id, pages, checkpoints)
+        self.pending_pages = []
+        self.pending_checkpoints = {}
+        self.cancel_checkpoint_timer()
+        self.logger.info("DPW-FL-01 - Pushed %d pages and %d page checkpoints of document %s. Status: %s", len(pages), len(checkpoints), self.item_id, result)
+
+    def cancel_checkpoint_timer(self):
+        # The pending checkpoints were just written, the next checkpoint starts a new timer
+        if self.checkpoint_timer is not None:
+            self.checkpoint_timer.cancel()
+            self.checkpoint_timer = None
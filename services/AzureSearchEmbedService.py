@@ -1,13 +1,23 @@
+import asyncio
+import heapq
 from io import BytesIO
 import os
 from azure.search.documents.indexes.aio import SearchIndexClient
-from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential
 from openai import AsyncAzureOpenAI
 from handlers.TextSplitterHandler import TextSplitterHandler
+from models.IndexingResult import IndexingResult
 from models.Message import Message
 from models.Page import Page, SplitPage
 from models.PageDetail import PageDetail
-from services.Logger import Logger
+from infra.ClientPool import ClientPool
+from infra.HttpSession import create_shared_transport
+from services.EmbeddingCache import create_embedding_cache
+from services.EmbeddingService import EmbeddingService
+from services.Logger import Lazy, Logger
+from services.Metrics import count, span
+from services.SearchIndexRegistry import get_search_index_registry
+from services.SearchIndexUploader import SearchIndexUploader
 from azure.search.documents.indexes.models import (
     HnswAlgorithmConfiguration,
     HnswParameters,
@@ -26,29 +36,47 @@ from azure.search.documents.indexes.models import (
 )
 
 from services.StorageContainerService import StorageContainerService
-from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient
 from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
-from azure.ai.documentintelligence.models import DocumentTable
+from azure.ai.documentintelligence.models import AnalyzeResult, DocumentPage, DocumentTable
 import html
-from typing import IO, AsyncGenerator, Generator, List, Union
-from azure.search.documents import IndexDocumentsBatch
+import re
+from typing import IO, AsyncGenerator, Dict, Generator, List, Union
 from azure.core.credentials import AzureKeyCredential
 from azure.identity.aio import get_bearer_token_provider
 
+DEFAULT_SEARCH_CLIENT_POOL_SIZE = 16  # SearchClients kept open, one per search index
+DEFAULT_CLIENT_POOL_IDLE_SECONDS = 600  # Pooled clients not used for this long are closed
+SEARCH_DELETE_BATCH_SIZE = 1000  # Max actions accepted in a single indexing request
+INDEX_PIPELINE_VERSION = "1"  # Part of the page fingerprints, change it when the text, sections or embeddings of unchanged pages would change
+DEFAULT_SECTION_BATCH_SIZE = 64  # Sections embedded and indexed together as soon as they are split
+DEFAULT_SECTION_BATCH_CONCURRENCY = 2  # Section batches being embedded and indexed while the next sections are split
+
 class AzureSearchEmbedService:
-    def __init__(self, storage_container_service: StorageContainerService):
+    def __init__(self, storage_container_service: StorageContainerService, credential: DefaultAzureCredential = None):
         self.logger = Logger()
+        # One credential, and its token cache, for the search, OpenAI and Document Intelligence clients
+        self.owns_credential = credential is None
+        self.credential = credential if credential is not None else DefaultAzureCredential()
         azure_search_service_endpoint = os.getenv('AZURE_SEARCH_SERVICE_ENDPOINT')
         self.search_index_client = SearchIndexClient(
             endpoint=azure_search_service_endpoint,
-            credential=DefaultAzureCredential(),
+            credential=self.credential,
+            transport=create_shared_transport(),
         )
+        client_pool_idle_seconds = float(os.getenv('CLIENT_POOL_IDLE_SECONDS', DEFAULT_CLIENT_POOL_IDLE_SECONDS))
+        self.search_client_pool = ClientPool("SearchClient", self.create_search_client,
+                                             max_size=int(os.getenv('SEARCH_CLIENT_POOL_SIZE', DEFAULT_SEARCH_CLIENT_POOL_SIZE)),
+                                             idle_seconds=client_pool_idle_seconds)
+        self.document_intelligence_client_pool = ClientPool("DocumentIntelligenceClient", self.create_document_intelligence_client,
+                                                            max_size=1,
+                                                            idle_seconds=client_pool_idle_seconds)
         self.storage_container_service = storage_container_service
         self.text_splitter_handler = TextSplitterHandler()
+        self.section_batch_size = int(os.getenv('SECTION_BATCH_SIZE', DEFAULT_SECTION_BATCH_SIZE))
+        self.section_batch_concurrency = int(os.getenv('SECTION_BATCH_CONCURRENCY', DEFAULT_SECTION_BATCH_CONCURRENCY))
         azure_open_ai_endpoint = os.getenv('AZURE_OPENAI_SERVICE_ENDPOINT')
         azure_deployment = os.getenv('EMBEDDING_DEPLOYMENT_NAME')
-        
-        self.credential = DefaultAzureCredential()
 
         auth_args = {}
         auth_args["azure_ad_token_provider"] = get_bearer_token_provider(
@@ -62,15 +90,41 @@ class AzureSearchEmbedService:
             **auth_args
         )
 
+        self.embedding_service = EmbeddingService(
+            open_ai_client=self.open_ai_client,
+            deployment_name=azure_deployment,
+            cache=create_embedding_cache(blob_service_client=storage_container_service.blob_service_client)
+        )
+        self.search_index_uploader = SearchIndexUploader()
+
+    def create_search_client(self, key) -> SearchClient:
+        endpoint, index_name = key
+        return SearchClient(endpoint=endpoint, index_name=index_name, credential=self.credential, transport=create_shared_transport())
+
+    def create_document_intelligence_client(self, endpoint) -> DocumentIntelligenceClient:
+        return DocumentIntelligenceClient(endpoint=endpoint, credential=self.credential, transport=create_shared_transport())
+
+    def search_client(self, search_index_name: str):
+        """
+        Lends the pooled SearchClient of the index, use it with 'async with'.
+        """
+        return self.search_client_pool.client((os.getenv('AZURE_SEARCH_SERVICE_ENDPOINT'), search_index_name))
+
+    async def close(self):
+        await self.search_client_pool.close()
+        await self.document_intelligence_client_pool.close()
+        await self.search_index_client.close()
+        await self.open_ai_client.close()
+        if self.embedding_service.cache is not None:
+            await self.embedding_service.cache.close()
+        if self.owns_credential:
+            await self.credential.close()
+
     async def ensure_search_index_exists(self, search_index_name):
         self.logger.info("ASES-COUI-01 - Creating the index if necessary")
 
         self.logger.info("ASES-COUI-04 - Checking if exists or not.")
-        if search_index_name not in [name async for name in self.search_index_client.list_index_names()]:
-            self.logger.info("ASES-COUI-05 - Creating " + search_index_name + " search index.")
-            await self.create_index(search_index_name)
-        else:
-            self.logger.info("ASES-COUI-05 - Search index " + search_index_name + " already exists.")
+        await get_search_index_registry().ensure_exists(self.search_index_client, search_index_name, self.create_index)
     
     async def create_index(self, search_index_name: str) -> SearchIndex:
         vector_search_config_name = "b3-vector-config"
@@ -154,126 +208,325 @@ class AzureSearchEmbedService:
 
         await self.search_index_client.create_index(index)
     
-    async def embed_blob(self, file_stream: BytesIO, message: Message, search_client: SearchClient, page_full_path: str) -> bool:
+    async def embed_blob(self, file_stream: BytesIO, message: Message, search_client: SearchClient, page_full_path: str, page_map: List[PageDetail] = None, upload_corpus: bool = True) -> IndexingResult:
+        """
+        Returns the ids of the sections uploaded to the search index, with the error when the blob couldn't be embedded.
+        The corpus blobs are not uploaded again when upload_corpus is False, i.e. the page map was read from them.
+
+        Pages are split as they are parsed and the sections are embedded and indexed in batches while
+        the next pages are still being split, only the sections of the batches in flight are kept in memory.
+        """
+        indexing_result = IndexingResult()
+        corpus_uploads = []
+        index_batches = []
         try:
-            self.logger.info("ASES-EB-01 - Start embedding blob "+page_full_path)
+            self.logger.info("ASES-EB-01 - Start embedding blob %s", page_full_path)
 
-            page_map = await self.parse(file_stream=file_stream,
-                                        blob_name=page_full_path,
-                                        file_format=message.originalFileFormat)
-            
-            self.logger.info("ASES-EB-02 - Embedding text in Azure Search index. Page map count: " + str(len(page_map)))
+            if page_map is None:
+                pages = self.parse_pages(file_stream=file_stream,
+                                         blob_name=page_full_path,
+                                         file_format=message.originalFileFormat)
+            else:
+                pages = self.iterate_pages(page_map)
 
-            file_name_without_extension = os.path.splitext(os.path.basename(page_full_path))[0]
-            directory = os.path.dirname(page_full_path)
+            section_splitter = self.text_splitter_handler.section_splitter(page_full_path=page_full_path, message=message)
+            sections = []
+            pages_count = 0
+            sections_count = 0
 
-            for page in page_map:
-                corpus_page_name = file_name_without_extension + "-" + str(page.Index) + ".txt"
-                corpus_name_full_path = os.path.join(directory, corpus_page_name)
-                self.logger.info("ASES-EB-03 - Uploading corpus blob for " + corpus_page_name + " with path: " + corpus_name_full_path)
-                corpus_text_file_stream = BytesIO(page.Text.encode('utf-8'))
-                self.storage_container_service.upload_corpus_blob(corpus_name_full_path, corpus_text_file_stream)
-            
             self.logger.info("ASES-EB-04 - Splitting text into sections.")
+            async for page in pages:
+                pages_count += 1
+                if upload_corpus:
+                    # The corpus uploads run while the sections are split, embedded and indexed
+                    corpus_uploads.append(asyncio.ensure_future(self.upload_corpus_page(page_full_path, page)))
 
-            sections = self.text_splitter_handler.split_pages(
-                page_full_path=page_full_path,
-                message=message,
-                pages=page_map
-            )
-            
-            self.logger.info("ASES-EB-05 - Indexing sections in into search index, number of sections: "+ str(len(sections)) +".")
+                with span("chunk"):
+                    sections += section_splitter.add_page(page)
+                while len(sections) >= self.section_batch_size:
+                    await self.start_index_batch(index_batches, sections[:self.section_batch_size], search_client, indexing_result)
+                    sections_count += self.section_batch_size
+                    sections = sections[self.section_batch_size:]
+
+            with span("chunk"):
+                sections += section_splitter.finish()
+            sections_count += len(sections)
+            if len(sections) > 0:
+                await self.start_index_batch(index_batches, sections, search_client, indexing_result)
+
+            self.logger.info("ASES-EB-02 - Embedding text in Azure Search index. Page map count: %d", pages_count)
+            self.logger.info("ASES-EB-05 - Indexing sections in into search index, number of sections: %d.", sections_count)
 
-            await self.index_section(sections, search_client)
+            for batch_result in await asyncio.gather(*index_batches):
+                indexing_result.add(batch_result)
+            index_batches = []
+            await asyncio.gather(*corpus_uploads)
 
         except Exception as e:
-            self.logger.error("ASES-EB-06 - Error embedding blob "+page_full_path+" in Azure Search index. Error: "+str(e))
+            self.logger.error("ASES-EB-06 - Error embedding blob %s in Azure Search index. Error: %s", page_full_path, e)
+            indexing_result.error = str(e)
+            # Batches still running when the blob failed are waited for, their sections are recorded too
+            for batch_result in await asyncio.gather(*index_batches, return_exceptions=True):
+                if isinstance(batch_result, IndexingResult):
+                    indexing_result.add(batch_result)
+            await asyncio.gather(*corpus_uploads, return_exceptions=True)
 
-        return True
-    
-    async def parse(self, file_stream: BytesIO, blob_name: str, file_format: str) -> List[PageDetail]:
-        model_id = "prebuilt-layout" if file_format.lower() == "pdf" else "prebuilt-read"
-        self.logger.info("ASES-GDT-01 - Extracting text from " + blob_name + " using Azure Form Recognizer")
+        return indexing_result
+
+    @staticmethod
+    def corpus_blob_prefix(page_full_path: str) -> str:
+        file_name_without_extension = os.path.splitext(os.path.basename(page_full_path))[0]
+        return os.path.join(os.path.dirname(page_full_path), file_name_without_extension + "-")
+
+    @staticmethod
+    def corpus_blob_path(page_full_path: str, index: int) -> str:
+        return AzureSearchEmbedService.corpus_blob_prefix(page_full_path) + str(index) + ".txt"
+
+    async def list_corpus_blob_paths(self, page_full_path: str) -> List[str]:
+        """
+        Paths of all the corpus blobs of a page, one for every page Document Intelligence found in it.
+        """
+        prefix = self.corpus_blob_prefix(page_full_path)
+        corpus_blob_name = re.compile(re.escape(prefix) + r"\d+\.txt")
+        return [name for name in await self.storage_container_service.list_corpus_blobs(prefix) if corpus_blob_name.fullmatch(name)]
+
+    async def upload_corpus_page(self, page_full_path: str, page: PageDetail):
+        corpus_name_full_path = self.corpus_blob_path(page_full_path, page.Index)
+        self.logger.info("ASES-EB-03 - Uploading corpus blob for page %d of %s with path: %s", page.Index, page_full_path, corpus_name_full_path)
+        await self.storage_container_service.upload_with_limit(
+            self.storage_container_service.upload_corpus_blob, corpus_name_full_path, BytesIO(page.Text.encode('utf-8'))
+        )
+
+    async def upload_corpus_pages(self, page_full_path: str, page_map: List[PageDetail]):
+        await asyncio.gather(*[self.upload_corpus_page(page_full_path, page) for page in page_map])
+
+    async def read_corpus_pages(self, page_full_path: str, pages_count: int) -> List[PageDetail]:
+        """
+        Rebuilds the page map of a page from its corpus blobs, the text extracted by an earlier analysis.
+        """
+        texts = await asyncio.gather(*[self.storage_container_service.download_corpus_blob(self.corpus_blob_path(page_full_path, index))
+                                       for index in range(pages_count)])
         page_map = []
+        offset = 0
+        for index, text in enumerate(texts):
+            page_map.append(PageDetail(index, offset, text))
+            offset += len(text)
+        return page_map
+
+    async def start_index_batch(self, index_batches: List[asyncio.Future], sections: List, search_client: SearchClient, indexing_result: IndexingResult):
+        # Keeps a bounded number of batches in flight, the oldest one is waited for to make room
+        while len(index_batches) >= self.section_batch_concurrency:
+            indexing_result.add(await index_batches.pop(0))
+        index_batches.append(asyncio.ensure_future(self.index_section(sections, search_client)))
+
+    async def iterate_pages(self, page_map: List[PageDetail]) -> AsyncGenerator[PageDetail, None]:
+        for page in page_map:
+            yield page
+
+    async def parse(self, file_stream: BytesIO, blob_name: str, file_format: str) -> List[PageDetail]:
+        return [page async for page in self.parse_pages(file_stream=file_stream, blob_name=blob_name, file_format=file_format)]
+
+    async def parse_pages(self, file_stream: BytesIO, blob_name: str, file_format: str) -> AsyncGenerator[PageDetail, None]:
+        """
+        Yields the page map of the document a page at a time, as the text of every page is built.
+        """
+        self.logger.info("ASES-GDT-01 - Extracting text from %s using Azure Form Recognizer", blob_name)
+
+        form_recognizer_results = await self.analyze_document(file_stream=file_stream, file_format=file_format)
+        offset = 0
+
+        tables_by_page = AzureSearchEmbedService.group_tables_by_page(form_recognizer_results)
+        for page_num, page in enumerate(form_recognizer_results.pages):
+            page_text = AzureSearchEmbedService.page_to_text(form_recognizer_results, page, tables_by_page)
+            yield PageDetail(page_num, offset, page_text)
+            offset += len(page_text)
+
+    async def parse_document_pages(self, file_stream: BytesIO, blob_name: str, file_format: str, pages: str = None) -> Dict[int, List[PageDetail]]:
+        """
+        Analyzes the whole document, or only the given 1-based page range (Ex. "1-50"), in a single Document Intelligence job.
+
+        Returns the page map of every analyzed page by its page number, the same page map that parse
+        returns for a document containing only that page.
+        """
+        self.logger.info("ASES-GDP-01 - Extracting text from pages %s of %s using Azure Form Recognizer", pages or "all", blob_name)
 
+        form_recognizer_results = await self.analyze_document(file_stream=file_stream, file_format=file_format, pages=pages)
+
+        page_maps = {}
+        tables_by_page = AzureSearchEmbedService.group_tables_by_page(form_recognizer_results)
+        for page in form_recognizer_results.pages:
+            page_maps[page.page_number] = [PageDetail(0, 0, AzureSearchEmbedService.page_to_text(form_recognizer_results, page, tables_by_page))]
+
+        self.logger.info("ASES-GDP-02 - Extracted text from %d pages of %s.", len(page_maps), blob_name)
+        return page_maps
+
+    async def analyze_document(self, file_stream: BytesIO, file_format: str, pages: str = None) -> AnalyzeResult:
+        model_id = "prebuilt-layout" if file_format.lower() == "pdf" else "prebuilt-read"
         file_format_formatted = "application/pdf" if file_format.lower() == "pdf" else "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        async with DocumentIntelligenceClient(
-            endpoint=os.getenv('AZURE_FORM_RECOGNIZER_SERVICE_ENDPOINT'), credential=DefaultAzureCredential()
-        ) as document_intelligence_client:
-            poller = await document_intelligence_client.begin_analyze_document(
-                model_id=model_id, analyze_request=file_stream, content_type=file_format_formatted
-            )
-            form_recognizer_results = await poller.result()
-            offset = 0
-
-            for page_num, page in enumerate(form_recognizer_results.pages):
-                tables_on_page = [
-                    table
-                    for table in (form_recognizer_results.tables or [])
-                    if table.bounding_regions and table.bounding_regions[0].page_number == page_num + 1
-                ]
+        async with self.document_intelligence_client_pool.client(os.getenv('AZURE_FORM_RECOGNIZER_SERVICE_ENDPOINT')) as document_intelligence_client:
+            with span("analyze"):
+                poller = await document_intelligence_client.begin_analyze_document(
+                    model_id=model_id, analyze_request=file_stream, content_type=file_format_formatted, pages=pages
+                )
+                result = await poller.result()
+        # Document Intelligence bills by analyzed page
+        count("analyzed_pages", len(result.pages or []))
+        return result
+
+    @classmethod
+    def page_to_text(cls, form_recognizer_results: AnalyzeResult, page: DocumentPage, tables_by_page: Dict[int, List[DocumentTable]] = None) -> str:
+        """
+        Text of the page with every table replaced by its html, at the position where the table starts.
+        Pass the result of group_tables_by_page when converting many pages of the same result.
+        """
+        if tables_by_page is None:
+            tables_by_page = cls.group_tables_by_page(form_recognizer_results)
+        tables_on_page = tables_by_page.get(page.page_number, [])
+
+        page_offset = page.spans[0].offset
+        page_length = page.spans[0].length
+        content = form_recognizer_results.content
+        if len(tables_on_page) == 0:
+            return content[page_offset:page_offset + page_length]
+
+        # Every character of the page belongs to the last table with a span over it, or to no table (-1)
+        page_text = []
+        added_tables = set()
+        for start, end, table_id in cls.table_intervals(tables_on_page, page_offset, page_length):
+            if table_id == -1:
+                page_text.append(content[page_offset + start:page_offset + end])
+            elif table_id not in added_tables:
+                page_text.append(cls.table_to_html(tables_on_page[table_id]))
+                added_tables.add(table_id)
+        return "".join(page_text)
+
+    @classmethod
+    def group_tables_by_page(cls, form_recognizer_results: AnalyzeResult) -> Dict[int, List[DocumentTable]]:
+        """
+        Tables of the result by the page number of their first bounding region, in the order of the result.
+        """
+        tables_by_page = {}
+        for table in (form_recognizer_results.tables or []):
+            if table.bounding_regions:
+                tables_by_page.setdefault(table.bounding_regions[0].page_number, []).append(table)
+        return tables_by_page
+
+    @classmethod
+    def table_intervals(cls, tables_on_page: List[DocumentTable], page_offset: int, page_length: int) -> List[tuple]:
+        """
+        Splits [0, page_length) into sorted (start, end, table id) intervals, the table id is -1 outside
+        the tables, and where the spans of tables overlap the table that comes last wins.
+        """
+        spans = []
+        for table_id, table in enumerate(tables_on_page):
+            for table_span in table.spans:
+                start = max(table_span.offset - page_offset, 0)
+                end = min(table_span.offset - page_offset + table_span.length, page_length)
+                if start < end:
+                    spans.append((start, end, table_id))
+
+        boundaries = sorted({0, page_length}.union(position for start, end, _ in spans for position in (start, end)))
+        starts_at = {}
+        for start, end, table_id in spans:
+            starts_at.setdefault(start, []).append((end, table_id))
+
+        intervals = []
+        covering = []  # Max heap of the (-table id, end) of the spans over the current position
+        for start, end in zip(boundaries, boundaries[1:]):
+            for span_end, table_id in starts_at.get(start, []):
+                heapq.heappush(covering, (-table_id, span_end))
+            while len(covering) > 0 and covering[0][1] <= start:
+                heapq.heappop(covering)
+            table_id = -covering[0][0] if len(covering) > 0 else -1
+            if len(intervals) > 0 and intervals[-1][2] == table_id:
+                intervals[-1] = (intervals[-1][0], end, table_id)
+            else:
+                intervals.append((start, end, table_id))
+        return intervals
 
-                # mark all positions of the table spans in the page
-                page_offset = page.spans[0].offset
-                page_length = page.spans[0].length
-                table_chars = [-1] * page_length
-                for table_id, table in enumerate(tables_on_page):
-                    for span in table.spans:
-                        # replace all table spans with "table_id" in table_chars array
-                        for i in range(span.length):
-                            idx = span.offset - page_offset + i
-                            if idx >= 0 and idx < page_length:
-                                table_chars[idx] = table_id
-
-                # build page text by replacing characters in table spans with table html
-                page_text = ""
-                added_tables = set()
-                for idx, table_id in enumerate(table_chars):
-                    if table_id == -1:
-                        page_text += form_recognizer_results.content[page_offset + idx]
-                    elif table_id not in added_tables:
-                        page_text += AzureSearchEmbedService.table_to_html(tables_on_page[table_id])
-                        added_tables.add(table_id)
-
-                page_map.append(PageDetail(page_num, offset, page_text))
-                offset += len(page_text)
-        return page_map
-        
     @classmethod
     def table_to_html(cls, table: DocumentTable):
-        table_html = "<table>"
-        rows = [
-            sorted([cell for cell in table.cells if cell.row_index == i], key=lambda cell: cell.column_index)
-            for i in range(table.row_count)
-        ]
+        # The result models are mappings over the JSON of the response, reading the JSON fields of the
+        # cells skips the deserialization that every attribute access of the model does
+        row_count = table.row_count
+        rows = [[] for _ in range(row_count)]
+        for cell in table.cells:
+            row_index = cell["rowIndex"]
+            if 0 <= row_index < row_count:
+                rows[row_index].append(cell)
+
+        table_html = ["<table>"]
         for row_cells in rows:
-            table_html += "<tr>"
-            for cell in row_cells:
-                tag = "th" if (cell.kind == "columnHeader" or cell.kind == "rowHeader") else "td"
+            table_html.append("<tr>")
+            for cell in sorted(row_cells, key=lambda cell: cell["columnIndex"]):
+                kind = cell.get("kind")
+                tag = "th" if (kind == "columnHeader" or kind == "rowHeader") else "td"
                 cell_spans = ""
-                if cell.column_span is not None and cell.column_span > 1:
-                    cell_spans += f" colSpan={cell.column_span}"
-                if cell.row_span is not None and cell.row_span > 1:
-                    cell_spans += f" rowSpan={cell.row_span}"
-                table_html += f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"
-            table_html += "</tr>"
-        table_html += "</table>"
-        return table_html
+                column_span = cell.get("columnSpan")
+                if column_span is not None and column_span > 1:
+                    cell_spans += f" colSpan={column_span}"
+                row_span = cell.get("rowSpan")
+                if row_span is not None and row_span > 1:
+                    cell_spans += f" rowSpan={row_span}"
+                table_html.append(f"<{tag}{cell_spans}>{html.escape(cell['content'])}</{tag}>")
+            table_html.append("</tr>")
+        table_html.append("</table>")
+        return "".join(table_html)
     
-    async def index_section(self, sections, search_client: SearchClient):
+    def pipeline_settings(self, message: Message, page_full_path: str) -> str:
+        """
+        Settings that change the sections indexed for a page, they are part of the page fingerprint
+        so a page is indexed again when any of them changes.
+        """
+        return "|".join(str(setting) for setting in [
+            os.getenv('INDEX_PIPELINE_VERSION', INDEX_PIPELINE_VERSION),
+            message.originalFileFormat,
+            self.embedding_service.deployment_name,
+            self.text_splitter_handler.max_section_length,
+            self.text_splitter_handler.section_overlap,
+            self.text_splitter_handler.sentence_search_limit,
+            message.fileName,
+            message.storageFilePath,
+            page_full_path,
+            message.theme,
+            message.subtheme,
+            message.language
+        ])
+
+    async def delete_sections(self, search_client: SearchClient, section_ids: List[str]) -> int:
+        removed_count = 0
+        for i in range(0, len(section_ids), SEARCH_DELETE_BATCH_SIZE):
+            removed_docs = await search_client.delete_documents([{"id": section_id} for section_id in section_ids[i:i + SEARCH_DELETE_BATCH_SIZE]])
+            removed_count += len([removed_doc for removed_doc in removed_docs if removed_doc.succeeded])
+        return removed_count
+
+    def split_sections(self, page_map: List[PageDetail], message: Message, page_full_path: str) -> List:
+        """
+        Splits the whole page map into sections at once, the sections embed_blob splits as the pages are parsed.
+        """
+        with span("chunk"):
+            section_splitter = self.text_splitter_handler.section_splitter(page_full_path=page_full_path, message=message)
+            sections = []
+            for page in page_map:
+                sections += section_splitter.add_page(page)
+            return sections + section_splitter.finish()
+
+    async def index_section(self, sections, search_client: SearchClient) -> IndexingResult:
         self.logger.info("ASES-IS-01 - Indexing sections in Azure Search index.")
-        iteration = 0
-
-        batch = IndexDocumentsBatch()
-        
-        self.logger.info("ASES-IS-02 - Creating batch index with "+str(len(sections)) + " sections.")
-        for section in sections:
-            result = await self.open_ai_client.embeddings.create(
-                model=os.getenv("EMBEDDING_DEPLOYMENT_NAME"), input=section.content
-            )
-            embedding = result.data[0].embedding
-            
-            document = {
+        documents = await self.embed_sections(sections)
+        return await self.upload_sections(search_client, documents)
+
+    async def embed_sections(self, sections) -> List[dict]:
+        """
+        Returns the search documents of the sections, with their embeddings.
+        """
+        self.logger.info("ASES-IS-02 - Creating batch index with %d sections.", len(sections))
+        count("sections", len(sections))
+        embeddings = await self.embedding_service.embed([section.content for section in sections])
+
+        documents = []
+        for section, embedding in zip(sections, embeddings):
+            documents.append({
                 "id": section.id,
                 "content": section.content,
                 "sourcepage": section.source_page,
@@ -282,34 +535,10 @@ class AzureSearchEmbedService:
                 "subtheme": section.sub_theme,
                 "originaldocsource": section.original_doc_source,
                 "contentvector": embedding,
-            }
-
-            batch.add_upload_actions([document])
-            iteration += 1
-
-            if iteration % 1000 == 0:
-                self.logger.info(f"ASES-IS-03 - Indexing batch {iteration}")
-                result = search_client.index_documents(batch)
-
-                succeeded = 0
-                for indexing_result in result:
-                    if indexing_result.succeeded == True:
-                        succeeded += 1
-
-                self.logger.info(f"ASES-IS-04 - Result = "+str(result))
-                self.logger.info(f"ASES-IS-04 - Indexed {len(batch.actions)} sections, {succeeded} succeeded")
-                batch = IndexDocumentsBatch()
-
-        if len(batch.actions) > 0:
-            self.logger.info(f"ASES-IS-05 - Indexing batch {iteration}")
-            result = search_client.index_documents(batch)
-
-            succeeded = 0
-            for indexing_result in result:
-                if indexing_result.succeeded == True:
-                    succeeded += 1
+            })
+        return documents
 
-            self.logger.info(f"ASES-IS-04 - Result = "+str(result))
-            self.logger.info(f"ASES-IS-06 - Indexed {len(batch.actions)} sections, {succeeded} succeeded")
-            
-        self.logger.info("ASES-IS-04 - Indexing completed.")
\ No newline at end of file
+    async def upload_sections(self, search_client: SearchClient, documents: List[dict]) -> IndexingResult:
+        indexing_results = await self.search_index_uploader.upload(search_client, documents)
+        self.logger.info("ASES-IS-04 - Indexing completed. %s", Lazy(indexing_results.to_string))
+        return indexing_results
\ No newline at end of file
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, List
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from services.Logger import Logger
+
+DEFAULT_EMBEDDING_CACHE_BACKEND = "local"
+DEFAULT_EMBEDDING_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_EMBEDDING_CACHE_CONTAINER = "embeddingcache"
+
+
+class EmbeddingCache(ABC):
+    """
+    Content-addressed store of embeddings keyed by a hash of the deployment name and the section text.
+
+    Vectors are stored as float32, the same precision as the contentvector field of the search index.
+    """
+
+    def __init__(self):
+        self.logger = Logger()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(deployment_name: str, text: str) -> str:
+        return hashlib.sha256(f"{deployment_name}\0{text}".encode('utf-8')).hexdigest()
+
+    async def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = await self.get(keys)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def put_many(self, embeddings: Dict[str, List[float]]):
+        if len(embeddings) > 0:
+            await self.put(embeddings)
+
+    @abstractmethod
+    async def get(self, keys: List[str]) -> Dict[str, List[float]]:
+        pass
+
+    @abstractmethod
+    async def put(self, embeddings: Dict[str, List[float]]):
+        pass
+
+    async def close(self):
+        pass
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def to_string(self):
+        return f"Hits: {self.hits}, Misses: {self.misses}, Hit ratio: {self.hit_ratio():.2%}"
+
+    @staticmethod
+    def serialize(embedding: List[float]) -> bytes:
+        return array('f', embedding).tobytes()
+
+    @staticmethod
+    def deserialize(data: bytes) -> List[float]:
+        vector = array('f')
+        vector.frombytes(data)
+        return vector.tolist()
+
+
+class LocalEmbeddingCache(EmbeddingCache):
+    """
+    On-disk SQLite cache, evicts the least recently used embeddings once the stored vectors exceed max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        super().__init__()
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "embeddings.sqlite")
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self.connection.commit()
+        self.logger.info("EMC-INIT-01 - Using local embedding cache '%s' with max size %d bytes.", self.path, max_bytes)
+
+    async def get(self, keys: List[str]) -> Dict[str, List[float]]:
+        return await asyncio.to_thread(self.get_sync, keys)
+
+    async def put(self, embeddings: Dict[str, List[float]]):
+        await asyncio.to_thread(self.put_sync, embeddings)
+
+    def get_sync(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self.lock:
+            # Stay below the default SQLite limit of host parameters per statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = self.deserialize(vector)
+            if len(found) > 0:
+                now = time.time()
+                self.connection.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key in found])
+                self.connection.commit()
+        return found
+
+    def put_sync(self, embeddings: Dict[str, List[float]]):
+        now = time.time()
+        rows = []
+        for key, embedding in embeddings.items():
+            data = self.serialize(embedding)
+            rows.append((key, data, len(data), now))
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            self.connection.commit()
+            self.evict()
+
+    async def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def evict(self):
+        total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        evicted_keys = []
+        for key, size in self.connection.execute("SELECT key, size FROM embeddings ORDER BY last_access"):
+            if total_bytes <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            total_bytes -= size
+        self.connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted_keys)
+        self.connection.commit()
+        self.logger.info("EMC-EV-01 - Evicted %d embeddings from local cache, size is now %d bytes.", len(evicted_keys), total_bytes)
+
+
+class BlobEmbeddingCache(EmbeddingCache):
+    """
+    Blob-backed cache shared by all function instances, one blob per embedding.
+    Eviction is left to a lifecycle management policy on the container.
+    """
+
+    def __init__(self, blob_service_client, container_name: str, max_concurrency: int = 16):
+        super().__init__()
+        self.container_client = blob_service_client.get_container_client(container_name)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.container_lock = asyncio.Lock()
+        self.container_exists = False
+        self.logger.info("EMC-INIT-02 - Using blob embedding cache in container '%s'.", container_name)
+
+    async def get(self, keys: List[str]) -> Dict[str, List[float]]:
+        vectors = await asyncio.gather(*[self.get_one(key) for key in keys])
+        return {key: vector for key, vector in zip(keys, vectors) if vector is not None}
+
+    async def put(self, embeddings: Dict[str, List[float]]):
+        await self.ensure_container_exists()
+        await asyncio.gather(*[self.put_one(key, embedding) for key, embedding in embeddings.items()])
+
+    async def ensure_container_exists(self):
+        async with self.container_lock:
+            if not self.container_exists:
+                try:
+                    await self.container_client.create_container()
+                except ResourceExistsError:
+                    pass
+                self.container_exists = True
+
+    async def get_one(self, key: str):
+        async with self.semaphore:
+            try:
+                downloader = await self.container_client.download_blob(key)
+                data = await downloader.readall()
+            except ResourceNotFoundError:
+                return None
+            except Exception as e:
+                # A failed cache read is a cache miss, the embedding is computed again
+                self.logger.warning("EMC-GET-01 - Error reading embedding %s from blob cache: %s", key, e)
+                return None
+        return self.deserialize(data)
+
+    async def put_one(self, key: str, embedding: List[float]):
+        async with self.semaphore:
+            try:
+                await self.container_client.upload_blob(name=key, data=self.serialize(embedding), overwrite=True)
+            except Exception as e:
+                # A failed cache write only costs a future cache miss
+                self.logger.warning("EMC-PUT-01 - Error writing embedding %s to blob cache: %s", key, e)
+
+
+def create_embedding_cache(blob_service_client) -> EmbeddingCache:
+    backend = os.getenv('EMBEDDING_CACHE_BACKEND', DEFAULT_EMBEDDING_CACHE_BACKEND).lower()
+    if backend == "local":
+        return LocalEmbeddingCache(
+            directory=os.getenv('EMBEDDING_CACHE_DIR', os.path.join(tempfile.gettempdir(), "embeddingcache")),
+            max_bytes=int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', DEFAULT_EMBEDDING_CACHE_MAX_BYTES))
+        )
+    if backend == "blob":
+        return BlobEmbeddingCache(
+            blob_service_client=blob_service_client,
+            container_name=os.getenv('EMBEDDING_CACHE_CONTAINER', DEFAULT_EMBEDDING_CACHE_CONTAINER)
+        )
+    if backend == "none":
+        return None
+    raise ValueError(f"Invalid embedding cache backend: {backend}")
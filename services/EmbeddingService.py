@@ -0,0 +1,123 @@
+import asyncio
+import dataclasses
+import math
+import os
+import time
+from typing import List
+from openai import AsyncAzureOpenAI
+from models.EmbeddingThroughput import EmbeddingThroughput
+from services.EmbeddingCache import EmbeddingCache
+from services.Logger import Lazy, Logger
+from services.Metrics import count, span
+
+DEFAULT_EMBEDDING_BATCH_SIZE = 16  # Max inputs per embeddings request accepted by the deployment
+DEFAULT_EMBEDDING_BATCH_MAX_TOKENS = 8000  # Token budget for a single embeddings request
+DEFAULT_EMBEDDING_MAX_CONCURRENCY = 4  # Embeddings requests in flight at the same time
+
+CHARACTERS_PER_TOKEN = 4  # Roughly 1000 chars are 250 tokens, see README
+
+
+class EmbeddingService:
+    def __init__(self, open_ai_client: AsyncAzureOpenAI, deployment_name: str, cache: EmbeddingCache = None):
+        self.logger = Logger()
+        self.open_ai_client = open_ai_client
+        self.deployment_name = deployment_name
+        self.cache = cache
+        self.batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', DEFAULT_EMBEDDING_BATCH_SIZE))
+        self.batch_max_tokens = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', DEFAULT_EMBEDDING_BATCH_MAX_TOKENS))
+        self.max_concurrency = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', DEFAULT_EMBEDDING_MAX_CONCURRENCY))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.throughput = EmbeddingThroughput()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        with span("embed"):
+            return await self.embed_with_cache(texts)
+
+    async def embed_with_cache(self, texts: List[str]) -> List[List[float]]:
+        embeddings = [None] * len(texts)
+        if len(texts) == 0:
+            return embeddings
+
+        # Identical texts are only looked up and embedded once
+        keys = [EmbeddingCache.key_for(self.deployment_name, text) for text in texts]
+        unique_texts = {}
+        for key, text in zip(keys, texts):
+            unique_texts.setdefault(key, text)
+
+        cached = {}
+        if self.cache is not None:
+            cached = await self.cache.get_many(list(unique_texts.keys()))
+            # The counters are passed as they are now, the cache keeps counting before the record is formatted
+            self.logger.info("EMB-EM-04 - Embedding cache. Hits: %d, Misses: %d, Hit ratio: %.2f%%", self.cache.hits, self.cache.misses, self.cache.hit_ratio() * 100)
+
+        count("cached_embeddings", len(cached))
+        missing_keys = [key for key in unique_texts if key not in cached]
+        missing_texts = [unique_texts[key] for key in missing_keys]
+        computed = dict(zip(missing_keys, await self.embed_texts(missing_texts)))
+
+        if self.cache is not None:
+            await self.cache.put_many(computed)
+
+        for i, key in enumerate(keys):
+            embeddings[i] = cached[key] if key in cached else computed[key]
+        return embeddings
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        embeddings = [None] * len(texts)
+        if len(texts) == 0:
+            return embeddings
+
+        batches = self.create_batches(texts)
+        self.logger.info("EMB-EM-01 - Embedding %d sections in %d requests, concurrency %d.", len(texts), len(batches), self.max_concurrency)
+
+        start = time.perf_counter()
+        tokens = await asyncio.gather(*[self.embed_batch(texts, batch, embeddings) for batch in batches])
+
+        throughput = EmbeddingThroughput(
+            sections=len(texts),
+            tokens=sum(tokens),
+            requests=len(batches),
+            elapsed_seconds=time.perf_counter() - start
+        )
+        self.throughput.add(throughput)
+        count("embedding_tokens", throughput.tokens)
+        count("embedding_requests", throughput.requests)
+
+        self.logger.info("EMB-EM-02 - Embedding throughput: %s", Lazy(throughput.to_string))
+        # A copy, the accumulated throughput keeps changing until the record is formatted
+        self.logger.info("EMB-EM-03 - Accumulated embedding throughput: %s", Lazy(dataclasses.replace(self.throughput).to_string))
+        return embeddings
+
+    def create_batches(self, texts: List[str]) -> List[List[int]]:
+        # Packs consecutive texts into requests bounded by the input count and the token budget.
+        # A single text above the budget still goes alone in its own request.
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for i, text in enumerate(texts):
+            text_tokens = self.estimate_tokens(text)
+            if len(batch) > 0 and (len(batch) >= self.batch_size or batch_tokens + text_tokens > self.batch_max_tokens):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(i)
+            batch_tokens += text_tokens
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    async def embed_batch(self, texts: List[str], batch: List[int], embeddings: List[List[float]]) -> int:
+        async with self.semaphore:
+            result = await self.open_ai_client.embeddings.create(
+                model=self.deployment_name, input=[texts[i] for i in batch]
+            )
+
+        # The service does not guarantee the order of the data items, use their index instead
+        for item in result.data:
+            embeddings[batch[item.index]] = item.embedding
+
+        return result.usage.total_tokens if result.usage is not None else 0
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return max(1, math.ceil(len(text) / CHARACTERS_PER_TOKEN))
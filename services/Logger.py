@@ -1,37 +1,186 @@
+import atexit
 import logging
 import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
 from opencensus.ext.azure.log_exporter import AzureLogHandler
 
+DEFAULT_LOG_MODE = "queue"  # "queue" formats and exports the records in a background thread, "sync" does it in the logging call
+DEFAULT_LOG_QUEUE_SIZE = 10000  # Records waiting for the background thread, the records logged while it is full are dropped
+DEFAULT_LOG_SAMPLE_RATES = ""  # Share of the info records of a code that are logged, i.e. "DP-PR-04=0.1,ASES-EB-*=0.01"
+DEFAULT_LOG_RATE_LIMITS = ""  # Info records of a code logged per second, i.e. "SCS-UPB-*=5"
+
+_log_listener: QueueListener = None
+
+
+def add_cloud_role(envelope):
+    # Telemetry processor of the logs and metrics sent to Application Insights
+    envelope.tags['ai.cloud.role'] = 'ingestion-processor'
+    return True
+
+
+def stop_log_listener():
+    """
+    Writes the records still waiting in the queue of the "queue" LOG_MODE. Runs when the process exits,
+    call it at the end of processes that skip the exit handlers, i.e. multiprocessing workers.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+class Lazy:
+    """
+    Log argument built only when the record is formatted, i.e. logger.info("PR-01 - Message: %s", Lazy(message.to_string)).
+    Nothing is built for the records that are sampled out. In the "queue" LOG_MODE the record is formatted later,
+    in the background thread, so pass a copy of values that keep changing.
+    """
+
+    def __init__(self, build):
+        self.build = build
+
+    def __str__(self):
+        return str(self.build())
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Hands the records to the QueueListener as they are, the message is formatted by the handlers in its thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Logging never blocks the caller
+            self.dropped += 1
+
+
+class LogSampler(logging.Filter):
+    """
+    Samples and rate limits the info records by their code, the text before " - " (Ex. "DP-PR-04").
+    A rule applies to a code, or to every code starting with a prefix when it ends with "*".
+    Warnings and errors are always logged.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self.rules = {}
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def parse_rules(setting: str) -> Dict[str, float]:
+        rules = {}
+        for rule in setting.split(","):
+            code, separator, value = rule.partition("=")
+            if separator:
+                rules[code.strip()] = float(value)
+        return rules
+
+    @staticmethod
+    def match(code: str, rules: Dict[str, float]) -> float:
+        if code in rules:
+            return rules[code]
+        prefixes = [prefix for prefix in rules if prefix.endswith("*") and code.startswith(prefix[:-1])]
+        return rules[max(prefixes, key=len)] if len(prefixes) > 0 else None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or not isinstance(record.msg, str):
+            return True
+        code = record.msg.split(" - ", 1)[0]
+        rule = self.rules.get(code)
+        if rule is None:
+            rule = self.rules[code] = (self.match(code, self.sample_rates), self.match(code, self.rate_limits))
+        sample_rate, rate_limit = rule
+
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+        if rate_limit is not None:
+            return self.within_rate_limit(code, rate_limit)
+        return True
+
+    def within_rate_limit(self, code: str, rate_limit: float) -> bool:
+        now = time.monotonic()
+        previously_dropped = 0
+        with self.lock:
+            window_start, logged, dropped = self.windows.get(code, (now, 0, 0))
+            if now - window_start >= 1:
+                previously_dropped = dropped
+                window_start, logged, dropped = now, 0, 0
+            allowed = logged < rate_limit
+            if allowed:
+                self.windows[code] = (window_start, logged + 1, dropped)
+            else:
+                self.windows[code] = (window_start, logged, dropped + 1)
+        # Logged outside of the lock, the record goes through this filter too
+        if previously_dropped > 0:
+            logging.getLogger().info("LG-RL-01 - Dropped %d records of code %s over the rate limit of %g per second.", previously_dropped, code, rate_limit)
+        return allowed
+
 
 class Logger:
+    """
+    Logs to the root logger, set up by the first Logger with an Application Insights handler and a stream handler.
+
+    In the "queue" LOG_MODE the records are handed to a background thread that formats and exports them.
+    Pass the values as arguments, i.e. logger.info("DP-PR-04 - Start working on pdf page: %s", path),
+    so they are only formatted for the records that are logged.
+    """
+
     def __init__(self):
+        global _log_listener
         self.logger = logging.getLogger()
         if not self.logger.handlers:
             log_level = os.getenv('LOG_LEVEL', 'INFO')
             self.logger.setLevel(getattr(logging, log_level))
-            
-            # Callback function to add os_type: linux to span properties
-            def callback_function(envelope):
-                envelope.tags['ai.cloud.role'] = 'ingestion-processor'
-                return True
 
             # Azure log handler
             azure_handler = AzureLogHandler(connection_string=os.getenv('APPLICATIONINSIGHTS_CONNECTION_STRING'))
-            azure_handler.add_telemetry_processor(callback_function)
+            azure_handler.add_telemetry_processor(add_cloud_role)
             formatter = logging.Formatter('%(filename)s - %(levelname)s - %(message)s')
             azure_handler.setFormatter(formatter)
-            self.logger.addHandler(azure_handler)
 
             # Stream handler
             stream_handler = logging.StreamHandler()
             stream_handler.setFormatter(formatter)
-            self.logger.addHandler(stream_handler)
 
-    def info(self, message):
-        self.logger.info(message)
+            if os.getenv('LOG_MODE', DEFAULT_LOG_MODE).lower() == "queue":
+                log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', DEFAULT_LOG_QUEUE_SIZE)))
+                self.logger.addHandler(LazyQueueHandler(log_queue))
+                _log_listener = QueueListener(log_queue, azure_handler, stream_handler, respect_handler_level=True)
+                _log_listener.start()
+                atexit.register(stop_log_listener)
+            else:
+                self.logger.addHandler(azure_handler)
+                self.logger.addHandler(stream_handler)
+
+        if not any(isinstance(log_filter, LogSampler) for log_filter in self.logger.filters):
+            sample_rates = LogSampler.parse_rules(os.getenv('LOG_SAMPLE_RATES', DEFAULT_LOG_SAMPLE_RATES))
+            rate_limits = LogSampler.parse_rules(os.getenv('LOG_RATE_LIMITS', DEFAULT_LOG_RATE_LIMITS))
+            if len(sample_rates) > 0 or len(rate_limits) > 0:
+                self.logger.addFilter(LogSampler(sample_rates, rate_limits))
+
+    # stacklevel=2 records the file of the caller instead of this one
+    def info(self, message, *args):
+        self.logger.info(message, *args, stacklevel=2)
 
-    def error(self, message):
-        self.logger.error(message)
+    def error(self, message, *args):
+        self.logger.error(message, *args, stacklevel=2)
 
-    def warning(self, message):
-        self.logger.warning(message)
+    def warning(self, message, *args):
+        self.logger.warning(message, *args, stacklevel=2)
@@ -0,0 +1,140 @@
+import contextvars
+import datetime
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+from opencensus.ext.azure.metrics_exporter import MetricsExporter
+from opencensus.metrics import transport
+from opencensus.metrics.export.metric import Metric
+from opencensus.metrics.export.metric_descriptor import MetricDescriptor, MetricDescriptorType
+from opencensus.metrics.export.metric_producer import MetricProducer
+from opencensus.metrics.export.point import Point
+from opencensus.metrics.export.time_series import TimeSeries
+from opencensus.metrics.export.value import ValueDouble
+from opencensus.metrics.label_key import LabelKey
+from opencensus.metrics.label_value import LabelValue
+from models.DocumentMetrics import DocumentMetrics
+from services.Logger import Logger, add_cloud_role
+
+DEFAULT_METRICS_EXPORT_INTERVAL_SECONDS = 15  # The metrics of the documents finished since the last export are sent this often
+METRIC_NAME_PREFIX = "indexing/"
+
+# Metrics of the document being indexed, the tasks started while indexing it inherit them
+_current_document_metrics: contextvars.ContextVar = contextvars.ContextVar("document_metrics", default=None)
+
+
+@contextmanager
+def document_metrics(file_id: str, theme: str, language: str):
+    """
+    Collects the spans and counters recorded while indexing a document, the time of the whole indexing is the "document" span.
+    """
+    metrics = DocumentMetrics(file_id=file_id, theme=theme, language=language)
+    token = _current_document_metrics.set(metrics)
+    started = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add_span("document", time.perf_counter() - started)
+        _current_document_metrics.reset(token)
+
+
+def current_document_metrics() -> DocumentMetrics:
+    return _current_document_metrics.get()
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times the block as a span of the document being indexed, it isn't recorded outside of document_metrics.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - started)
+
+
+def add_span(name: str, seconds: float):
+    metrics = _current_document_metrics.get()
+    if metrics is not None:
+        metrics.add_span(name, seconds)
+
+
+def count(name: str, value: int = 1):
+    metrics = _current_document_metrics.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def export_document_metrics(metrics: DocumentMetrics):
+    DocumentMetricsExporter.get().record(metrics)
+
+
+class DocumentMetricsExporter(MetricProducer):
+    """
+    Sends the metrics of every document once, as Application Insights custom metrics tagged with the theme,
+    language and fileId of the document, from the background thread of the opencensus Azure exporter.
+    The spans are sent as the indexing/span_seconds and indexing/span_count metrics, with the span name as a tag.
+
+    Nothing is sent when APPLICATIONINSIGHTS_CONNECTION_STRING is not set.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.logger = Logger()
+        self.pending: List[tuple] = []
+        self.lock = threading.Lock()
+        self.exporter = None
+        connection_string = os.getenv('APPLICATIONINSIGHTS_CONNECTION_STRING')
+        if connection_string:
+            export_interval = float(os.getenv('METRICS_EXPORT_INTERVAL_SECONDS', DEFAULT_METRICS_EXPORT_INTERVAL_SECONDS))
+            # The host metrics are left to the Functions host, only the document metrics are sent
+            self.exporter = MetricsExporter(connection_string=connection_string, enable_standard_metrics=False, export_interval=export_interval)
+            self.exporter.add_telemetry_processor(add_cloud_role)
+            # Flushed by the exporter when the process exits
+            self.exporter.exporter_thread = transport.get_exporter_thread([self], self.exporter, interval=export_interval)
+            self.logger.info("MT-EX-01 - Exporting document metrics every %ss.", export_interval)
+
+    @classmethod
+    def get(cls) -> "DocumentMetricsExporter":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = DocumentMetricsExporter()
+            return cls._instance
+
+    def record(self, metrics: DocumentMetrics):
+        if self.exporter is None:
+            return
+        with self.lock:
+            self.pending.append((metrics, datetime.datetime.now(datetime.timezone.utc)))
+
+    def get_metrics(self) -> List[Metric]:
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+
+        series: Dict[str, List[TimeSeries]] = {}
+        label_keys: Dict[str, List[LabelKey]] = {}
+
+        def add(name: str, tags: Dict[str, str], metric_value: float, timestamp: datetime.datetime):
+            label_keys.setdefault(name, [LabelKey(key, key) for key in tags])
+            series.setdefault(name, []).append(TimeSeries(
+                [LabelValue(tag) for tag in tags.values()],
+                [Point(ValueDouble(float(metric_value)), timestamp)],
+                timestamp
+            ))
+
+        for metrics, timestamp in pending:
+            tags = metrics.tags()
+            for name, counter in metrics.counters.items():
+                add(METRIC_NAME_PREFIX + name, tags, counter, timestamp)
+            for name, span_metrics in metrics.spans.items():
+                span_tags = dict(tags, span=name)
+                add(METRIC_NAME_PREFIX + "span_seconds", span_tags, span_metrics.seconds, timestamp)
+                add(METRIC_NAME_PREFIX + "span_count", span_tags, span_metrics.count, timestamp)
+
+        return [Metric(MetricDescriptor(name, name, "1", MetricDescriptorType.GAUGE_DOUBLE, label_keys[name]), name_series)
+                for name, name_series in series.items()]
@@ -0,0 +1,101 @@
+import json
+import os
+from azure.identity.aio import DefaultAzureCredential
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.queue import QueueMessage, TextBase64DecodePolicy, TextBase64EncodePolicy
+from azure.storage.queue.aio import QueueClient
+from infra.HttpSession import create_shared_transport
+from services.Logger import Logger
+
+DEFAULT_ACTION_QUEUE_NAME = "original-docs-action-received"  # Queue of the ActionReceivedFunc trigger
+
+
+class QueueService:
+    """
+    Sends messages to the queue the worker is triggered by, i.e. the continuation of a document
+    whose indexing was stopped before the function timeout, and receives them for the standalone worker.
+
+    Uses the queue service of the trigger connection: AzureWebJobsStorage holds either a connection string or
+    the queue service URI (i.e. https://<storage_account_name>.queue.core.windows.net/), used with the worker credential.
+    Identity based connections set AzureWebJobsStorage__queueServiceUri or AzureWebJobsStorage__accountName instead.
+    The queue client is created by the first call that uses it, the messages that never send one don't need the queue settings.
+    """
+
+    def __init__(self, credential: DefaultAzureCredential = None, queue_name: str = None):
+        self.logging = Logger()
+        self.queue_name = queue_name or os.getenv('ACTION_QUEUE_NAME', DEFAULT_ACTION_QUEUE_NAME)
+        self.owns_credential = credential is None
+        self.credential = credential if credential is not None else DefaultAzureCredential()
+        self.queue_client = None
+        self.poison_queue_client = None
+
+    @staticmethod
+    def queue_connection() -> str:
+        connection = os.getenv('AzureWebJobsStorage') or os.getenv('AzureWebJobsStorage__queueServiceUri')
+        if connection:
+            return connection
+        account_name = os.getenv('AzureWebJobsStorage__accountName')
+        if account_name:
+            return f"https://{account_name}.queue.core.windows.net/"
+        raise ValueError("The queue connection is not set, set AzureWebJobsStorage, AzureWebJobsStorage__queueServiceUri or AzureWebJobsStorage__accountName")
+
+    def get_queue_client(self) -> QueueClient:
+        if self.queue_client is None:
+            self.queue_client = self.create_queue_client(self.queue_name)
+        return self.queue_client
+
+    def create_queue_client(self, queue_name: str) -> QueueClient:
+        connection = self.queue_connection()
+        # host.json reads the queue messages as base64
+        if connection.lower().startswith("https://"):
+            return QueueClient(account_url=connection,
+                               queue_name=queue_name,
+                               credential=self.credential,
+                               transport=create_shared_transport(),
+                               message_encode_policy=TextBase64EncodePolicy(),
+                               message_decode_policy=TextBase64DecodePolicy())
+        return QueueClient.from_connection_string(conn_str=connection,
+                                                  queue_name=queue_name,
+                                                  transport=create_shared_transport(),
+                                                  message_encode_policy=TextBase64EncodePolicy(),
+                                                  message_decode_policy=TextBase64DecodePolicy())
+
+    async def close(self):
+        if self.queue_client is not None:
+            await self.queue_client.close()
+        if self.poison_queue_client is not None:
+            await self.poison_queue_client.close()
+        if self.owns_credential:
+            await self.credential.close()
+
+    async def send_message(self, content: dict, visibility_timeout: int = None):
+        self.logging.info("QS-SM-01 - Sending message to queue '%s'.", self.queue_name)
+        await self.get_queue_client().send_message(json.dumps(content), visibility_timeout=visibility_timeout)
+        self.logging.info("QS-SM-02 - Message sent.")
+
+    async def receive_message(self, visibility_timeout: int) -> QueueMessage:
+        return await self.get_queue_client().receive_message(visibility_timeout=visibility_timeout)
+
+    async def delete_message(self, message: QueueMessage):
+        await self.get_queue_client().delete_message(message)
+
+    async def update_visibility(self, message: QueueMessage, visibility_timeout: int) -> QueueMessage:
+        """
+        Keeps the message hidden for visibility_timeout more seconds, the returned message holds the new pop receipt.
+        """
+        updated = await self.get_queue_client().update_message(message, visibility_timeout=visibility_timeout)
+        message.pop_receipt = updated.pop_receipt
+        message.next_visible_on = updated.next_visible_on
+        return message
+
+    async def move_to_poison_queue(self, message: QueueMessage):
+        # Same <queue>-poison queue the Functions host moves the messages to after maxDequeueCount
+        if self.poison_queue_client is None:
+            self.poison_queue_client = self.create_queue_client(self.queue_name + "-poison")
+            try:
+                await self.poison_queue_client.create_queue()
+            except ResourceExistsError:
+                pass
+        self.logging.error("QS-PQ-01 - Moving message %s to queue '%s-poison' after %d attempts.", message.id, self.queue_name, message.dequeue_count)
+        await self.poison_queue_client.send_message(message.content)
+        await self.get_queue_client().delete_message(message)
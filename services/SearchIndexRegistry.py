@@ -0,0 +1,66 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from services.Logger import Logger
+
+DEFAULT_SEARCH_INDEX_CACHE_TTL_SECONDS = 3600  # How long an index seen to exist is trusted without asking the search service again
+
+
+class SearchIndexRegistry:
+    """
+    Search indexes known to exist, shared by all the messages processed by the worker.
+
+    A known index needs no management-plane call until its entry expires. On a miss the index is
+    looked up by name and created when absent, one check per index name at a time.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.logger = Logger()
+        self.ttl_seconds = ttl_seconds
+        self.known_indexes: Dict[str, float] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    def is_known(self, search_index_name: str) -> bool:
+        expires_at = self.known_indexes.get(search_index_name)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def remember(self, search_index_name: str):
+        self.known_indexes[search_index_name] = time.monotonic() + self.ttl_seconds
+
+    async def ensure_exists(self, search_index_client, search_index_name: str, create_index: Callable[[str], Awaitable]):
+        if self.is_known(search_index_name):
+            self.logger.info("SIR-EE-01 - Search index %s is known to exist.", search_index_name)
+            return
+
+        lock = self.locks.setdefault(search_index_name, asyncio.Lock())
+        async with lock:
+            # Another message may have checked the index while this one was waiting
+            if self.is_known(search_index_name):
+                return
+
+            try:
+                await search_index_client.get_index(search_index_name)
+                self.logger.info("SIR-EE-02 - Search index %s already exists.", search_index_name)
+            except ResourceNotFoundError:
+                self.logger.info("SIR-EE-03 - Creating %s search index.", search_index_name)
+                try:
+                    await create_index(search_index_name)
+                except ResourceExistsError:
+                    self.logger.info("SIR-EE-04 - Search index %s was created by another instance.", search_index_name)
+                except HttpResponseError as e:
+                    if e.status_code != 409:
+                        raise
+                    self.logger.info("SIR-EE-04 - Search index %s was created by another instance.", search_index_name)
+            self.remember(search_index_name)
+
+
+_registry = None
+
+
+def get_search_index_registry() -> SearchIndexRegistry:
+    global _registry
+    if _registry is None:
+        _registry = SearchIndexRegistry(float(os.getenv('SEARCH_INDEX_CACHE_TTL_SECONDS', DEFAULT_SEARCH_INDEX_CACHE_TTL_SECONDS)))
+    return _registry
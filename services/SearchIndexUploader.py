@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import random
+from typing import List
+from azure.search.documents.aio import SearchClient
+from models.IndexingResult import IndexingResult
+from services.Logger import Lazy, Logger
+from services.Metrics import count, span
+
+DEFAULT_SEARCH_UPLOAD_BATCH_SIZE = 1000  # Max documents per indexing request accepted by Azure AI Search
+DEFAULT_SEARCH_UPLOAD_BATCH_MAX_BYTES = 8 * 1024 * 1024  # Payload budget of a request, Azure AI Search rejects requests above 16 MB
+DEFAULT_SEARCH_UPLOAD_MAX_CONCURRENCY = 4  # Indexing requests in flight at the same time
+DEFAULT_SEARCH_UPLOAD_MAX_RETRIES = 3  # Retries of the documents that failed with a transient status
+DEFAULT_SEARCH_UPLOAD_RETRY_DELAY_SECONDS = 1  # Delay before the first retry, doubled on every retry
+
+# Per document statuses worth retrying, see https://learn.microsoft.com/rest/api/searchservice/addupdate-or-delete-documents
+RETRIABLE_STATUS_CODES = {409, 422, 429, 503}
+FLOAT_JSON_MAX_CHARACTERS = 25  # Longest JSON representation of a float, i.e. -1.2345678901234567e-123
+
+
+class SearchIndexUploader:
+    """
+    Uploads documents to a search index in batches bounded by the document count and the payload size,
+    with a bounded number of requests in flight.
+
+    Documents that fail with a transient status are retried on their own with exponential backoff.
+    The requests that fail as a whole were already retried by the client pipeline, their documents are failed.
+    """
+
+    def __init__(self):
+        self.logger = Logger()
+        self.batch_size = int(os.getenv('SEARCH_UPLOAD_BATCH_SIZE', DEFAULT_SEARCH_UPLOAD_BATCH_SIZE))
+        self.batch_max_bytes = int(os.getenv('SEARCH_UPLOAD_BATCH_MAX_BYTES', DEFAULT_SEARCH_UPLOAD_BATCH_MAX_BYTES))
+        self.max_concurrency = int(os.getenv('SEARCH_UPLOAD_MAX_CONCURRENCY', DEFAULT_SEARCH_UPLOAD_MAX_CONCURRENCY))
+        self.max_retries = int(os.getenv('SEARCH_UPLOAD_MAX_RETRIES', DEFAULT_SEARCH_UPLOAD_MAX_RETRIES))
+        self.retry_delay_seconds = float(os.getenv('SEARCH_UPLOAD_RETRY_DELAY_SECONDS', DEFAULT_SEARCH_UPLOAD_RETRY_DELAY_SECONDS))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def upload(self, search_client: SearchClient, documents: List[dict]) -> IndexingResult:
+        result = IndexingResult()
+        if len(documents) == 0:
+            return result
+
+        batches = self.create_batches(documents)
+        self.logger.info("SIU-UP-01 - Uploading %d documents in %d requests, concurrency %d.", len(documents), len(batches), self.max_concurrency)
+        with span("index"):
+            for batch_result in await asyncio.gather(*[self.upload_batch(search_client, batch) for batch in batches]):
+                result.add(batch_result)
+        count("indexed_sections", len(result.succeeded_ids))
+        count("failed_sections", len(result.failed_ids))
+
+        self.logger.info("SIU-UP-02 - Upload completed. %s", Lazy(result.to_string))
+        return result
+
+    def create_batches(self, documents: List[dict]) -> List[List[dict]]:
+        # Packs consecutive documents into requests bounded by the document count and the payload budget.
+        # A single document above the budget still goes alone in its own request.
+        batches = []
+        batch = []
+        batch_bytes = 0
+        for document in documents:
+            document_bytes = self.estimate_bytes(document)
+            if len(batch) > 0 and (len(batch) >= self.batch_size or batch_bytes + document_bytes > self.batch_max_bytes):
+                batches.append(batch)
+                batch = []
+                batch_bytes = 0
+            batch.append(document)
+            batch_bytes += document_bytes
+            count("indexed_bytes", document_bytes)
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    async def upload_batch(self, search_client: SearchClient, documents: List[dict]) -> IndexingResult:
+        result = IndexingResult()
+        pending = documents
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    item_results = await search_client.upload_documents(documents=pending)
+            except Exception as e:
+                self.logger.error("SIU-UB-01 - Error uploading %d documents. Error: %s", len(pending), e)
+                result.failed_ids += [document["id"] for document in pending]
+                result.error = str(e)
+                return result
+
+            retry_ids = set()
+            for item in item_results:
+                if item.succeeded:
+                    result.succeeded_ids.append(item.key)
+                elif item.status_code in RETRIABLE_STATUS_CODES and attempt < self.max_retries:
+                    retry_ids.add(item.key)
+                else:
+                    self.logger.error("SIU-UB-02 - Document %s failed with status %s. Error: %s", item.key, item.status_code, item.error_message)
+                    result.failed_ids.append(item.key)
+
+            if len(retry_ids) == 0:
+                return result
+
+            attempt += 1
+            count("retries", len(retry_ids))
+            delay = self.retry_delay_seconds * (2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+            self.logger.info("SIU-UB-03 - Retrying %d documents in %.2fs, attempt %d of %d.", len(retry_ids), delay, attempt, self.max_retries)
+            await asyncio.sleep(delay)
+            pending = [document for document in pending if document["id"] in retry_ids]
+
+    @staticmethod
+    def estimate_bytes(document: dict) -> int:
+        # Upper bound of the serialized document, the vectors are not serialized to keep it cheap
+        size = 0
+        scalars = {}
+        for name, value in document.items():
+            if isinstance(value, list) and len(value) > 0 and isinstance(value[0], float):
+                size += len(name) + 4 + len(value) * (FLOAT_JSON_MAX_CHARACTERS + 1)
+            else:
+                scalars[name] = value
+        return size + len(json.dumps(scalars).encode('utf-8'))
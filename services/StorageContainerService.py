@@ -1,82 +1,232 @@
+import asyncio
+import io
 import os
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from azure.identity import DefaultAzureCredential
-from io import BytesIO
-from exceptions.StorageContainerServiceExceptions import BlobFileDoesntExistsError
-from services.Logger import Logger
+from typing import List, Tuple
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
+from azure.identity.aio import DefaultAzureCredential
+import tempfile
+from azure.core.exceptions import ResourceNotFoundError
+from exceptions.StorageContainerServiceExceptions import BlobDeletionError, BlobFileDoesntExistsError
+from infra.BlobStream import BlobBufferView, MappedBlobStream, MemoryBlobStream
+from models.BlobDeletionSummary import BlobDeletionSummary
+from infra.HttpSession import create_shared_transport
+from services.Logger import Lazy, Logger
+from services.Metrics import count, span
 from pathlib import Path
 
+DEFAULT_BLOB_DOWNLOAD_CHUNK_BYTES = 4 * 1024 * 1024  # Size of the ranged GET requests
+DEFAULT_BLOB_DOWNLOAD_MAX_CONCURRENCY = 8  # Ranged GET requests running at the same time
+DEFAULT_BLOB_DOWNLOAD_MEMORY_LIMIT_BYTES = 64 * 1024 * 1024  # Bigger blobs are spooled to a temporary file
+DEFAULT_BLOB_UPLOAD_MAX_CONCURRENCY = 8  # Blobs uploaded at the same time by the upload helpers
+DEFAULT_BLOB_DELETE_MODE = "batch"  # "batch" uses the Blob batch API, "single" deletes every blob on its own
+DEFAULT_BLOB_DELETE_BATCH_SIZE = 256  # Max sub-requests accepted by the Blob batch API
+DEFAULT_BLOB_DELETE_MAX_CONCURRENCY = 4  # Delete batches running at the same time
+
 
 class StorageContainerService:
 
-    def __init__(self):
+    def __init__(self, credential: DefaultAzureCredential = None):
         self.download_container_name = "originaldocuments"
         self.upload_pages_container_name = "documentpages"
         self.corpus_container_name = "corpus"
         self.logging = Logger()        
         self.logging.info('SCS-INIT-01 - Running in the serve with Default Azure Credentials')
+        self.download_max_concurrency = int(os.getenv('BLOB_DOWNLOAD_MAX_CONCURRENCY', DEFAULT_BLOB_DOWNLOAD_MAX_CONCURRENCY))
+        self.download_memory_limit = int(os.getenv('BLOB_DOWNLOAD_MEMORY_LIMIT_BYTES', DEFAULT_BLOB_DOWNLOAD_MEMORY_LIMIT_BYTES))
+        download_chunk_size = int(os.getenv('BLOB_DOWNLOAD_CHUNK_BYTES', DEFAULT_BLOB_DOWNLOAD_CHUNK_BYTES))
+        self.upload_semaphore = asyncio.Semaphore(int(os.getenv('BLOB_UPLOAD_MAX_CONCURRENCY', DEFAULT_BLOB_UPLOAD_MAX_CONCURRENCY)))
+        self.delete_mode = os.getenv('BLOB_DELETE_MODE', DEFAULT_BLOB_DELETE_MODE).lower()
+        self.delete_batch_size = min(int(os.getenv('BLOB_DELETE_BATCH_SIZE', DEFAULT_BLOB_DELETE_BATCH_SIZE)), DEFAULT_BLOB_DELETE_BATCH_SIZE)
+        self.delete_semaphore = asyncio.Semaphore(int(os.getenv('BLOB_DELETE_MAX_CONCURRENCY', DEFAULT_BLOB_DELETE_MAX_CONCURRENCY)))
+        self.owns_credential = credential is None
+        self.credential = credential if credential is not None else DefaultAzureCredential()
         self.blob_service_client = BlobServiceClient(account_url=os.getenv('AZURE_STORAGE_BLOB_ENDPOINT'), 
-                                                     credential=DefaultAzureCredential())
+                                                     credential=self.credential,
+                                                     transport=create_shared_transport(),
+                                                     max_single_get_size=download_chunk_size,
+                                                     max_chunk_get_size=download_chunk_size)
+
+    async def close(self):
+        await self.blob_service_client.close()
+        if self.owns_credential:
+            await self.credential.close()
 
-    def download_blob(self, blob_name):
+    async def download_blob(self, blob_name):
+        """
+        Downloads the blob once, in parallel ranged chunks. Blobs up to the memory limit are returned
+        as a MemoryBlobStream, bigger blobs are spooled to a memory mapped MappedBlobStream.
+        The caller closes the returned stream.
+        """
         self.logging.info('SCS-DB-01 - Download blob method called')
         try:
             self.logging.info('SCS-DB-02 - Getting blob')
             
             blob_client = self.blob_service_client.get_blob_client(container=self.download_container_name, 
                                                                    blob=blob_name)
-            if not blob_client.exists():
-                self.logging.error(f"SCS-DB-03 - Blob does not exists in container.")
-                raise BlobFileDoesntExistsError()
-            
-            # Create a stream and download the blob to it
-            stream = BytesIO()
-            downloader = blob_client.download_blob()
-            downloader.readinto(stream)
+            with span("download"):
+                try:
+                    downloader = await blob_client.download_blob(max_concurrency=self.download_max_concurrency)
+                except ResourceNotFoundError:
+                    self.logging.error("SCS-DB-03 - Blob does not exists in container.")
+                    raise BlobFileDoesntExistsError()
+
+                if downloader.size <= self.download_memory_limit:
+                    stream = MemoryBlobStream()
+                    await downloader.readinto(stream)
+                else:
+                    self.logging.info("SCS-DB-05 - Spooling blob of %d bytes to a temporary file.", downloader.size)
+                    temp_file = tempfile.NamedTemporaryFile(suffix=Path(blob_name).suffix)
+                    try:
+                        await downloader.readinto(temp_file)
+                        temp_file.flush()
+                        stream = MappedBlobStream(temp_file)
+                    except Exception:
+                        temp_file.close()
+                        raise
+            stream.seek(0)
+            count("downloaded_bytes", downloader.size)
 
             self.logging.info('SCS-DB-04 - Blob downloaded with success.')
-            return blob_client.download_blob()   
+            return stream
         except Exception as e:
-            self.logging.error(f"SCS-DB-03 - Error on downloading blob: {e}")
+            self.logging.error("SCS-DB-03 - Error on downloading blob: %s", e)
             raise e
 
-    def upload_page_blob(self, container_name, data, content_type):
-        self.logging.info(f"SCS-UPB-01 - Uploading blob '{container_name}'.'")
+    async def list_original_blobs(self, prefix) -> List[str]:
+        self.logging.info("SCS-LOB-01 - Listing blobs starting with '%s' in container '%s'.", prefix, self.download_container_name)
+        container_client = self.blob_service_client.get_container_client(self.download_container_name)
+        return [blob.name async for blob in container_client.list_blobs(name_starts_with=prefix)]
+
+    async def list_corpus_blobs(self, prefix) -> List[str]:
+        self.logging.info("SCS-LCB-01 - Listing blobs starting with '%s' in container '%s'.", prefix, self.corpus_container_name)
+        container_client = self.blob_service_client.get_container_client(self.corpus_container_name)
+        return [blob.name async for blob in container_client.list_blobs(name_starts_with=prefix)]
+
+    async def upload_page_blob(self, container_name, data, content_type):
+        self.logging.info("SCS-UPB-01 - Uploading blob '%s'.", container_name)
         container_client = self.blob_service_client.get_container_client(self.upload_pages_container_name)
         cnt_settings = ContentSettings(content_type=content_type)
-        container_client.upload_blob(name=container_name, data=data, content_settings=cnt_settings, overwrite=True)
+        with span("upload"):
+            await container_client.upload_blob(name=container_name, data=data, content_settings=cnt_settings, overwrite=True)
+        count("uploaded_bytes", self.data_size(data))
         self.logging.info('SCS-UPB-02 - Blob uploaded.')
 
-    def upload_corpus_blob(self, container_name, data):
-        self.logging.info(f"SCS-UCP-01 - Uploading blob '{container_name}'.'")
+    async def upload_corpus_blob(self, container_name, data):
+        self.logging.info("SCS-UCP-01 - Uploading blob '%s'.", container_name)
         container_client = self.blob_service_client.get_container_client(self.corpus_container_name)
         cnt_settings = ContentSettings(content_type='text/plain')
-        container_client.upload_blob(name=container_name, data=data, content_settings=cnt_settings, overwrite=True)
+        with span("upload"):
+            await container_client.upload_blob(name=container_name, data=data, content_settings=cnt_settings, overwrite=True)
+        count("uploaded_bytes", self.data_size(data))
         self.logging.info('SCS-UCP-02 - Blob uploaded.')
 
-    def delete_blob(self, container_name, blob_name):
-        self.logging.info(f"SCS-DB-01 - Deleting blob '{container_name}'.'")
+    async def download_corpus_blob(self, blob_name) -> str:
+        self.logging.info("SCS-DCB-01 - Downloading corpus blob '%s'.", blob_name)
+        blob_client = self.blob_service_client.get_blob_client(container=self.corpus_container_name, blob=blob_name)
+        with span("download"):
+            downloader = await blob_client.download_blob(encoding='utf-8')
+            text = await downloader.readall()
+        count("downloaded_bytes", downloader.size)
+        return text
+
+    @staticmethod
+    def data_size(data) -> int:
+        if isinstance(data, (bytes, bytearray)):
+            return len(data)
+        if isinstance(data, (MemoryBlobStream, BlobBufferView)):
+            return data.size
+        if isinstance(data, io.BytesIO):
+            return data.getbuffer().nbytes
+        return 0
+
+    async def delete_blob(self, container_name, blob_name) -> BlobDeletionSummary:
+        self.logging.info("SCS-DB-01 - Deleting blob '%s'.'", container_name)
         container_client = self.blob_service_client.get_container_client(container_name)
-        blob_client = container_client.get_blob_client(blob_name)
-        
-        if blob_client.exists():
-            blob_client.delete_blob()
+        summary = await self.delete_one(container_client, blob_name)
+
+        if summary.deleted > 0:
             self.logging.info('SCS-DB-02 - Blob deleted.')
         else:
-            self.logging.error(f"SCS-DB-03 - Blob '{blob_name}' doesn't exist in container '{container_name}'.")
-        
-    def delete_blobs_in_folder(self, container_name, folder_name):
-        self.logging.info("SCS-DBF-01 - Deleting blobs in folder +"+folder_name+".")
+            self.logging.error("SCS-DB-03 - Blob '%s' doesn't exist in container '%s'.", blob_name, container_name)
+        return summary
+
+    async def delete_blobs_in_folder(self, container_name, folder_name) -> BlobDeletionSummary:
+        """
+        Deletes every blob under the folder, in batches of up to BLOB_DELETE_BATCH_SIZE blobs that start
+        while the folder is still being listed.
+        """
+        self.logging.info("SCS-DBF-01 - Deleting blobs in folder %s.", folder_name)
 
         container_client = self.blob_service_client.get_container_client(container_name)
         blobs = container_client.list_blobs(name_starts_with=folder_name+"/")
 
-        for blob in blobs:
-            blob_client = container_client.get_blob_client(blob.name)
-            if blob_client.exists():
-                blob_client.delete_blob()
-                self.logging.info(f"SCS-DBF-02 - Blob '{blob.name}' deleted.")
+        batches = []
+        blob_names = []
+        async for blob in blobs:
+            blob_names.append(blob.name)
+            if len(blob_names) == self.delete_batch_size:
+                batches.append(asyncio.ensure_future(self.delete_batch(container_client, blob_names)))
+                blob_names = []
+        if len(blob_names) > 0:
+            batches.append(asyncio.ensure_future(self.delete_batch(container_client, blob_names)))
+
+        summary = BlobDeletionSummary()
+        for batch_summary in await asyncio.gather(*batches):
+            summary.add(batch_summary)
+
+        self.logging.info("SCS-DBF-03 - Blobs in folder '%s' deleted in container '%s'. %s", folder_name, container_name, Lazy(summary.to_string))
+        if summary.failed > 0:
+            raise BlobDeletionError(container_name, folder_name, summary.failed)
+        return summary
+
+    async def delete_batch(self, container_client, blob_names) -> BlobDeletionSummary:
+        summary = BlobDeletionSummary()
+        async with self.delete_semaphore:
+            if self.delete_mode == "batch":
+                responses = await container_client.delete_blobs(*blob_names, raise_on_any_failure=False)
+                async for blob_name, response in self.zip_responses(blob_names, responses):
+                    if response.status_code == 202:
+                        summary.deleted += 1
+                    elif response.status_code == 404:
+                        summary.missing += 1
+                    else:
+                        self.logging.error("SCS-DBF-04 - Error deleting blob '%s', status code %s.", blob_name, response.status_code)
+                        summary.failed += 1
             else:
-                self.logging.error(f"SCS-DBF-03 - Blob '{blob.name}' doesn't exist in container '{container_name}'.")
+                for blob_summary in await asyncio.gather(*[self.delete_one(container_client, blob_name) for blob_name in blob_names]):
+                    summary.add(blob_summary)
+
+        self.logging.info("SCS-DBF-02 - Deleted batch of %d blobs. %s", len(blob_names), Lazy(summary.to_string))
+        return summary
+
+    async def delete_one(self, container_client, blob_name) -> BlobDeletionSummary:
+        try:
+            await container_client.delete_blob(blob_name)
+            return BlobDeletionSummary(deleted=1)
+        except ResourceNotFoundError:
+            return BlobDeletionSummary(missing=1)
+
+    @staticmethod
+    async def zip_responses(blob_names, responses):
+        # The batch responses come back in the order of the blobs
+        index = 0
+        async for response in responses:
+            yield blob_names[index], response
+            index += 1
+
+    async def upload_page_blobs(self, blobs: List[Tuple[str, object, str]]):
+        """
+        Uploads (blob name, data, content type) page blobs concurrently.
+        """
+        await asyncio.gather(*[self.upload_with_limit(self.upload_page_blob, *blob) for blob in blobs])
+
+    async def upload_corpus_blobs(self, blobs: List[Tuple[str, object]]):
+        """
+        Uploads (blob name, data) corpus blobs concurrently.
+        """
+        await asyncio.gather(*[self.upload_with_limit(self.upload_corpus_blob, *blob) for blob in blobs])
 
-        self.logging.info(f"SCS-DBF-03 - Blobs in folder '{folder_name}' deleted in container '{container_name}'.")
\ No newline at end of file
+    async def upload_with_limit(self, upload, *args):
+        async with self.upload_semaphore:
+            await upload(*args)
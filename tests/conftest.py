@@ -0,0 +1,9 @@
+import logging
+import os
+import sys
+
+# The tests import the function modules from the repository root, i.e. handlers.TextSplitterHandler
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A handler on the root logger keeps Logger from exporting to Application Insights
+logging.basicConfig(level=logging.WARNING)
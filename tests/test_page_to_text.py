@@ -0,0 +1,198 @@
+"""
+The interval sweep of AzureSearchEmbedService.page_to_text gives the same page text as the per character loop it replaced.
+"""
+import html
+import random
+from typing import List
+
+import pytest
+from azure.ai.documentintelligence.models import (
+    AnalyzeResult,
+    BoundingRegion,
+    DocumentPage,
+    DocumentSpan,
+    DocumentTable,
+    DocumentTableCell,
+)
+
+from services.AzureSearchEmbedService import AzureSearchEmbedService
+
+WORDS = ["Receita", "líquida", "EBITDA", "Lucro", "R$", "2024", "<b>", "a & b", "\"x\""]
+
+
+def baseline_table_to_html(table: DocumentTable) -> str:
+    # table_to_html before the rows were grouped in a single pass, kept as the reference
+    table_html = "<table>"
+    rows = [
+        sorted([cell for cell in table.cells if cell.row_index == i], key=lambda cell: cell.column_index)
+        for i in range(table.row_count)
+    ]
+    for row_cells in rows:
+        table_html += "<tr>"
+        for cell in row_cells:
+            tag = "th" if (cell.kind == "columnHeader" or cell.kind == "rowHeader") else "td"
+            cell_spans = ""
+            if cell.column_span is not None and cell.column_span > 1:
+                cell_spans += f" colSpan={cell.column_span}"
+            if cell.row_span is not None and cell.row_span > 1:
+                cell_spans += f" rowSpan={cell.row_span}"
+            table_html += f"<{tag}{cell_spans}>{html.escape(cell.content)}</{tag}>"
+        table_html += "</tr>"
+    table_html += "</table>"
+    return table_html
+
+
+def baseline_page_texts(form_recognizer_results: AnalyzeResult) -> List[str]:
+    # The per character loop of get_document_text before the interval sweep, kept as the reference
+    page_texts = []
+    for page_num, page in enumerate(form_recognizer_results.pages):
+        tables_on_page = [
+            table
+            for table in (form_recognizer_results.tables or [])
+            if table.bounding_regions and table.bounding_regions[0].page_number == page_num + 1
+        ]
+
+        page_offset = page.spans[0].offset
+        page_length = page.spans[0].length
+        table_chars = [-1] * page_length
+        for table_id, table in enumerate(tables_on_page):
+            for span in table.spans:
+                for i in range(span.length):
+                    idx = span.offset - page_offset + i
+                    if idx >= 0 and idx < page_length:
+                        table_chars[idx] = table_id
+
+        page_text = ""
+        added_tables = set()
+        for idx, table_id in enumerate(table_chars):
+            if table_id == -1:
+                page_text += form_recognizer_results.content[page_offset + idx]
+            elif table_id not in added_tables:
+                page_text += baseline_table_to_html(tables_on_page[table_id])
+                added_tables.add(table_id)
+        page_texts.append(page_text)
+    return page_texts
+
+
+def page_texts(form_recognizer_results: AnalyzeResult) -> List[str]:
+    tables_by_page = AzureSearchEmbedService.group_tables_by_page(form_recognizer_results)
+    return [AzureSearchEmbedService.page_to_text(form_recognizer_results, page, tables_by_page) for page in form_recognizer_results.pages]
+
+
+def cell(random_generator: random.Random, row: int, column: int, **spans) -> DocumentTableCell:
+    return DocumentTableCell(row_index=row, column_index=column, content=" ".join(random_generator.choice(WORDS) for _ in range(random_generator.randint(0, 3))),
+                             kind=random_generator.choice([None, "content", "columnHeader", "rowHeader", "stubHead"]), **spans)
+
+
+def table(random_generator: random.Random, page_number: int, spans: List[tuple], rows: int = 3, columns: int = 3) -> DocumentTable:
+    cells = []
+    for row in range(rows):
+        for column in range(columns):
+            spans_of_cell = {}
+            if random_generator.random() < 0.2:
+                spans_of_cell["column_span"] = random_generator.randint(1, 3)
+            if random_generator.random() < 0.2:
+                spans_of_cell["row_span"] = random_generator.randint(1, 3)
+            cells.append(cell(random_generator, row, column, **spans_of_cell))
+    random_generator.shuffle(cells)
+    return DocumentTable(row_count=rows, column_count=columns, cells=cells,
+                         bounding_regions=[BoundingRegion(page_number=page_number, polygon=[])],
+                         spans=[DocumentSpan(offset=offset, length=length) for offset, length in spans])
+
+
+def result(content: str, page_lengths: List[int], tables: List[DocumentTable]) -> AnalyzeResult:
+    pages = []
+    offset = 0
+    for page_number, page_length in enumerate(page_lengths, start=1):
+        pages.append(DocumentPage(page_number=page_number, spans=[DocumentSpan(offset=offset, length=page_length)]))
+        offset += page_length
+    return AnalyzeResult(content=content, pages=pages, tables=tables)
+
+
+def text(random_generator: random.Random, length: int) -> str:
+    return "".join(random_generator.choice("abcdefghij .,\n") for _ in range(length))
+
+
+def test_pages_without_tables():
+    random_generator = random.Random(0)
+    analyze_result = result(text(random_generator, 300), [100, 0, 150, 50], [])
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
+
+
+def test_tables_on_some_pages():
+    random_generator = random.Random(1)
+    tables = [table(random_generator, 1, [(20, 30)]), table(random_generator, 3, [(210, 40)])]
+    analyze_result = result(text(random_generator, 300), [100, 100, 100], tables)
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
+
+
+def test_adjacent_tables():
+    random_generator = random.Random(2)
+    tables = [table(random_generator, 1, [(10, 20)]), table(random_generator, 1, [(30, 20)]), table(random_generator, 1, [(50, 50)])]
+    analyze_result = result(text(random_generator, 100), [100], tables)
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
+
+
+@pytest.mark.parametrize("spans", [
+    [[(10, 40)], [(30, 40)]],  # The later table wins where they overlap
+    [[(30, 40)], [(10, 40)]],
+    [[(10, 80)], [(20, 10)]],  # A table inside another one
+    [[(20, 10)], [(10, 80)]],
+    [[(10, 10), (50, 10)], [(15, 40)]],  # A table with many spans around another one
+    [[(10, 30)], [(10, 30)]],  # Tables over the same characters
+])
+def test_overlapping_tables(spans):
+    random_generator = random.Random(3)
+    tables = [table(random_generator, 1, table_spans) for table_spans in spans]
+    analyze_result = result(text(random_generator, 100), [100], tables)
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
+
+
+def test_table_spans_outside_of_their_page():
+    # Spans starting on the previous page or going past the end of the page are cut at the page edges
+    random_generator = random.Random(4)
+    tables = [table(random_generator, 2, [(80, 40)]), table(random_generator, 2, [(180, 50)]), table(random_generator, 2, [(0, 10)])]
+    analyze_result = result(text(random_generator, 300), [100, 100, 100], tables)
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
+
+
+def test_row_and_column_spans():
+    random_generator = random.Random(5)
+    cells = [
+        cell(random_generator, 0, 0, column_span=2),
+        cell(random_generator, 0, 2, row_span=2),
+        cell(random_generator, 1, 0, row_span=1, column_span=1),
+        cell(random_generator, 1, 1),
+        cell(random_generator, 2, 0, row_span=3, column_span=3),
+        cell(random_generator, 7, 0),  # Outside of the rows of the table
+    ]
+    spanned_table = DocumentTable(row_count=3, column_count=3, cells=cells,
+                                  bounding_regions=[BoundingRegion(page_number=1, polygon=[])], spans=[DocumentSpan(offset=5, length=50)])
+    analyze_result = result(text(random_generator, 100), [100], [spanned_table])
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
+    assert AzureSearchEmbedService.table_to_html(spanned_table) == baseline_table_to_html(spanned_table)
+
+
+def test_tables_without_bounding_regions_are_ignored():
+    random_generator = random.Random(6)
+    unplaced_table = table(random_generator, 1, [(10, 20)])
+    unplaced_table.bounding_regions = None
+    analyze_result = result(text(random_generator, 100), [100], [unplaced_table, table(random_generator, 1, [(40, 20)])])
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_random_results_match_baseline(seed):
+    random_generator = random.Random(seed)
+    page_lengths = [random_generator.choice([0, 1, 50, 200]) for _ in range(random_generator.randint(1, 5))]
+    content_length = sum(page_lengths)
+    tables = []
+    for _ in range(random_generator.randint(0, 8)):
+        spans = []
+        for _ in range(random_generator.randint(1, 3)):
+            offset = random_generator.randint(0, max(content_length - 1, 0))
+            spans.append((offset, random_generator.randint(0, 60)))
+        tables.append(table(random_generator, random_generator.randint(1, len(page_lengths)), spans,
+                            rows=random_generator.randint(0, 4), columns=random_generator.randint(1, 4)))
+    analyze_result = result(text(random_generator, content_length), page_lengths, tables)
+    assert page_texts(analyze_result) == baseline_page_texts(analyze_result)
@@ -0,0 +1,179 @@
+"""
+The regex and streaming splitter of TextSplitterHandler gives the same sections as the character loop it replaced.
+"""
+import random
+import re
+from typing import List
+
+import pytest
+
+from handlers.TextSplitterHandler import TextSplitterHandler
+from models.Message import Message
+from models.PageDetail import PageDetail
+
+PAGE_FULL_PATH = "theme/subtheme/Report/Report-1.pdf"
+MESSAGE = Message(dict(action="index", fileId="test", storageFilePath="theme/subtheme/Report.pdf", fileName="Report.pdf",
+                       originalFileFormat="pdf", theme="theme", subtheme="subtheme", language="port"))
+WORDS = ["receita", "líquida", "EBITDA", "trimestre", "resultado", "market", "share", "dividend", "2024", "R$", "1.234,56", "収益", "配当"]
+ENDINGS = [". ", "; ", ", ", "! ", "? ", "\n", "。", "、", "（注）", " - "]
+
+
+def baseline_split_pages(handler: TextSplitterHandler, page_full_path: str, message: Message, pages: List[PageDetail]):
+    # The character loop of split_pages before the regex searches, kept as the reference
+    all_text = "".join(page.Text for page in pages)
+    if len(all_text.strip()) == 0:
+        return
+    page_sections = []
+    length = len(all_text)
+    start = 0
+    end = length
+    while start + handler.section_overlap < length:
+        last_word = -1
+        end = start + handler.max_section_length
+
+        if end > length:
+            end = length
+        else:
+            while (
+                end < length
+                and (end - start - handler.max_section_length) < handler.sentence_search_limit
+                and all_text[end] not in handler.sentence_endings
+            ):
+                if all_text[end] in handler.word_breaks:
+                    last_word = end
+                end += 1
+            if end < length and all_text[end] not in handler.sentence_endings and last_word > 0:
+                end = last_word
+        if end < length:
+            end += 1
+
+        last_word = -1
+        while (
+            start > 0
+            and start > end - handler.max_section_length - 2 * handler.sentence_search_limit
+            and all_text[start] not in handler.sentence_endings
+        ):
+            if all_text[start] in handler.word_breaks:
+                last_word = start
+            start -= 1
+        if all_text[start] not in handler.sentence_endings and last_word > 0:
+            start = last_word
+        if start > 0:
+            start += 1
+
+        section_text = all_text[start:end]
+        page_sections.append((re.sub(r'[^0-9a-zA-Z_-]', '_', f'{page_full_path}-{start}').lstrip('_'), section_text))
+
+        last_table_start = section_text.rfind("<table")
+        if last_table_start > 2 * handler.sentence_search_limit and last_table_start > section_text.rfind("</table"):
+            start = min(end - handler.section_overlap, start + last_table_start)
+        else:
+            start = end - handler.section_overlap
+
+    if start + handler.section_overlap < end:
+        page_sections.append((re.sub(r'[^0-9a-zA-Z_-]', '_', f'{page_full_path}-{start}').lstrip('_'), section_text))
+    return page_sections
+
+
+def as_tuples(sections):
+    if sections is None:
+        return None
+    return [(section.id, section.content) for section in sections]
+
+
+def pages_of(text: str, lengths: List[int]) -> List[PageDetail]:
+    # Splits the text into pages of the given lengths, the last page has the rest of the text
+    pages = []
+    offset = 0
+    for index, page_length in enumerate(lengths):
+        pages.append(PageDetail(index, offset, text[offset:offset + page_length]))
+        offset += page_length
+    pages.append(PageDetail(len(lengths), offset, text[offset:]))
+    return pages
+
+
+def random_text(random_generator: random.Random, size: int, table_every: int = 0) -> str:
+    parts = []
+    written = 0
+    sentence = 0
+    while written < size:
+        part = " ".join(random_generator.choice(WORDS) for _ in range(random_generator.randint(1, 40))) + random_generator.choice(ENDINGS)
+        sentence += 1
+        if table_every > 0 and sentence % table_every == 0:
+            rows = "".join(f"<tr><td>{random_generator.choice(WORDS)}</td></tr>" for _ in range(random_generator.randint(1, 120)))
+            # Some tables are left unclosed at the end of the section
+            part += "<table>" + rows + random_generator.choice(["</table>", ""])
+        parts.append(part)
+        written += len(part)
+    return "".join(parts)[:size]
+
+
+def assert_same_sections(pages: List[PageDetail]):
+    handler = TextSplitterHandler()
+    expected = baseline_split_pages(handler, PAGE_FULL_PATH, MESSAGE, pages)
+
+    assert as_tuples(handler.split_pages(PAGE_FULL_PATH, MESSAGE, pages)) == expected
+
+    # Pages added one at a time, the way embed_blob splits the pages as they are analyzed
+    section_splitter = handler.section_splitter(PAGE_FULL_PATH, MESSAGE)
+    streamed = []
+    for page in pages:
+        streamed += section_splitter.add_page(page)
+    streamed += section_splitter.finish()
+    assert as_tuples(streamed) == (expected or [])
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_text_matches_baseline(seed):
+    random_generator = random.Random(seed)
+    text = random_text(random_generator, random_generator.randint(1, 12000), table_every=random_generator.choice([0, 3, 10]))
+    lengths = [random_generator.choice([0, 1, 50, 99, 100, 101, 900, 1000, 1001, 1100, 2500]) for _ in range(random_generator.randint(0, 8))]
+    assert_same_sections(pages_of(text, lengths))
+
+
+@pytest.mark.parametrize("size", [1, 99, 100, 101, 999, 1000, 1001, 1099, 1100, 1101, 1200, 1900, 2000, 2105, 5000])
+def test_text_without_sentence_endings(size):
+    text = " ".join(["palavra"] * size)[:size]
+    assert_same_sections(pages_of(text, []))
+    # The start search of the last section looks further back than the text kept between pages
+    assert_same_sections(pages_of(text, [100] * (size // 100)))
+
+
+@pytest.mark.parametrize("size", [1, 100, 1000, 1001, 1100, 1101, 3500])
+def test_text_without_any_boundary(size):
+    assert_same_sections(pages_of("a" * size, [size // 3]))
+
+
+@pytest.mark.parametrize("end", [999, 1000, 1001, 1099, 1100, 1101])
+def test_boundary_at_the_end_of_the_text(end):
+    # A sentence ending as the last character, right at or around the max section length
+    text = ("lorem ipsum " * 200)[:end - 1] + "."
+    assert_same_sections(pages_of(text, []))
+    assert_same_sections(pages_of(text + " ", [end]))
+
+
+@pytest.mark.parametrize("page_length", [1, 99, 100, 101, 899, 900, 901, 999, 1000, 1001, 1100])
+def test_overlap_at_page_edges(page_length):
+    # Page edges falling on the section ends, and on the overlap the next section starts in
+    random_generator = random.Random(page_length)
+    text = random_text(random_generator, 6000)
+    assert_same_sections(pages_of(text, [page_length] * (6000 // page_length)))
+
+
+def test_empty_pages_between_pages():
+    text = random_text(random.Random(1), 3000)
+    assert_same_sections(pages_of(text, [0, 0, 1000, 0, 1000, 0]))
+
+
+@pytest.mark.parametrize("text", ["", " ", "\n\n\t", "   " * 500])
+def test_text_without_content_has_no_sections(text):
+    handler = TextSplitterHandler()
+    pages = pages_of(text, [1])
+    assert handler.split_pages(PAGE_FULL_PATH, MESSAGE, pages) is None
+    assert baseline_split_pages(handler, PAGE_FULL_PATH, MESSAGE, pages) is None
+    assert_same_sections(pages)
+
+
+def test_unclosed_table_starts_the_next_section():
+    text = "Resultado do trimestre. " * 20 + "<table>" + "<tr><td>receita</td></tr>" * 200
+    assert_same_sections(pages_of(text, [700, 700]))
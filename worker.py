@@ -0,0 +1,92 @@
+"""
+Standalone worker running the processors outside of the Functions host, i.e. for bulk loads.
+
+Drain the queue of ActionReceivedFunc, stopping once it stays empty for 60 seconds:
+    python worker.py queue --concurrency 8 --processes 2 --idle-exit 60
+
+Index all the documents of a theme or subtheme in the originaldocuments container:
+    python worker.py backfill --prefix manualsoperations/counter/ --concurrency 8 --processes 2
+
+Both print a throughput report (docs/min, pages/min) at the end.
+"""
+import argparse
+import asyncio
+import dataclasses
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+DEFAULT_WORKER_CONCURRENCY = 4  # Messages processed at the same time by every worker process
+DEFAULT_WORKER_PROCESSES = 1
+
+
+async def run_worker(args, part_index: int) -> dict:
+    # Imported in the worker process, after the environment is loaded
+    from processors.ProcessorBuilder import close_processor_builder
+    from workers.BackfillWorker import BackfillWorker
+    from workers.QueueWorker import QueueWorker
+
+    if args.mode == "queue":
+        worker = QueueWorker(concurrency=args.concurrency, idle_exit_seconds=args.idle_exit)
+    else:
+        worker = BackfillWorker(prefix=args.prefix, language=args.language, concurrency=args.concurrency,
+                                part_index=part_index, part_count=args.processes,
+                                skip_indexed=args.skip_indexed, dry_run=args.dry_run)
+    try:
+        return dataclasses.asdict(await worker.run())
+    finally:
+        await close_processor_builder()
+
+
+def worker_process(args, part_index: int, reports: multiprocessing.Queue):
+    from services.Logger import stop_log_listener
+
+    load_dotenv()
+    if args.timeout is None:
+        # No function timeout outside of the host, documents are never continued in a new message
+        os.environ['FUNCTION_TIMEOUT_SECONDS'] = "inf"
+    else:
+        os.environ['FUNCTION_TIMEOUT_SECONDS'] = str(args.timeout)
+    try:
+        reports.put(asyncio.run(run_worker(args, part_index)))
+    finally:
+        # The exit handlers don't run in multiprocessing workers
+        stop_log_listener()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["queue", "backfill"])
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_WORKER_CONCURRENCY, help="Messages processed at the same time by every process")
+    parser.add_argument("--processes", type=int, default=DEFAULT_WORKER_PROCESSES, help="Worker processes")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds after which a document is continued in a new queue message, none by default")
+    parser.add_argument("--idle-exit", type=float, default=None, help="queue: stop once the queue is empty for this many seconds, runs until stopped by default")
+    parser.add_argument("--prefix", default="", help="backfill: path prefix of the documents in the originaldocuments container, i.e. <theme>/<subtheme>/")
+    parser.add_argument("--language", default="port", help="backfill: language of the documents that don't record one")
+    parser.add_argument("--skip-indexed", action="store_true", help="backfill: skip the documents already indexed")
+    parser.add_argument("--dry-run", action="store_true", help="backfill: only log the messages that would be processed")
+    args = parser.parse_args()
+
+    # The PDF split process pool of every worker process is created in that process
+    context = multiprocessing.get_context("spawn")
+    reports = context.Queue()
+    processes = [context.Process(target=worker_process, args=(args, part_index, reports)) for part_index in range(max(args.processes, 1))]
+    for process in processes:
+        process.start()
+
+    from models.WorkerReport import WorkerReport
+    report = WorkerReport()
+    for process in processes:
+        process.join()
+    failed_processes = [process.pid for process in processes if process.exitcode != 0]
+    for _ in range(len(processes) - len(failed_processes)):
+        report.add(WorkerReport(**reports.get(timeout=10)))
+
+    print(f"{args.mode} worker: {report.to_string()}")
+    if len(failed_processes) > 0:
+        print(f"Worker processes {failed_processes} exited with an error.")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+from models.IndexStatus import IndexStatus
+from models.WorkerReport import WorkerReport
+from processors.ProcessorBuilder import get_processor_builder
+from services.Logger import Lazy
+from workers.Worker import Worker
+
+SUPPORTED_FILE_FORMATS = ["pdf", "docx"]
+
+
+class BackfillWorker(Worker):
+    """
+    Indexes the documents of the originaldocuments container whose path starts with prefix, i.e. all the
+    documents of a theme or subtheme, without going through the queue.
+
+    Every blob is matched with its document in the Document metadata store by storageFilePath, the blobs
+    without a document are skipped. Worker processes split the blobs by position with part_index and part_count.
+    """
+
+    def __init__(self, prefix: str, language: str, concurrency: int, part_index: int = 0, part_count: int = 1,
+                 skip_indexed: bool = False, dry_run: bool = False):
+        super().__init__(concurrency)
+        self.prefix = prefix
+        self.language = language
+        self.part_index = part_index
+        self.part_count = max(part_count, 1)
+        self.skip_indexed = skip_indexed
+        self.dry_run = dry_run
+
+    async def run(self) -> WorkerReport:
+        processor_builder = await get_processor_builder()
+        blob_names = await processor_builder.storage_container_service.list_original_blobs(self.prefix)
+        blob_names = [blob_name for blob_name in sorted(blob_names)[self.part_index::self.part_count]
+                      if self.file_format(blob_name) in SUPPORTED_FILE_FORMATS]
+        self.logger.info("BW-RN-01 - Backfilling %d documents starting with '%s', part %d of %d, with %d consumers.",
+                         len(blob_names), self.prefix, self.part_index + 1, self.part_count, self.concurrency)
+
+        pending = asyncio.Queue()
+        for blob_name in blob_names:
+            pending.put_nowait(blob_name)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[self.consume(pending) for _ in range(self.concurrency)])
+        self.report.elapsed_seconds = time.perf_counter() - started
+
+        self.logger.info("BW-RN-02 - Backfill done. %s", Lazy(self.report.to_string))
+        return self.report
+
+    async def consume(self, pending: asyncio.Queue):
+        while not pending.empty():
+            blob_name = pending.get_nowait()
+            try:
+                message = await self.build_message(blob_name)
+                if message is None:
+                    continue
+                if self.dry_run:
+                    self.logger.info("BW-CN-01 - Would index %s: %s", blob_name, message)
+                    continue
+                result = await self.process(message)
+            except Exception as e:
+                self.logger.error("BW-CN-02 - Error indexing %s. Error: %s", blob_name, e)
+                self.report.failed += 1
+                continue
+            self.report.add_message(result)
+
+    async def build_message(self, blob_name: str) -> dict:
+        processor_builder = await get_processor_builder()
+        document = await processor_builder.cosmos_repository.get_by_storage_file_path("documentskb", blob_name)
+        if document is None:
+            self.logger.error("BW-BM-01 - No document found with storageFilePath %s, skipping it.", blob_name)
+            return None
+        if self.skip_indexed and document.get("indexStatus") == IndexStatus.INDEXED.value:
+            self.logger.info("BW-BM-02 - Document %s is already indexed, skipping it.", blob_name)
+            return None
+
+        # The documents are stored as <theme>/<subtheme>/<file name>
+        path_parts = blob_name.split("/")
+        return {
+            "action": "index",
+            "fileId": document["id"],
+            "storageFilePath": blob_name,
+            "fileName": os.path.basename(blob_name),
+            "originalFileFormat": self.file_format(blob_name),
+            "theme": document.get("theme") or path_parts[0],
+            "subtheme": document.get("subtheme") or (path_parts[1] if len(path_parts) > 2 else ""),
+            "language": document.get("language") or self.language
+        }
+
+    @staticmethod
+    def file_format(blob_name: str) -> str:
+        return os.path.splitext(blob_name)[1].lstrip(".").lower()
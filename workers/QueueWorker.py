@@ -0,0 +1,93 @@
+import asyncio
+import contextlib
+import os
+import time
+from azure.storage.queue import QueueMessage
+from models.WorkerReport import WorkerReport
+from processors.ProcessorBuilder import get_processor_builder
+from services.Logger import Lazy
+from services.QueueService import QueueService
+from workers.Worker import Worker
+
+DEFAULT_WORKER_VISIBILITY_TIMEOUT_SECONDS = 60  # Messages in process are kept hidden for this long, renewed at half of it
+DEFAULT_WORKER_RETRY_DELAY_SECONDS = 15  # visibilityTimeout of host.json, a failed message is retried after it
+DEFAULT_WORKER_MAX_DEQUEUE_COUNT = 3  # maxDequeueCount of host.json, then the message is moved to the poison queue
+DEFAULT_WORKER_MAX_POLLING_INTERVAL_SECONDS = 30  # maxPollingInterval of host.json
+MIN_POLLING_INTERVAL_SECONDS = 0.1
+
+
+class QueueWorker(Worker):
+    """
+    Drains the queue of ActionReceivedFunc with the retry and poison queue behaviour of host.json.
+    Every consumer polls the queue with an exponential backoff while it is empty, and the worker
+    stops once all the consumers found the queue empty for idle_exit_seconds, when given.
+    """
+
+    def __init__(self, concurrency: int, idle_exit_seconds: float = None):
+        super().__init__(concurrency)
+        self.idle_exit_seconds = idle_exit_seconds
+        self.visibility_timeout = int(os.getenv('WORKER_VISIBILITY_TIMEOUT_SECONDS', DEFAULT_WORKER_VISIBILITY_TIMEOUT_SECONDS))
+        self.retry_delay = int(os.getenv('WORKER_RETRY_DELAY_SECONDS', DEFAULT_WORKER_RETRY_DELAY_SECONDS))
+        self.max_dequeue_count = int(os.getenv('WORKER_MAX_DEQUEUE_COUNT', DEFAULT_WORKER_MAX_DEQUEUE_COUNT))
+        self.max_polling_interval = float(os.getenv('WORKER_MAX_POLLING_INTERVAL_SECONDS', DEFAULT_WORKER_MAX_POLLING_INTERVAL_SECONDS))
+
+    async def run(self) -> WorkerReport:
+        processor_builder = await get_processor_builder()
+        queue_service = processor_builder.queue_service
+        self.logger.info("QW-RN-01 - Draining queue '%s' with %d consumers.", queue_service.queue_name, self.concurrency)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[self.consume(queue_service) for _ in range(self.concurrency)])
+        self.report.elapsed_seconds = time.perf_counter() - started
+
+        self.logger.info("QW-RN-02 - Queue worker done. %s", Lazy(self.report.to_string))
+        return self.report
+
+    async def consume(self, queue_service: QueueService):
+        polling_interval = MIN_POLLING_INTERVAL_SECONDS
+        last_message_at = time.monotonic()
+        while True:
+            queue_message = await queue_service.receive_message(visibility_timeout=self.visibility_timeout)
+            if queue_message is None:
+                if self.idle_exit_seconds is not None and time.monotonic() - last_message_at >= self.idle_exit_seconds:
+                    return
+                await asyncio.sleep(polling_interval)
+                polling_interval = min(polling_interval * 2, self.max_polling_interval)
+                continue
+
+            polling_interval = MIN_POLLING_INTERVAL_SECONDS
+            await self.handle(queue_service, queue_message)
+            last_message_at = time.monotonic()
+
+    async def handle(self, queue_service: QueueService, queue_message: QueueMessage):
+        renewal = asyncio.ensure_future(self.keep_hidden(queue_service, queue_message))
+        try:
+            result = await self.process(queue_message.content)
+        except Exception as e:
+            self.logger.error("QW-HD-01 - Error processing message %s, attempt %d. Error: %s", queue_message.id, queue_message.dequeue_count, e)
+            self.report.failed += 1
+            await self.stop_renewal(renewal)
+            if queue_message.dequeue_count >= self.max_dequeue_count:
+                await queue_service.move_to_poison_queue(queue_message)
+            else:
+                await queue_service.update_visibility(queue_message, self.retry_delay)
+            return
+
+        await self.stop_renewal(renewal)
+        await queue_service.delete_message(queue_message)
+        self.report.add_message(result)
+
+    async def keep_hidden(self, queue_service: QueueService, queue_message: QueueMessage):
+        # Messages can take longer than the visibility timeout, the Functions host renews it the same way
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+            try:
+                await queue_service.update_visibility(queue_message, self.visibility_timeout)
+            except Exception as e:
+                self.logger.error("QW-KH-01 - Error renewing the visibility of message %s. Error: %s", queue_message.id, e)
+
+    @staticmethod
+    async def stop_renewal(renewal: asyncio.Future):
+        renewal.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await renewal
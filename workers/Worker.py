@@ -0,0 +1,27 @@
+import json
+from typing import Union
+from builders.MessageBuilder import MessageBuilder
+from models.MessageResult import MessageResult
+from models.WorkerReport import WorkerReport
+from processors.ProcessorBuilder import get_processor_builder
+from services.Logger import Logger
+
+
+class Worker:
+    """
+    Processes messages outside of the Functions host with the same MessageBuilder, ProcessorBuilder
+    and Processor as ActionReceivedFunc, up to concurrency messages at the same time.
+    """
+
+    def __init__(self, concurrency: int):
+        self.logger = Logger()
+        self.concurrency = max(concurrency, 1)
+        self.report = WorkerReport()
+
+    async def process(self, content: Union[str, dict]) -> MessageResult:
+        message_dict = json.loads(content) if isinstance(content, str) else content
+        message = MessageBuilder(message_dict).build()
+        # The clients are created by the first message and reused by the next ones
+        processor_builder = await get_processor_builder()
+        async with processor_builder.processor(message=message) as processor:
+            return await processor.process()